@@ -0,0 +1,70 @@
+"""Utilidades compartidas por los benchmarks: carga del agente y medición"""
+
+import importlib.util
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_PATH = os.path.join(REPO_ROOT, "import.py")
+
+# fake_services vive en la raíz del repo
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def load_agent_module(**env):
+    """Importa import.py (nombre reservado en Python) como módulo 'agent_app'"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("WEBHOOK_MODE", "sync")
+    for key, value in env.items():
+        os.environ[key] = str(value)
+    if "agent_app" in sys.modules:
+        return sys.modules["agent_app"]
+    spec = importlib.util.spec_from_file_location("agent_app", AGENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["agent_app"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(func, inputs, iterations=1000, warmup=50):
+    """Ejecuta func sobre inputs en bucle y devuelve ops/s, p50 y p99 (µs)"""
+    inputs = list(inputs)
+    for i in range(warmup):
+        func(inputs[i % len(inputs)])
+    samples = []
+    perf = time.perf_counter
+    for i in range(iterations):
+        arg = inputs[i % len(inputs)]
+        started = perf()
+        func(arg)
+        samples.append(perf() - started)
+    samples.sort()
+    total = sum(samples)
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / total, 1) if total else float("inf"),
+        "mean_us": round(statistics.fmean(samples) * 1e6, 2),
+        "p50_us": round(percentile(samples, 50) * 1e6, 2),
+        "p99_us": round(percentile(samples, 99) * 1e6, 2),
+    }
+
+
+def print_table(title, rows):
+    width = max([28] + [len(name) + 2 for name, _ in rows])
+    print(f"\n{title}")
+    print(f"{'caso':<{width}}{'ops/s':>14}{'p50 µs':>12}{'p99 µs':>12}")
+    for name, result in rows:
+        print(
+            f"{name:<{width}}{result['ops_per_sec']:>14,.1f}"
+            f"{result['p50_us']:>12.2f}{result['p99_us']:>12.2f}"
+        )
@@ -0,0 +1,133 @@
+"""Sustitutos en proceso de OpenAI, Twilio, Cal.com y Google Sheets para los benchmarks
+
+Nada sale a la red: cada fake responde en memoria con la forma que espera el
+agente, opcionalmente tras una latencia simulada.
+"""
+
+import itertools
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytz
+
+from fake_services import extract_fields
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, payload=None, text=None):
+        self.status_code = status_code
+        self._payload = payload if payload is not None else {}
+        self.text = text if text is not None else json.dumps(self._payload)
+        self.headers = {"Content-Type": "application/json"}
+
+    def json(self):
+        return self._payload
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeOpenAI:
+    """Imita client.chat.completions.create con una extracción JSON determinista"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model=None, messages=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = messages[-1]["content"].split(":", 1)[-1].strip()
+        content = json.dumps(extract_fields(text))
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeTransport:
+    """Sustituye http_transport: Twilio Messages.json, Cal.com availability/bookings y probes"""
+
+    def __init__(self, latency=0.0, timezone="America/New_York"):
+        self.latency = latency
+        self.timezone = pytz.timezone(timezone)
+        self.counts = {"twilio": 0, "cal": 0, "media": 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def request(self, upstream, method, url, **kwargs):
+        with self._lock:
+            self.counts[upstream] = self.counts.get(upstream, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if upstream == "twilio":
+            return FakeResponse(201, {"sid": f"SMfake{next(self._ids)}", "status": "queued"})
+        if upstream == "probe":
+            return FakeResponse(200, {})
+        if upstream == "cal" and method.upper() == "GET":
+            return FakeResponse(200, {"slots": self._slots(kwargs.get("params") or {})})
+        if upstream == "cal":
+            return FakeResponse(201, {"status": "success", "data": {"uid": f"bk{next(self._ids)}"}})
+        return FakeResponse(404, {"error": "not found"})
+
+    def get(self, upstream, url, **kwargs):
+        return self.request(upstream, "GET", url, **kwargs)
+
+    def post(self, upstream, url, **kwargs):
+        return self.request(upstream, "POST", url, **kwargs)
+
+    def _slots(self, params):
+        """Slots cada hora de 9:00 a 17:00, en formato {día: [{"time": ...}]}"""
+        start = datetime.strptime(params.get("startDate", "2025-01-01"), "%Y-%m-%d")
+        end = datetime.strptime(params.get("endDate", "2025-01-08"), "%Y-%m-%d")
+        slots = {}
+        day = start
+        while day <= end:
+            slots[day.strftime("%Y-%m-%d")] = [
+                {"time": self.timezone.localize(day.replace(hour=hour)).isoformat()}
+                for hour in range(9, 18)
+            ]
+            day += timedelta(days=1)
+        return slots
+
+    def stats(self):
+        return dict(self.counts)
+
+
+class FakeSheets:
+    def __init__(self):
+        self.rows = []
+
+    def save_booking_data(self, **row):
+        self.rows.append(row)
+        return True
+
+    def flush(self):
+        return True
+
+    def stats(self):
+        return {"rows": len(self.rows)}
+
+
+def make_fakes(timezone, llm_latency=0.0, http_latency=0.0):
+    """Fakes de los clientes externos y los componentes de create_app() que los usan"""
+    fakes = SimpleNamespace(
+        openai=FakeOpenAI(llm_latency),
+        transport=FakeTransport(http_latency, timezone),
+        sheets=FakeSheets(),
+    )
+    fakes.components = {
+        "openai_client": fakes.openai,
+        "http_transport": fakes.transport,
+        "sheets_integration": fakes.sheets,
+    }
+    return fakes
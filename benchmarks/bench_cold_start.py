@@ -0,0 +1,136 @@
+"""Presupuesto de arranque en frío: importar import.py y servir el primer /health
+
+Cada ronda es un intérprete nuevo que mide:
+  - tiempo de importación del módulo (parseo de .env, tablas, agente, rutas)
+  - tiempo hasta la primera respuesta de /health (test client de Flask)
+  - conexiones de red abiertas durante la importación (deben ser 0)
+  - si el SDK de OpenAI quedó importado (debe cargarse en el primer uso)
+
+Sale con código 1 si la mediana de importación supera --budget-ms o si alguna
+ronda abrió conexiones o importó OpenAI durante el arranque.
+
+Uso: python benchmarks/bench_cold_start.py [--rounds 5] [--budget-ms 800] [--importtime]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from _common import REPO_ROOT
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Se ejecuta en el intérprete hijo; imprime una línea JSON con las medidas
+CHILD = r"""
+import json, socket, sys, time
+sys.path.insert(0, BENCH_DIR)
+connections = []
+_connect = socket.socket.connect
+def counting_connect(self, address):
+    connections.append(str(address))
+    return _connect(self, address)
+socket.socket.connect = counting_connect
+
+started = time.perf_counter()
+from _common import load_agent_module
+module = load_agent_module()
+imported = time.perf_counter()
+status = module.app.test_client().get("/health").status_code
+served = time.perf_counter()
+print("COLD_START " + json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_health_ms": (served - started) * 1000,
+    "health_status": status,
+    "connections": connections,
+    "openai_imported": "openai" in sys.modules,
+}))
+"""
+
+
+def run_round(extra_args=()):
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-cold-start",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": os.devnull,
+        "WARMUP_MODE": "off",
+    }
+    result = subprocess.run(
+        [sys.executable, *extra_args, "-c", f"BENCH_DIR = {BENCH_DIR!r}\n{CHILD}"],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    for line in result.stdout.splitlines():
+        if line.startswith("COLD_START "):
+            return json.loads(line[len("COLD_START "):]), result.stderr
+    raise RuntimeError(f"la ronda falló:\n{result.stderr[-2000:]}")
+
+
+def print_importtime(stderr, top=15):
+    """Módulos con mayor tiempo acumulado según ``python -X importtime``"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    print(f"\n🐢 Importaciones más lentas (acumulado, top {top})")
+    for cumulative_us, name in rows[:top]:
+        print(f"  {cumulative_us / 1000:>9.1f} ms  {name}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rounds", type=int, default=5)
+    arg_parser.add_argument("--budget-ms", type=float, default=800.0)
+    arg_parser.add_argument(
+        "--importtime", action="store_true", help="desglose con python -X importtime"
+    )
+    args = arg_parser.parse_args()
+
+    rounds = [run_round()[0] for _ in range(args.rounds)]
+    import_ms = sorted(r["import_ms"] for r in rounds)
+    health_ms = sorted(r["first_health_ms"] for r in rounds)
+    connections = sorted({c for r in rounds for c in r["connections"]})
+    openai_imported = any(r["openai_imported"] for r in rounds)
+    bad_status = [r["health_status"] for r in rounds if r["health_status"] != 200]
+
+    print(f"🧊 Arranque en frío ({args.rounds} rondas)")
+    print(
+        f"  importación:      mediana {statistics.median(import_ms):8.1f} ms  "
+        f"máx {import_ms[-1]:8.1f} ms  (presupuesto {args.budget_ms:.0f} ms)"
+    )
+    print(
+        f"  primer /health:   mediana {statistics.median(health_ms):8.1f} ms  "
+        f"máx {health_ms[-1]:8.1f} ms"
+    )
+    print(f"  conexiones de red al importar: {connections or 'ninguna'}")
+    print(f"  SDK de OpenAI importado al arrancar: {'sí' if openai_imported else 'no'}")
+
+    if args.importtime:
+        print_importtime(run_round(["-X", "importtime"])[1])
+
+    failures = []
+    if statistics.median(import_ms) > args.budget_ms:
+        failures.append("importación por encima del presupuesto")
+    if connections:
+        failures.append("conexiones de red durante la importación")
+    if openai_imported:
+        failures.append("OpenAI importado en el arranque")
+    if bad_status:
+        failures.append(f"/health respondió {bad_status}")
+    if failures:
+        print(f"\n❌ {'; '.join(failures)}")
+        return 1
+    print("\n✅ Dentro del presupuesto")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Corpus y throughput de la gramática de fechas (resolve_date_text) frente a dateutil
+
+Cada fila del corpus es (texto, resultado esperado de DateMatch.as_text()) con el
+miércoles 2025-11-19 como día de referencia. El script falla si alguna fila no
+coincide, y después mide la gramática en frío, memoizada y contra dateutil fuzzy.
+
+Uso: python benchmarks/bench_date_grammar.py [--iterations N]
+"""
+
+import argparse
+import logging
+import sys
+from datetime import date
+
+from _common import load_agent_module, measure, print_table
+
+REFERENCE = date(2025, 11, 19)  # miércoles
+
+CORPUS = [
+    # --- English ---
+    ("tomorrow", "tomorrow"),
+    ("tomorrow at 3pm", "tomorrow at 15:00"),
+    ("Tomorrow at 3:30 PM please", "tomorrow at 15:30"),
+    ("tomorrow morning at 9", "tomorrow at 09:00"),
+    ("today at 5 p.m.", "today at 17:00"),
+    ("today at noon", "today at 12:00"),
+    ("day after tomorrow at 10am", "2025-11-21 10:00"),
+    ("monday at 3", "2025-11-24 15:00"),
+    ("next friday at 11:00", "2025-11-21 11:00"),
+    ("on wednesday", "2025-11-26"),
+    ("next week", "2025-11-24"),
+    ("tuesday next week at 2pm", "2025-11-25 14:00"),
+    ("November 25 at 3pm", "2025-11-25 15:00"),
+    ("nov 25th, 10:30", "2025-11-25 10:30"),
+    ("the 3rd of december at 9am", "2025-12-03 09:00"),
+    ("January 5", "2026-01-05"),
+    ("march 2 2026 at 16:00", "2026-03-02 16:00"),
+    ("12 pm tomorrow", "tomorrow at 12:00"),
+    ("12am tomorrow", "tomorrow at 00:00"),
+    ("hola, mañana a las 4", "tomorrow at 16:00"),
+    ("tomorrow in the afternoon at 4", "tomorrow at 16:00"),
+    ("tomorrow evening at 7", "tomorrow at 19:00"),
+    ("saturday 18:45", "2025-11-22 18:45"),
+    # --- Español ---
+    ("mañana", "tomorrow"),
+    ("mañana a las 3", "tomorrow at 15:00"),
+    ("mañana a las 10", "tomorrow at 10:00"),
+    ("mañana por la mañana a las 9", "tomorrow at 09:00"),
+    ("mañana a las 5 de la tarde", "tomorrow at 17:00"),
+    ("hoy a las 18:30", "today at 18:30"),
+    ("pasado mañana a las 11", "2025-11-21 11:00"),
+    ("lunes a las 3", "2025-11-24 15:00"),
+    ("el próximo martes a las 4 de la tarde", "2025-11-25 16:00"),
+    ("el viernes que viene", "2025-11-21"),
+    ("miércoles", "2025-11-26"),
+    ("la próxima semana", "2025-11-24"),
+    ("la semana que viene el jueves a las 10", "2025-11-27 10:00"),
+    ("25 de noviembre a las 3pm", "2025-11-25 15:00"),
+    ("el 2 de enero", "2026-01-02"),
+    ("15 de diciembre de 2025 a las 12:00", "2025-12-15 12:00"),
+    ("sábado a mediodía", "2025-11-22 12:00"),
+    ("domingo 20:00", "2025-11-23 20:00"),
+    # --- Français ---
+    ("demain", "tomorrow"),
+    ("demain à 15h", "tomorrow at 15:00"),
+    ("demain à 14h30", "tomorrow at 14:30"),
+    ("aujourd'hui à 17h", "today at 17:00"),
+    ("après-demain à 10h", "2025-11-21 10:00"),
+    ("lundi prochain à 9h", "2025-11-24 09:00"),
+    ("jeudi", "2025-11-20"),
+    ("la semaine prochaine", "2025-11-24"),
+    ("le 25 novembre à 15h", "2025-11-25 15:00"),
+    ("1er décembre", "2025-12-01"),
+    ("demain à 3 heures de l'après-midi", "tomorrow at 15:00"),
+    ("samedi à midi", "2025-11-22 12:00"),
+    # --- Deutsch ---
+    ("morgen", "tomorrow"),
+    ("morgen um 15 Uhr", "tomorrow at 15:00"),
+    ("morgen um 9:30", "tomorrow at 09:30"),
+    ("heute um 17 Uhr", "today at 17:00"),
+    ("übermorgen", "2025-11-21"),
+    ("übermorgen um 10 Uhr", "2025-11-21 10:00"),
+    ("am Montag um 14 Uhr", "2025-11-24 14:00"),
+    ("nächsten Freitag", "2025-11-21"),
+    ("nächste Woche", "2025-11-24"),
+    ("am 25. November um 15 Uhr", "2025-11-25 15:00"),
+    ("3. März 2026", "2026-03-03"),
+    ("morgen nachmittags um 3", "tomorrow at 15:00"),
+    ("Guten Morgen", None),
+    # --- Italiano ---
+    ("domani", "tomorrow"),
+    ("domani alle 15", "tomorrow at 15:00"),
+    ("domani alle 9:30", "tomorrow at 09:30"),
+    ("oggi alle 18", "today at 18:00"),
+    ("dopodomani alle 11", "2025-11-21 11:00"),
+    ("lunedì alle 3 del pomeriggio", "2025-11-24 15:00"),
+    ("venerdì prossimo", "2025-11-21"),
+    ("la prossima settimana", "2025-11-24"),
+    ("25 novembre alle 15", "2025-11-25 15:00"),
+    ("il 6 gennaio", "2026-01-06"),
+    ("sabato a mezzogiorno", "2025-11-22 12:00"),
+    # --- Português ---
+    ("amanhã", "tomorrow"),
+    ("amanhã às 15h", "tomorrow at 15:00"),
+    ("amanhã às 3 da tarde", "tomorrow at 15:00"),
+    ("hoje às 17:30", "today at 17:30"),
+    ("depois de amanhã às 10h", "2025-11-21 10:00"),
+    ("segunda-feira às 9h", "2025-11-24 09:00"),
+    ("próxima sexta", "2025-11-21"),
+    ("semana que vem", "2025-11-24"),
+    ("25 de novembro às 14h", "2025-11-25 14:00"),
+    ("quinta-feira ao meio-dia", "2025-11-20 12:00"),
+    ("na segunda às 10h", "2025-11-24 10:00"),
+    ("sexta feira às 15h", "2025-11-21 15:00"),
+    # "segunda"/"quinta" sin contexto de día son ordinales: gana el día relativo
+    ("segunda vez mañana", "tomorrow"),
+    ("a quinta opção amanhã às 10", "tomorrow at 10:00"),
+    ("segunda", None),
+    # --- ISO (lo que devuelve el LLM) ---
+    ("2025-11-25 15:00", "2025-11-25 15:00"),
+    ("2025-11-25T09:30:00", "2025-11-25 09:30"),
+    ("2025-12-01", "2025-12-01"),
+    # --- ISO con zona (slots de Cal.com): el offset se conserva ---
+    ("2025-11-25T14:00:00Z", "2025-11-25T14:00:00Z"),
+    ("2025-11-25T14:00:00.000Z", "2025-11-25T14:00:00Z"),
+    ("2025-11-25T16:00:00+02:00", "2025-11-25T16:00:00+02:00"),
+    ("2025-11-25T09:00:00-0500", "2025-11-25T09:00:00-05:00"),
+    # --- Sin fecha ---
+    ("a las 3", None),
+    ("at 10am", None),
+    ("hello there", None),
+    ("my number is +1 555 123 4567", None),
+    ("john.smith99@example.com", None),
+    ("we are 2 people", None),
+    ("la mañana es mejor", None),
+    ("buenos días, quiero una cita", None),
+]
+
+
+# normalize_date_to_iso con instantes ISO con zona: el resultado en UTC no cambia
+# (fechas futuras para que no se apliquen las reglas de "fecha pasada")
+NORMALIZE_CASES = [
+    ("2030-06-20T14:00:00Z", "2030-06-20T14:00:00Z"),
+    ("2030-06-20T16:00:00+02:00", "2030-06-20T14:00:00Z"),
+    ("2030-01-15T09:00:00-05:00", "2030-01-15T14:00:00Z"),
+    ("2030-01-15T09:00:00", "2030-01-15T14:00:00Z"),  # sin zona: hora de Nueva York
+]
+
+
+def check_normalize(agent_module):
+    failures = []
+    for text, expected in NORMALIZE_CASES:
+        got = agent_module.normalize_date_to_iso(text)
+        if got != expected:
+            failures.append((text, expected, got))
+    return failures
+
+
+def check_corpus(agent_module):
+    failures = []
+    for text, expected in CORPUS:
+        match = agent_module.resolve_date_text(text, REFERENCE)
+        got = match.as_text() if match else None
+        if got != expected:
+            failures.append((text, expected, got))
+    return failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--iterations", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    agent_module = load_agent_module()
+    logging.disable(logging.CRITICAL)
+
+    failures = check_corpus(agent_module)
+    print(f"Corpus: {len(CORPUS) - len(failures)}/{len(CORPUS)} correctos")
+    for text, expected, got in failures:
+        print(f"  ❌ {text!r}: esperado {expected!r}, obtenido {got!r}")
+    normalize_failures = check_normalize(agent_module)
+    print(
+        f"normalize_date_to_iso: {len(NORMALIZE_CASES) - len(normalize_failures)}"
+        f"/{len(NORMALIZE_CASES)} correctos"
+    )
+    for text, expected, got in normalize_failures:
+        print(f"  ❌ {text!r}: esperado {expected!r}, obtenido {got!r}")
+    failures += normalize_failures
+
+    texts = [text for text, _ in CORPUS]
+    cached = agent_module._resolve_date_cached
+    uncached = cached.__wrapped__
+    dateutil_parse = agent_module.parser.parse
+
+    def grammar_cold(text):
+        return uncached(text.lower(), REFERENCE)
+
+    def grammar_cached(text):
+        return agent_module.resolve_date_text(text, REFERENCE)
+
+    def dateutil_fuzzy(text):
+        try:
+            return dateutil_parse(text, fuzzy=True)
+        except (ValueError, OverflowError):
+            return None
+
+    print_table(
+        f"Throughput sobre {len(texts)} textos del corpus",
+        [
+            ("gramática (sin caché)", measure(grammar_cold, texts, args.iterations)),
+            ("gramática (memoizada)", measure(grammar_cached, texts, args.iterations)),
+            ("dateutil fuzzy", measure(dateutil_fuzzy, texts, args.iterations)),
+        ],
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Micro-benchmark de detect_language: índice precompilado vs implementación anterior
+
+Uso: python benchmarks/bench_detect_language.py [--iterations N]
+"""
+
+import argparse
+import logging
+
+from _common import load_agent_module, measure, print_table
+
+MESSAGES = [
+    "hola, quiero agendar una cita para mañana",
+    "Hello, I would like to book an appointment tomorrow at 3pm",
+    "bonjour je voudrais un rendez-vous demain",
+    "Hallo, ich möchte einen Termin buchen",
+    "ciao vorrei prenotare un appuntamento domani alle 15",
+    "olá eu gostaria de agendar uma consulta amanhã",
+    "Maria Clara",
+    "jackson.smith@example.com",
+    "mi nombre es Carlos Martin y mi correo es carlos@example.com",
+    "sí",
+]
+
+
+def legacy_detect_language(agent_module, text):
+    """Copia del algoritmo anterior: reconstruye las listas y busca subcadenas"""
+    if not text or not isinstance(text, str) or not text.strip():
+        return "en"
+    text_lower = text.lower().strip()
+    tables = {lang: list(words) for lang, words in agent_module.LANGUAGE_KEYWORDS.items()}
+    common_names = list(agent_module.COMMON_NAMES)
+    words = text_lower.split()
+    if len(words) <= 4 and all(word in common_names for word in words):
+        return "en"
+    for phrase in tables["en"]:
+        if phrase in text_lower:
+            return "en"
+    filtered_text = " ".join(word for word in words if word not in common_names)
+    counts = {
+        lang: sum(1 for word in keywords if word in filtered_text)
+        for lang, keywords in tables.items()
+    }
+    best_lang = max(counts, key=counts.get)
+    if counts[best_lang] == 0 or len(text.strip()) < 5:
+        return "en"
+    return best_lang
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--iterations", type=int, default=20000)
+    args = arg_parser.parse_args()
+
+    agent_module = load_agent_module()
+    logging.disable(logging.CRITICAL)
+    detector = agent_module.language_detector
+
+    print("Resultados por mensaje (nuevo / anterior):")
+    for message in MESSAGES:
+        print(
+            f"  {detector.detect(message)[0]:>2} / "
+            f"{legacy_detect_language(agent_module, message):>2}  {message}"
+        )
+
+    rows = [
+        ("LanguageDetector.detect", measure(detector.detect, MESSAGES, args.iterations)),
+        (
+            "agent.detect_language",
+            measure(
+                agent_module.current_components().agent.detect_language,
+                MESSAGES,
+                args.iterations,
+            ),
+        ),
+        (
+            "implementación anterior",
+            measure(
+                lambda m: legacy_detect_language(agent_module, m),
+                MESSAGES,
+                args.iterations,
+            ),
+        ),
+    ]
+    print_table("detect_language - coste por llamada", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Benchmark del camino caliente de un mensaje con OpenAI, Twilio, Cal.com y Sheets falsos
+
+Mide ops/s y p50/p99 de cada función del pipeline y de turnos completos sobre
+conversaciones de reserva en los 6 idiomas, y guarda el resultado en JSON para
+comparar entre commits.
+
+Uso:
+    python benchmarks/bench_hot_path.py [--iterations N] [--output FICHERO]
+    python benchmarks/bench_hot_path.py --compare benchmarks/results/hot_path_<sha>.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from _common import REPO_ROOT, load_agent_module, measure, print_table
+from _fakes import make_fakes
+
+CONVERSATIONS = {
+    "es": [
+        "Hola, quiero agendar una cita",
+        "Me llamo Carlos Martínez",
+        "carlos.martinez@example.com",
+        "mañana a las 3",
+    ],
+    "en": [
+        "Hi, I would like to book a demo",
+        "My name is John Smith",
+        "john.smith@example.com",
+        "tomorrow at 3pm",
+    ],
+    "fr": [
+        "Bonjour, je voudrais un rendez-vous",
+        "Je m'appelle Marie Dupont",
+        "marie.dupont@example.fr",
+        "demain à 15h",
+    ],
+    "de": [
+        "Hallo, ich möchte einen Termin buchen",
+        "Ich heiße Anna Schmidt",
+        "anna.schmidt@example.de",
+        "morgen um 15 Uhr",
+    ],
+    "it": [
+        "Ciao, vorrei prenotare un appuntamento",
+        "Mi chiamo Luca Rossi",
+        "luca.rossi@example.it",
+        "domani alle 15",
+    ],
+    "pt": [
+        "Olá, gostaria de agendar uma consulta",
+        "Meu nome é João Silva",
+        "joao.silva@example.com.br",
+        "amanhã às 15h",
+    ],
+}
+
+DATE_TEXTS = [
+    "tomorrow at 15:00",
+    "mañana a las 3",
+    "lundi prochain à 9h",
+    "übermorgen um 10 Uhr",
+    "25 novembre alle 15",
+    "2030-11-25 15:00",
+    "next friday 11am",
+]
+
+RESPONSE_CALLS = [
+    ("data_extraction_request", lang, {}) for lang in CONVERSATIONS
+] + [
+    ("ask_for_email", lang, {"name": "Ana"}) for lang in CONVERSATIONS
+] + [
+    (
+        "booking_initiated",
+        lang,
+        {"user_name": "Ana", "user_email": "", "user_date": "", "remaining_fields": "email"},
+    )
+    for lang in CONVERSATIONS
+]
+
+
+def conversation_turns(count, prefix):
+    """(número, mensaje, idioma) en orden de conversación, un número por conversación"""
+    turns = []
+    for n in itertools.count():
+        for lang, messages in CONVERSATIONS.items():
+            number = f"{prefix}{n:06d}{list(CONVERSATIONS).index(lang)}"
+            for message in messages:
+                turns.append((number, message, lang))
+                if len(turns) >= count:
+                    return turns
+    return turns
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, baseline, baseline_path):
+    print(f"\nComparación con {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"{'caso':<36}{'antes ops/s':>14}{'ahora ops/s':>14}{'Δ':>9}")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        delta = (result["ops_per_sec"] / before["ops_per_sec"] - 1) * 100
+        print(
+            f"{name:<36}{before['ops_per_sec']:>14,.1f}"
+            f"{result['ops_per_sec']:>14,.1f}{delta:>+8.1f}%"
+        )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--iterations", type=int, default=20000)
+    arg_parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--http-latency-ms", type=float, default=0.0)
+    arg_parser.add_argument("--output", help="JSON de resultados (por defecto benchmarks/results/)")
+    arg_parser.add_argument("--compare", help="JSON de un run anterior para comparar")
+    args = arg_parser.parse_args()
+
+    # El baseline se lee antes de escribir: puede ser el mismo fichero (mismo commit)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+
+    agent_module = load_agent_module(
+        OUTBOUND_MODE="sync",
+        OUTBOUND_RATE_PER_SECOND=1e9,
+        CAL_API_KEY="cal-benchmark",
+        TWILIO_ACCOUNT_SID="ACbenchmark",
+        TWILIO_AUTH_TOKEN="benchmark",
+    )
+    logging.disable(logging.CRITICAL)
+    fakes = make_fakes(
+        agent_module.DEFAULT_TIMEZONE, args.llm_latency_ms / 1000, args.http_latency_ms / 1000
+    )
+    # Aplicación propia con los fakes inyectados; su contexto queda activo para
+    # que process_whatsapp_message y la reserva usen esos mismos componentes
+    bench_app = agent_module.create_app(**fakes.components)
+    bench_app.app_context().push()
+    agent = agent_module.current_components().agent
+    iterations = args.iterations
+    messages = [m for msgs in CONVERSATIONS.values() for m in msgs]
+    languages = {m: lang for lang, msgs in CONVERSATIONS.items() for m in msgs}
+
+    results = {}
+    results["detect_language"] = measure(agent.detect_language, messages, iterations)
+    results["basic_data_extraction"] = measure(
+        lambda m: agent.basic_data_extraction(m, languages[m]), messages, iterations
+    )
+    results["normalize_date_to_iso"] = measure(
+        agent_module.normalize_date_to_iso, DATE_TEXTS, iterations
+    )
+    results["get_response"] = measure(
+        lambda call: agent.get_response(call[0], call[1], **call[2]), RESPONSE_CALLS, iterations
+    )
+    results["extract_booking_data"] = measure(
+        lambda m: agent.extract_booking_data(m, languages[m]), messages, iterations
+    )
+
+    # Turnos con estado: cada conversación usa un número nuevo, sin calentamiento
+    turn_iterations = max(len(messages), iterations // 4)
+    results["get_contextual_response (turno)"] = measure(
+        lambda t: agent.get_contextual_response(t[1], t[0], t[2]),
+        conversation_turns(turn_iterations, "+1555"),
+        turn_iterations,
+        warmup=0,
+    )
+    full_iterations = max(len(messages), iterations // 20)
+    results["process_whatsapp_message (turno)"] = measure(
+        lambda t: agent_module.process_whatsapp_message(
+            {"From": f"whatsapp:{t[0]}", "Body": t[1], "MessageSid": f"SM{t[0]}{t[1]}"}
+        ),
+        conversation_turns(full_iterations, "+1666"),
+        full_iterations,
+        warmup=0,
+    )
+
+    print_table("Camino caliente (fakes en proceso)", list(results.items()))
+
+    commit = git_commit()
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"hot_path_{commit}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as fh:
+        json.dump(
+            {
+                "benchmark": "hot_path",
+                "commit": commit,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "iterations": iterations,
+                "llm_latency_ms": args.llm_latency_ms,
+                "http_latency_ms": args.http_latency_ms,
+                "results": results,
+            },
+            fh,
+            indent=2,
+        )
+    print(f"\n💾 Resultados guardados en {output}")
+
+    if baseline is not None:
+        compare(results, baseline, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
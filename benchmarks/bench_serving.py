@@ -0,0 +1,244 @@
+"""Throughput del servidor: servidor de desarrollo de Flask frente a gunicorn
+
+Arranca cada servidor como subproceso apuntando a fake_services y mide:
+  1. /health en bucle desde --clients hilos (coste puro de servir HTTP)
+  2. conversaciones completas de reserva por /webhook/whatsapp (load_generator)
+
+Uso:
+    python benchmarks/bench_serving.py
+    python benchmarks/bench_serving.py --server dev --server gunicorn:1x16 \\
+        --server gunicorn:4x8 --users 40 --latency openai=300
+
+``gunicorn:WxT`` = W workers × T hilos (gunicorn.conf.py). Si gunicorn no está
+instalado, esos casos se omiten.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import Namespace
+
+import requests
+
+from _common import AGENT_PATH, REPO_ROOT, percentile
+from fake_services import FakeServiceConfig, FakeServices
+from load_generator import LoadStats, user_loop
+
+DEFAULT_SERVERS = ["dev", "gunicorn:1x16", "gunicorn:4x8"]
+
+
+def server_command(spec):
+    """Devuelve (nombre, comando, entorno extra) para 'dev' o 'gunicorn:WxT'"""
+    if spec == "dev":
+        return "flask dev", [sys.executable, AGENT_PATH], {}
+    workers, threads = spec.split(":", 1)[1].lower().split("x")
+    return (
+        f"gunicorn {workers}×{threads}",
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py")],
+        {"GUNICORN_WORKERS": workers, "GUNICORN_THREADS": threads},
+    )
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, env, base_url, log_path, timeout=60):
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(
+            command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"el servidor terminó con código {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("el servidor no respondió a /health a tiempo")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def health_load(base_url, clients, seconds):
+    """Peticiones GET /health desde ``clients`` hilos durante ``seconds``"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def loop():
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = session.get(f"{base_url}/health", timeout=10).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {
+        "requests_per_sec": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "errors": errors[0],
+    }
+
+
+def conversation_load(base_url, services, args):
+    """Conversaciones completas con load_generator; devuelve su resumen"""
+    stats = LoadStats()
+    load_args = Namespace(
+        conversations=args.conversations,
+        voice_ratio=0.0,
+        reply_timeout=30.0,
+        think_ms=0.0,
+        seed=args.seed,
+    )
+    webhook_url = f"{base_url}/webhook/whatsapp"
+    started = time.monotonic()
+    users = [
+        threading.Thread(
+            target=user_loop,
+            args=(user, webhook_url, services, stats, load_args),
+            daemon=True,
+        )
+        for user in range(args.users)
+    ]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    return stats.summary(time.monotonic() - started)
+
+
+def run_server(spec, args, config, log_dir):
+    name, command, extra_env = server_command(spec)
+    # Servicios falsos nuevos por servidor: los mensajes de Twilio se cuentan por número
+    services = FakeServices(config).start()
+    port = free_port()
+    env = {
+        **os.environ,
+        **services.env(),
+        **extra_env,
+        "PORT": str(port),
+        "HOST": "127.0.0.1",
+        "WEBHOOK_MODE": args.webhook_mode,
+        "OPENAI_API_KEY": "sk-serving-bench",
+        "CAL_API_KEY": "cal-serving-bench",
+        "TWILIO_ACCOUNT_SID": "ACservingbench",
+        "TWILIO_AUTH_TOKEN": "serving-bench",
+        "TWILIO_PHONE_NUMBER": "+15550001111",
+        "LOG_LEVEL": "WARNING",
+        "LOG_FILE": os.path.join(log_dir, f"agent_{port}.log"),
+    }
+    base_url = f"http://127.0.0.1:{port}"
+    log_path = os.path.join(log_dir, f"server_{port}.out")
+    print(f"\n🚀 {name} en {base_url}")
+    try:
+        process = start_server(command, env, base_url, log_path)
+    except RuntimeError as e:
+        services.stop()
+        print(f"❌ {name}: {e} (salida en {log_path})")
+        return None
+    try:
+        health = health_load(base_url, args.clients, args.seconds)
+        print(
+            f"  /health: {health['requests_per_sec']:,.1f} req/s, "
+            f"p50 {health['p50_ms']} ms, p99 {health['p99_ms']} ms"
+        )
+        conversations = conversation_load(base_url, services, args)
+        print(
+            f"  webhook: {conversations['turns_per_sec']} turnos/s, "
+            f"{conversations['bookings']}/{conversations['conversations']} reservas, "
+            f"errores {conversations['errors'] or 'ninguno'}"
+        )
+    finally:
+        stop_server(process)
+        services.stop()
+    return {"server": name, "health": health, "conversations": conversations}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--server", action="append", metavar="dev|gunicorn:WxT")
+    arg_parser.add_argument("--clients", type=int, default=16, help="hilos contra /health")
+    arg_parser.add_argument("--seconds", type=float, default=5.0, help="duración de /health")
+    arg_parser.add_argument("--users", type=int, default=20)
+    arg_parser.add_argument("--conversations", type=int, default=2, help="por usuario")
+    arg_parser.add_argument("--webhook-mode", default="queue", choices=("queue", "sync"))
+    arg_parser.add_argument("--latency", action="append", metavar="[SERVICIO=]MS")
+    arg_parser.add_argument("--seed", type=int, default=7)
+    arg_parser.add_argument("--output", help="guardar los resultados en JSON")
+    args = arg_parser.parse_args()
+
+    specs = args.server or DEFAULT_SERVERS
+    if importlib.util.find_spec("gunicorn") is None:
+        skipped = [spec for spec in specs if spec.startswith("gunicorn")]
+        if skipped:
+            print(f"⚠️ gunicorn no instalado (pip install gunicorn), se omite: {skipped}")
+        specs = [spec for spec in specs if not spec.startswith("gunicorn")]
+
+    config = FakeServiceConfig(
+        latency_ms=FakeServiceConfig.parse_per_service(args.latency), seed=args.seed
+    )
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_serving_") as log_dir:
+        for spec in specs:
+            result = run_server(spec, args, config, log_dir)
+            if result is not None:
+                results.append(result)
+
+    print(f"\n{'servidor':<18}{'health req/s':>14}{'p99 ms':>10}{'turnos/s':>11}"
+          f"{'reply p95 ms':>14}{'reservas':>10}")
+    for result in results:
+        health, conversations = result["health"], result["conversations"]
+        print(
+            f"{result['server']:<18}{health['requests_per_sec']:>14,.1f}"
+            f"{health['p99_ms']:>10.2f}{conversations['turns_per_sec']:>11.2f}"
+            f"{conversations['reply_latency']['p95_ms']:>14.1f}"
+            f"{conversations['bookings']:>5}/{conversations['conversations']:<4}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(results, fh, indent=2)
+        print(f"💾 Resultados guardados en {args.output}")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
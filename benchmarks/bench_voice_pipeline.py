@@ -0,0 +1,117 @@
+"""Benchmark del pipeline de voz: descarga en memoria vs archivo temporal
+
+Sirve audios sintéticos desde un servidor HTTP local y mide, para cada tamaño,
+la latencia (descarga + "subida" a un transcriptor falso que lee el archivo) y
+el pico de memoria Python (tracemalloc) de ambos caminos.
+
+Uso: python benchmarks/bench_voice_pipeline.py [--sizes-kb 64,512,4096] [--rounds N]
+"""
+
+import argparse
+import http.server
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from _common import load_agent_module
+
+
+class AudioHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    payloads = {}
+
+    def do_GET(self):
+        body = self.payloads.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/ogg")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fake_transcribe(file):
+    """Simula la subida multipart: lee el archivo entero como haría el cliente"""
+    if isinstance(file, tuple):
+        file = file[1]
+    total = 0
+    while True:
+        chunk = file.read(64 * 1024)
+        if not chunk:
+            return total
+        total += len(chunk)
+
+
+def legacy_pipeline(agent_module, url):
+    """Camino anterior: response.content -> NamedTemporaryFile -> reabrir -> subir"""
+    response = agent_module.current_components().http_transport.get("media", url)
+    audio_data = response.content
+    temp_filename = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
+            temp_file.write(audio_data)
+            temp_filename = temp_file.name
+        with open(temp_filename, "rb") as audio_file:
+            return fake_transcribe(audio_file)
+    finally:
+        if temp_filename and os.path.exists(temp_filename):
+            os.unlink(temp_filename)
+
+
+def streaming_pipeline(agent_module, url):
+    """Camino nuevo: streaming a BytesIO -> subir desde memoria"""
+    buffer, filename, content_type = agent_module.download_voice_media(url)
+    return fake_transcribe((filename, buffer, content_type))
+
+
+def run(func, agent_module, url, rounds):
+    timings = []
+    peaks = []
+    for _ in range(rounds):
+        tracemalloc.start()
+        started = time.perf_counter()
+        func(agent_module, url)
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return statistics.median(timings) * 1000, max(peaks) / 1024
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes-kb", default="64,512,4096")
+    arg_parser.add_argument("--rounds", type=int, default=20)
+    args = arg_parser.parse_args()
+
+    agent_module = load_agent_module()
+    logging.disable(logging.CRITICAL)
+
+    sizes = [int(size) for size in args.sizes_kb.split(",")]
+    for size in sizes:
+        AudioHandler.payloads[f"/media/{size}"] = os.urandom(size * 1024)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), AudioHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    print(f"{'tamaño':>10}{'camino':>14}{'p50 ms':>10}{'pico KiB':>12}")
+    for size in sizes:
+        url = f"{base}/media/{size}"
+        for name, func in (("tempfile", legacy_pipeline), ("streaming", streaming_pipeline)):
+            latency, peak = run(func, agent_module, url, args.rounds)
+            print(f"{size:>8}KB{name:>14}{latency:>10.2f}{peak:>12.1f}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Generador de carga end-to-end contra /webhook/whatsapp con servicios falsos locales
+
+Arranca fake_services (Twilio, media, Cal.com, OpenAI) y, salvo que se pase
+--target, el propio agente en un servidor WSGI local apuntando a ellos. Cada
+usuario simulado recorre conversaciones completas de reserva y espera la
+respuesta de WhatsApp (en el TwiML o en el Twilio falso) antes del siguiente
+mensaje.
+
+Uso:
+    python benchmarks/load_generator.py --users 50 --conversations 4 \\
+        --latency openai=400 --latency cal=150 --conflict-rate 0.1
+
+Contra un agente ya arrancado (con TWILIO_API_BASE/CAL_API_BASE/OPENAI_BASE_URL
+apuntando a los servicios falsos que imprime este script):
+    python benchmarks/load_generator.py --target http://127.0.0.1:5000 --fake-port 8900
+"""
+
+import argparse
+import html
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+from _common import load_agent_module, percentile
+from bench_hot_path import CONVERSATIONS
+from fake_services import FakeServiceConfig, FakeServices
+
+TWIML_MESSAGE_RE = re.compile(r"<Message>(.*?)</Message>", re.S)
+
+
+class LoadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.webhook_latencies = []
+        self.reply_latencies = []
+        self.errors = Counter()
+        self.turns = 0
+        self.conversations = 0
+        self.bookings = 0
+
+    def add_turn(self, webhook_latency, reply_latency):
+        with self.lock:
+            self.turns += 1
+            self.webhook_latencies.append(webhook_latency)
+            self.reply_latencies.append(reply_latency)
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def summary(self, elapsed):
+        def dist(values):
+            values = sorted(values)
+            return {
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+            }
+
+        with self.lock:
+            return {
+                "elapsed_s": round(elapsed, 2),
+                "turns": self.turns,
+                "conversations": self.conversations,
+                "bookings": self.bookings,
+                "turns_per_sec": round(self.turns / elapsed, 2) if elapsed else 0.0,
+                "conversations_per_sec": round(self.conversations / elapsed, 2)
+                if elapsed
+                else 0.0,
+                "webhook_latency": dist(self.webhook_latencies),
+                "reply_latency": dist(self.reply_latencies),
+                "errors": dict(self.errors),
+            }
+
+
+def run_conversation(session, webhook_url, services, stats, number, args, rng):
+    """Una conversación completa; devuelve True si terminó con la reserva confirmada"""
+    messages = CONVERSATIONS[rng.choice(list(CONVERSATIONS))]
+    received = 0
+    reply = None
+    for turn, text in enumerate(messages):
+        form = {"From": f"whatsapp:{number}", "MessageSid": f"SM{uuid.uuid4().hex}"}
+        last_turn = turn == len(messages) - 1
+        if not last_turn and rng.random() < args.voice_ratio:
+            form["MediaUrl0"] = services.media_url(text)
+            form["MediaContentType0"] = "audio/ogg"
+        else:
+            form["Body"] = text
+
+        started = time.monotonic()
+        try:
+            response = session.post(webhook_url, data=form, timeout=args.reply_timeout)
+        except requests.RequestException as e:
+            stats.error(f"webhook_{type(e).__name__}")
+            return False
+        webhook_latency = time.monotonic() - started
+        if response.status_code != 200:
+            stats.error(f"webhook_http_{response.status_code}")
+            return False
+
+        inline = TWIML_MESSAGE_RE.findall(response.text) if "xml" in response.headers.get(
+            "Content-Type", ""
+        ) else []
+        if inline:
+            reply = html.unescape(inline[-1])
+        else:
+            reply = services.wait_for_messages(number, received + 1, args.reply_timeout)
+            if reply is None:
+                stats.error("reply_timeout")
+                return False
+            received += 1
+        stats.add_turn(webhook_latency, time.monotonic() - started)
+        if args.think_ms:
+            time.sleep(rng.uniform(0, args.think_ms) / 1000)
+
+    if "app.cal.com" not in (reply or ""):
+        stats.error("booking_not_confirmed")
+        return False
+    return True
+
+
+def user_loop(user, webhook_url, services, stats, args):
+    rng = random.Random(args.seed + user if args.seed is not None else None)
+    session = requests.Session()
+    for conversation in range(args.conversations):
+        number = f"+1888{user:04d}{conversation:03d}"
+        booked = run_conversation(session, webhook_url, services, stats, number, args, rng)
+        with stats.lock:
+            stats.conversations += 1
+            stats.bookings += int(booked)
+
+
+def start_local_agent(services, args):
+    """Carga import.py apuntando a los servicios falsos y lo sirve en un puerto libre"""
+    from werkzeug.serving import make_server
+
+    env = {
+        **services.env(),
+        "WEBHOOK_MODE": args.webhook_mode,
+        "CAL_API_KEY": "cal-load-test",
+        "TWILIO_ACCOUNT_SID": "ACloadtest",
+        "TWILIO_AUTH_TOKEN": "load-test",
+        "TWILIO_PHONE_NUMBER": "+15550001111",
+    }
+    for item in args.agent_env or ():
+        key, value = item.split("=", 1)
+        env[key] = value
+    agent_module = load_agent_module(**env)
+    logging.disable(logging.CRITICAL)
+    server = make_server("127.0.0.1", 0, agent_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="agent-wsgi", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--users", type=int, default=20)
+    arg_parser.add_argument("--conversations", type=int, default=3, help="por usuario")
+    arg_parser.add_argument("--target", help="URL base de un agente ya arrancado")
+    arg_parser.add_argument("--webhook-mode", default="queue", choices=("queue", "sync"))
+    arg_parser.add_argument("--agent-env", action="append", metavar="CLAVE=VALOR")
+    arg_parser.add_argument("--fake-port", type=int, default=0)
+    arg_parser.add_argument("--latency", action="append", metavar="[SERVICIO=]MS")
+    arg_parser.add_argument("--jitter-ms", type=float, default=0.0)
+    arg_parser.add_argument("--error-rate", action="append", metavar="[SERVICIO=]TASA")
+    arg_parser.add_argument("--conflict-rate", type=float, default=0.0)
+    arg_parser.add_argument("--voice-ratio", type=float, default=0.0)
+    arg_parser.add_argument("--think-ms", type=float, default=0.0)
+    arg_parser.add_argument("--reply-timeout", type=float, default=30.0)
+    arg_parser.add_argument("--seed", type=int)
+    arg_parser.add_argument("--output", help="guardar el resumen en JSON")
+    args = arg_parser.parse_args()
+
+    config = FakeServiceConfig(
+        latency_ms=FakeServiceConfig.parse_per_service(args.latency),
+        jitter_ms=args.jitter_ms,
+        error_rate=FakeServiceConfig.parse_per_service(args.error_rate),
+        conflict_rate=args.conflict_rate,
+        seed=args.seed,
+    )
+    services = FakeServices(config, port=args.fake_port).start()
+    print(f"🧪 Servicios falsos en {services.base_url}")
+
+    server = None
+    if args.target:
+        base_url = args.target.rstrip("/")
+        for key, value in services.env().items():
+            print(f"  (el agente debe usar {key}={value})")
+    else:
+        base_url, server = start_local_agent(services, args)
+    webhook_url = f"{base_url}/webhook/whatsapp"
+    print(f"🚀 {args.users} usuarios × {args.conversations} conversaciones → {webhook_url}")
+
+    stats = LoadStats()
+    started = time.monotonic()
+    users = [
+        threading.Thread(
+            target=user_loop, args=(user, webhook_url, services, stats, args), daemon=True
+        )
+        for user in range(args.users)
+    ]
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    summary = stats.summary(time.monotonic() - started)
+    summary["fake_services"] = services.stats()
+    try:
+        summary["agent_stats"] = requests.get(f"{base_url}/stats", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        summary["agent_stats"] = None
+
+    print(
+        f"\n✅ {summary['turns']} turnos, {summary['conversations']} conversaciones, "
+        f"{summary['bookings']} reservas en {summary['elapsed_s']}s"
+    )
+    print(
+        f"⚡ {summary['turns_per_sec']} turnos/s, "
+        f"{summary['conversations_per_sec']} conversaciones/s"
+    )
+    for name in ("webhook_latency", "reply_latency"):
+        dist = summary[name]
+        print(
+            f"⏱️ {name:<16} p50 {dist['p50_ms']:>8} ms  p95 {dist['p95_ms']:>8} ms  "
+            f"p99 {dist['p99_ms']:>8} ms  max {dist['max_ms']:>8} ms"
+        )
+    print(f"❌ Errores: {summary['errors'] or 'ninguno'}")
+    print(f"🧪 Servicios falsos: {summary['fake_services']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2, default=str)
+        print(f"💾 Resumen guardado en {args.output}")
+
+    if server is not None:
+        server.shutdown()
+    services.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""Prueba de carga del orden por remitente: muchos hilos golpean el mismo número
+
+Comprueba, en modo queue (JobQueue con buzones) y en modo sync (SenderSerializer):
+  * nunca hay dos mensajes del mismo remitente procesándose a la vez,
+  * los mensajes de un remitente se procesan en orden de llegada,
+  * remitentes distintos sí se procesan en paralelo.
+
+Uso: python benchmarks/stress_sender_ordering.py [--threads N] [--messages M]
+"""
+
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+from _common import load_agent_module
+
+HOT_NUMBER = "+15550000000"
+
+
+class Recorder:
+    """Sustituye process_whatsapp_message y registra concurrencia y orden"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = defaultdict(int)
+        self.max_running_per_sender = 0
+        self.global_running = 0
+        self.max_global_running = 0
+        self.processed = defaultdict(list)
+        self.arrivals = defaultdict(list)
+
+    def arrived(self, sender, seq):
+        with self.lock:
+            self.arrivals[sender].append(seq)
+
+    def process(self, form_data):
+        sender = form_data["From"].replace("whatsapp:", "")
+        with self.lock:
+            self.running[sender] += 1
+            self.global_running += 1
+            self.max_running_per_sender = max(
+                self.max_running_per_sender, self.running[sender]
+            )
+            self.max_global_running = max(self.max_global_running, self.global_running)
+            self.processed[sender].append(int(form_data["Body"]))
+        time.sleep(random.uniform(0.0005, 0.003))
+        with self.lock:
+            self.running[sender] -= 1
+            self.global_running -= 1
+        return {"status": "success"}
+
+
+def run_queue_mode(agent_module, threads, messages):
+    recorder = Recorder()
+    jobs = agent_module.JobQueue(num_workers=8, maxsize=0)
+    counter = iter(range(threads * messages * 2))
+    counter_lock = threading.Lock()
+
+    def client(sender):
+        for _ in range(messages):
+            # El número de secuencia y el encolado son atómicos: define la llegada
+            with counter_lock:
+                seq = next(counter)
+                recorder.arrived(sender, seq)
+                jobs.submit(
+                    recorder.process,
+                    {"From": f"whatsapp:{sender}", "Body": str(seq)},
+                    key=sender,
+                )
+
+    senders = [HOT_NUMBER] * threads + [f"+1666000{i:04d}" for i in range(threads)]
+    workers = [threading.Thread(target=client, args=(s,)) for s in senders]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    jobs._queue.join()
+    return recorder
+
+
+def run_sync_mode(agent_module, threads, messages):
+    recorder = Recorder()
+    serializer = agent_module.SenderSerializer()
+    arrival_lock = threading.Lock()
+    counter = iter(range(threads * messages * 2))
+
+    def client(sender):
+        for _ in range(messages):
+            with arrival_lock:
+                seq = next(counter)
+                recorder.arrived(sender, seq)
+                turn = serializer.turn(sender)
+            with turn:
+                recorder.process({"From": f"whatsapp:{sender}", "Body": str(seq)})
+
+    senders = [HOT_NUMBER] * threads + [f"+1666000{i:04d}" for i in range(threads)]
+    workers = [threading.Thread(target=client, args=(s,)) for s in senders]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return recorder
+
+
+def check(name, recorder):
+    ok = True
+    if recorder.max_running_per_sender != 1:
+        print(f"❌ {name}: {recorder.max_running_per_sender} mensajes simultáneos por remitente")
+        ok = False
+    for sender, order in recorder.processed.items():
+        if order != recorder.arrivals[sender]:
+            print(f"❌ {name}: orden incorrecto para {sender}")
+            ok = False
+    if recorder.max_global_running < 2:
+        print(f"❌ {name}: los remitentes distintos no se procesaron en paralelo")
+        ok = False
+    total = sum(len(v) for v in recorder.processed.values())
+    hot = len(recorder.processed[HOT_NUMBER])
+    print(
+        f"{'✅' if ok else '❌'} {name}: {total} mensajes ({hot} del número caliente), "
+        f"concurrencia máxima global={recorder.max_global_running}"
+    )
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--threads", type=int, default=16)
+    arg_parser.add_argument("--messages", type=int, default=25)
+    args = arg_parser.parse_args()
+
+    agent_module = load_agent_module()
+    logging.disable(logging.CRITICAL)
+
+    ok = check("queue", run_queue_mode(agent_module, args.threads, args.messages))
+    ok = check("sync", run_sync_mode(agent_module, args.threads, args.messages)) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
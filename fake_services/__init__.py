@@ -0,0 +1,15 @@
+"""Servidores locales que imitan Twilio, Cal.com y OpenAI para pruebas de carga
+
+Uso típico (un solo puerto para todos los servicios):
+
+    python -m fake_services --port 8900 --latency openai=400 --conflict-rate 0.1
+
+y arrancar el agente con:
+
+    TWILIO_API_BASE=http://127.0.0.1:8900 CAL_API_BASE=http://127.0.0.1:8900 \\
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python import.py
+"""
+
+from .server import SERVICES, FakeServiceConfig, FakeServices, extract_fields
+
+__all__ = ["SERVICES", "FakeServiceConfig", "FakeServices", "extract_fields"]
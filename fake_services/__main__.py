@@ -0,0 +1,46 @@
+"""python -m fake_services: arranca los servicios falsos en primer plano"""
+
+import argparse
+import time
+
+from .server import FakeServiceConfig, FakeServices
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8900)
+    arg_parser.add_argument(
+        "--latency", action="append", metavar="[SERVICIO=]MS",
+        help="latencia en ms, global o por servicio (twilio, media, cal, openai)",
+    )
+    arg_parser.add_argument("--jitter-ms", type=float, default=0.0)
+    arg_parser.add_argument(
+        "--error-rate", action="append", metavar="[SERVICIO=]TASA",
+        help="fracción de peticiones que responden 503, global o por servicio",
+    )
+    arg_parser.add_argument("--conflict-rate", type=float, default=0.0)
+    arg_parser.add_argument("--seed", type=int)
+    args = arg_parser.parse_args()
+
+    config = FakeServiceConfig(
+        latency_ms=FakeServiceConfig.parse_per_service(args.latency),
+        jitter_ms=args.jitter_ms,
+        error_rate=FakeServiceConfig.parse_per_service(args.error_rate),
+        conflict_rate=args.conflict_rate,
+        seed=args.seed,
+    )
+    services = FakeServices(config, args.host, args.port).start()
+    print(f"🧪 Servicios falsos en {services.base_url}")
+    for key, value in services.env().items():
+        print(f"  export {key}={value}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"📊 {services.stats()}")
+    except KeyboardInterrupt:
+        services.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Servidor HTTP (stdlib) con las rutas de Twilio, Cal.com y OpenAI que usa el agente"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import pytz
+
+SERVICES = ("twilio", "media", "cal", "openai")
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")
+NAME_RE = re.compile(
+    r"\b([A-ZÁÉÍÓÚÄÖÜ][a-záéíóúäöüßçñ]+(?:\s+[A-ZÁÉÍÓÚÄÖÜ][a-záéíóúäöüßçñ]+)*)"
+)
+# Los audios falsos llevan el texto que "dice" la nota de voz tras este marcador
+AUDIO_MARKER = b"OggS-fake:"
+
+TWILIO_MESSAGES_RE = re.compile(r"^/2010-04-01/Accounts/[^/]+/Messages\.json$")
+TWILIO_ACCOUNT_RE = re.compile(r"^/2010-04-01/Accounts/[^/]+\.json$")
+
+
+def extract_fields(text):
+    """Extracción determinista que imita la respuesta JSON del LLM"""
+    email = EMAIL_RE.search(text)
+    name = NAME_RE.search(EMAIL_RE.sub(" ", text))
+    return {
+        "nombre": name.group(1) if name else "Not specified",
+        "email": email.group(0) if email else "Not specified",
+        "fecha": "Not specified",
+    }
+
+
+class FakeServiceConfig:
+    """Latencia, jitter, tasa de errores 5xx y tasa de conflictos de slot por servicio"""
+
+    def __init__(
+        self,
+        latency_ms=None,
+        jitter_ms=0.0,
+        error_rate=None,
+        conflict_rate=0.0,
+        timezone="America/New_York",
+        slot_minutes=30,
+        seed=None,
+    ):
+        self.latency_ms = {service: 0.0 for service in SERVICES}
+        self.latency_ms.update(latency_ms or {})
+        self.error_rate = {service: 0.0 for service in SERVICES}
+        self.error_rate.update(error_rate or {})
+        self.jitter_ms = jitter_ms
+        self.conflict_rate = conflict_rate
+        self.timezone = pytz.timezone(timezone)
+        self.slot_minutes = slot_minutes
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def parse_per_service(values, default=0.0):
+        """["50", "openai=400"] -> {"twilio": 50, ..., "openai": 400}"""
+        result = {}
+        for value in values or ():
+            if "=" in value:
+                service, number = value.split("=", 1)
+                if service not in SERVICES:
+                    raise ValueError(f"Servicio desconocido: {service}")
+                result[service] = float(number)
+            else:
+                result.update({service: float(value) for service in SERVICES})
+        return {service: result.get(service, default) for service in SERVICES}
+
+
+class FakeServices:
+    """Arranca el servidor en un hilo y guarda lo que recibe (mensajes, reservas)"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeServiceConfig()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+        self._lock = threading.Lock()
+        self._messages_changed = threading.Condition(self._lock)
+        self._ids = itertools.count(1)
+        self.messages = {}  # número destino -> [textos]
+        self.bookings = {}  # epoch del slot -> uid
+        self.counts = {}
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def env(self):
+        """Variables de entorno para que el agente use estos servicios"""
+        return {
+            "TWILIO_API_BASE": self.base_url,
+            "CAL_API_BASE": self.base_url,
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+        }
+
+    def media_url(self, text):
+        """URL de una nota de voz falsa cuya transcripción será ``text``"""
+        return f"{self.base_url}/media/{self.new_id('ME')}?text={quote(text)}"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-services", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # ---- registro ----
+    def new_id(self, prefix):
+        return f"{prefix}{next(self._ids)}"
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def record_message(self, to_number, body):
+        with self._messages_changed:
+            self.messages.setdefault(to_number, []).append(body)
+            self._messages_changed.notify_all()
+
+    def wait_for_messages(self, to_number, count, timeout):
+        """Espera a que ``to_number`` haya recibido al menos ``count`` mensajes"""
+        deadline = time.monotonic() + timeout
+        with self._messages_changed:
+            while len(self.messages.get(to_number, ())) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._messages_changed.wait(remaining)
+            return self.messages[to_number][count - 1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": dict(sorted(self.counts.items())),
+                "messages": sum(len(m) for m in self.messages.values()),
+                "bookings": len(self.bookings),
+            }
+
+    # ---- Cal.com ----
+    def free_slots(self, start_date, end_date):
+        cfg = self.config
+        slots = {}
+        day = start_date
+        with self._lock:
+            booked = set(self.bookings)
+        while day <= end_date:
+            times = []
+            moment = cfg.timezone.localize(day.replace(hour=9, minute=0))
+            closing = moment.replace(hour=17)
+            while moment <= closing:
+                if moment.timestamp() not in booked:
+                    times.append({"time": moment.isoformat()})
+                moment += timedelta(minutes=cfg.slot_minutes)
+            slots[day.strftime("%Y-%m-%d")] = times
+            day += timedelta(days=1)
+        return slots
+
+    def book(self, start):
+        """Reserva el slot; None si ya está ocupado (o se inyecta un conflicto)"""
+        epoch = datetime.fromisoformat(start.replace("Z", "+00:00")).timestamp()
+        with self._lock:
+            if epoch in self.bookings or self.config.random.random() < self.config.conflict_rate:
+                return None
+            uid = self.new_id("fakebk")
+            self.bookings[epoch] = uid
+            return uid
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como los upstreams reales
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    # ---- utilidades ----
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload=b"", content_type="application/json"):
+        if not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _inject(self, service):
+        """Aplica latencia y, según la tasa configurada, responde 5xx. True si respondió"""
+        cfg = self.fake.config
+        self.fake.count(f"{service}.requests")
+        delay = cfg.latency_ms[service]
+        if cfg.jitter_ms:
+            delay += cfg.random.uniform(0, cfg.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        if cfg.random.random() < cfg.error_rate[service]:
+            self.fake.count(f"{service}.injected_errors")
+            self._send(503, {"error": "injected failure", "service": service})
+            return True
+        return False
+
+    # ---- rutas ----
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.startswith("/media/"):
+            if self._inject("media"):
+                return
+            text = parse_qs(url.query).get("text", [""])[0]
+            return self._send(200, AUDIO_MARKER + text.encode(), "audio/ogg")
+        if url.path == "/v1/availability":
+            if self._inject("cal"):
+                return
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            start = datetime.strptime(params.get("startDate"), "%Y-%m-%d")
+            end = datetime.strptime(params.get("endDate"), "%Y-%m-%d")
+            return self._send(200, {"slots": self.fake.free_slots(start, end)})
+        # 🩺 Endpoints que usan las probes de /ready
+        if url.path == "/v2/me":
+            if self._inject("cal"):
+                return
+            return self._send(200, {"status": "success", "data": {"id": 1}})
+        if url.path == "/v1/models":
+            if self._inject("openai"):
+                return
+            return self._send(200, {"object": "list", "data": [{"id": "gpt-4o-mini"}]})
+        if TWILIO_ACCOUNT_RE.match(url.path):
+            if self._inject("twilio"):
+                return
+            return self._send(200, {"sid": url.path.rsplit("/", 1)[1][:-5], "status": "active"})
+        self._send(404, {"error": "not found", "path": url.path})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self._body()
+        if TWILIO_MESSAGES_RE.match(path):
+            if self._inject("twilio"):
+                return
+            form = {k: v[0] for k, v in parse_qs(body.decode()).items()}
+            to_number = form.get("To", "").replace("whatsapp:", "")
+            self.fake.record_message(to_number, form.get("Body", ""))
+            sid = self.fake.new_id("SMfake")
+            return self._send(201, {"sid": sid, "status": "queued", "to": form.get("To")})
+        if path == "/v2/bookings":
+            if self._inject("cal"):
+                return
+            payload = json.loads(body or b"{}")
+            uid = self.fake.book(payload.get("start", ""))
+            if uid is None:
+                self.fake.count("cal.conflicts")
+                return self._send(
+                    400,
+                    {"status": "error", "error": {"code": "no_available_users_found"}},
+                )
+            return self._send(201, {"status": "success", "data": {"uid": uid, "id": uid}})
+        if path == "/v1/chat/completions":
+            if self._inject("openai"):
+                return
+            payload = json.loads(body or b"{}")
+            text = payload["messages"][-1]["content"].split(":", 1)[-1].strip()
+            return self._send(200, _chat_completion(payload, json.dumps(extract_fields(text))))
+        if path == "/v1/audio/transcriptions":
+            if self._inject("openai"):
+                return
+            start = body.find(AUDIO_MARKER)
+            text = ""
+            if start >= 0:
+                start += len(AUDIO_MARKER)
+                text = body[start : body.find(b"\r\n--", start)].decode(errors="replace")
+            return self._send(200, {"text": text})
+        self._send(404, {"error": "not found", "path": path})
+
+
+def _chat_completion(request_payload, content):
+    return {
+        "id": f"chatcmpl-fake{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request_payload.get("model", "gpt-4o-mini"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
@@ -0,0 +1,63 @@
+"""Configuración de gunicorn para producción
+
+Uso:
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py
+
+Workers gthread con la app precargada en el maestro (preload_app): plantillas,
+índice de idiomas y gramática de fechas se construyen una sola vez y los
+workers las heredan por copy-on-write. import.py recrea en cada hijo los hilos,
+el pool HTTP y las conexiones SQLite (os.register_at_fork).
+
+⚠️ El estado de las conversaciones vive en la memoria de cada worker. Con más
+de un worker, dos mensajes del mismo remitente pueden caer en workers
+distintos; por eso el valor por defecto es 1 worker con varios hilos.
+"""
+
+import gc
+import os
+import sys
+
+wsgi_app = "import:app"
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# 🧵 Procesos e hilos por proceso
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+worker_class = "gthread"
+preload_app = True
+
+# ⏱️ En modo sync un webhook espera a OpenAI y Cal.com: margen sobre sus timeouts
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")  # "-" para stdout; sin definir, desactivado
+errorlog = "-"
+
+# 👥 Varios workers: idempotencia compartida entre procesos y el límite de Twilio
+# (80 msg/s por remitente) repartido entre ellos. Este fichero se lee antes de
+# precargar la app, así que basta con fijar el entorno aquí.
+if workers > 1:
+    os.environ.setdefault("IDEMPOTENCY_BACKEND", "sqlite")
+    os.environ.setdefault("OUTBOUND_RATE_PER_SECOND", str(80 / workers))
+
+
+def when_ready(server):
+    # Lo precargado pasa a la generación permanente del GC: las pasadas del
+    # colector en los workers no lo tocan y sus páginas siguen compartidas
+    gc.freeze()
+    server.log.info(f"🏭 App precargada ({workers} workers × {threads} hilos)")
+
+
+def post_fork(server, worker):
+    server.log.info(f"🍴 Worker {worker.pid} arrancado")
+
+
+def post_worker_init(worker):
+    # 🔥 El worker ya acepta conexiones: clientes y conexiones se crean en segundo plano
+    agent_module = sys.modules.get("import")
+    if agent_module is not None:
+        agent_module.start_background_warmup()
@@ -1,21 +1,39 @@
 import os
+import atexit
+import bisect
+import copy
+import hashlib
+import importlib.util
 import json
 import logging
+import logging.handlers
+import queue
+import random
 import requests
-import tempfile
+import sqlite3
+import string
+import threading
+import time
 import uuid
+import weakref
 import pytz
 import re  # 🆕 PARA EXTRAER HORA
 from dateutil import parser
-from openai import OpenAI
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, Response, current_app, has_app_context, request, jsonify
 from io import BytesIO
+from collections import OrderedDict, deque, namedtuple
+from functools import lru_cache, wraps
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape as xml_escape
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ========================================
 # 🔧 CONFIGURACIÓN INICIAL (IGUAL)
 # ========================================
-print("🔄 Cargando variables de entorno...")
+# Claves cargadas desde .env (se listan en el diagnóstico de arranque)
+ENV_FILE_KEYS = []
 if os.path.exists(".env"):
     with open(".env", "r") as f:
         for line in f:
@@ -23,19 +41,209 @@ if os.path.exists(".env"):
             if line and not line.startswith("#") and "=" in line:
                 key, value = line.split("=", 1)
                 os.environ[key.strip()] = value.strip().strip("'\"")
-                print(f"✅ Cargada: {key.strip()}")
-else:
-    print("⚠️ No se encontró archivo .env")
+                ENV_FILE_KEYS.append(key.strip())
 
-print("=" * 80)
+# 📜 Logs: "async" (cola acotada + hilo escritor) o "sync" (escritura dentro del request)
+LOG_MODE = os.getenv("LOG_MODE", "async").strip().lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()  # "text" o "json"
+LOG_FILE = os.getenv("LOG_FILE", "whatsapp_voice_agent.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+# Fracción de líneas DEBUG que se conservan (1 = todas)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1))
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(), logging.FileHandler("whatsapp_voice_agent.log")],
-)
+TEXT_LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Conversación y MessageSid del mensaje que procesa el hilo actual
+_log_context = threading.local()
+
+
+class LogContext:
+    """``with LogContext(conversation, message_sid):`` etiqueta los logs del hilo"""
+
+    def __init__(self, conversation=None, message_sid=None):
+        self._values = {"conversation": conversation, "message_sid": message_sid}
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = dict(_log_context.__dict__)
+        _log_context.__dict__.update(self._values)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _log_context.__dict__.clear()
+        _log_context.__dict__.update(self._previous)
+        return False
+
+
+class LogContextFilter(logging.Filter):
+    """Copia el contexto del hilo al record antes de que cambie de hilo"""
+
+    def filter(self, record):
+        record.conversation = getattr(_log_context, "conversation", None)
+        record.message_sid = getattr(_log_context, "message_sid", None)
+        return True
+
+
+class DebugSampleFilter(logging.Filter):
+    """Conserva solo una fracción de las líneas DEBUG; el resto no llega a la cola"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, rate))
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Una línea JSON por record (ts, nivel, mensaje, conversación, MessageSid)"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+            "conversation": getattr(record, "conversation", None),
+            "message_sid": getattr(record, "message_sid", None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que nunca bloquea: si la cola está llena, descarta y cuenta"""
+
+    exception_formatter = logging.Formatter()
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Interpola el mensaje y formatea la traza antes de cambiar de hilo
+
+        A diferencia de QueueHandler.prepare, la traza no se mezcla con el
+        mensaje: queda en ``exc_text`` para que cada formatter la emita a su
+        manera, y la conversación y el MessageSid siguen siendo campos propios.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exception_formatter.formatException(record.exc_info)
+            # El traceback retiene frames y variables locales del hilo del request
+            record.exc_info = None
+        record.conversation = getattr(record, "conversation", None)
+        record.message_sid = getattr(record, "message_sid", None)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """Al parar espera hueco para el centinela aunque la cola esté llena"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class AsyncLogging:
+    """Logs fuera del hilo del request: cola acotada -> QueueListener -> handlers
+
+    Formatear, escribir a disco y rotar el archivo ocurre en el hilo del
+    listener. El request solo interpola el mensaje y hace ``put_nowait``.
+    """
+
+    def __init__(self, handlers, maxsize=LOG_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.listener = DrainingQueueListener(
+            self.queue, *handlers, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def reset_after_fork(self):
+        """En el hijo de un fork no existe el hilo escritor: cola y listener nuevos"""
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.handler.queue = self.queue
+        self.listener = DrainingQueueListener(
+            self.queue, *self.listener.handlers, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def stop(self):
+        """Vacía la cola pendiente y detiene el hilo escritor"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self):
+        return {
+            "mode": "async",
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "enqueued": self.handler.enqueued,
+            "dropped": self.handler.dropped,
+        }
+
+
+def configure_logging():
+    """Configura el logger raíz según LOG_MODE/LOG_FORMAT; devuelve AsyncLogging o None"""
+    formatter = (
+        JsonLogFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_LOG_FORMAT)
+    )
+    handlers = [
+        logging.StreamHandler(),
+        logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        ),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    async_logging = AsyncLogging(handlers) if LOG_MODE == "async" else None
+    front = [async_logging.handler] if async_logging else handlers
+    for handler in front:
+        handler.addFilter(DebugSampleFilter(LOG_DEBUG_SAMPLE_RATE))
+        handler.addFilter(LogContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in front:
+        root.addHandler(handler)
+    return async_logging
+
+
+async_logging = configure_logging()
 logger = logging.getLogger(__name__)
 
+
+def logging_stats():
+    """📜 Estado del logging (profundidad de la cola y records descartados)"""
+    if async_logging is None:
+        return {"mode": "sync"}
+    return async_logging.stats()
+
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID")
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
 CAL_API_KEY = os.getenv("CAL_API_KEY")
@@ -44,28 +252,730 @@ TWILIO_PHONE_NUMBER = os.getenv("TWILIO_PHONE_NUMBER")
 CAL_EVENT_TYPE_ID = int(os.getenv("CAL_EVENT_TYPE_ID", 3953936))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 🧵 Modo del webhook: "queue" responde al instante y procesa en workers, "sync" procesa dentro del request
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue").strip().lower()
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", 4))
+JOB_QUEUE_MAXSIZE = int(os.getenv("JOB_QUEUE_MAXSIZE", 1000))
+
+# 🌐 Transporte HTTP: pool keep-alive por upstream, timeouts y reintentos de conexión
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", max(10, WORKER_POOL_SIZE)))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 15))
+HTTP_CONNECT_RETRIES = int(os.getenv("HTTP_CONNECT_RETRIES", 2))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 0.3))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 30))
+
+# 🔗 URLs base de las APIs (apuntables a fake_services para pruebas de carga locales)
+TWILIO_API_BASE = os.getenv("TWILIO_API_BASE", "https://api.twilio.com").rstrip("/")
+CAL_API_BASE = os.getenv("CAL_API_BASE", "https://api.cal.com").rstrip("/")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
+# 💾 Escritura diferida en Google Sheets: se agrupan filas y se envían en un solo append
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", 20))
+SHEETS_FLUSH_INTERVAL = float(os.getenv("SHEETS_FLUSH_INTERVAL", 5))
+SHEETS_IDEMPOTENCY_KEYS = int(os.getenv("SHEETS_IDEMPOTENCY_KEYS", 10000))
+# Tope de filas en memoria si Sheets no responde; por encima se descartan (y se cuentan)
+SHEETS_MAX_PENDING = int(os.getenv("SHEETS_MAX_PENDING", 1000))
+# La hoja se conecta en el primer flush; tras un fallo se reintenta pasado este tiempo
+SHEETS_CONNECT_RETRY_SECONDS = float(os.getenv("SHEETS_CONNECT_RETRY_SECONDS", 300))
+
+# 🗄️ Caché de extracción OpenAI: "memory", "sqlite" o "off"
+EXTRACTION_CACHE_BACKEND = os.getenv("EXTRACTION_CACHE_BACKEND", "memory").strip().lower()
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", 2048))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", 3600))
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "extraction_cache.sqlite3")
+
+# 📆 Gramática de fechas: resultados memoizados por (texto, día de referencia)
+DATE_GRAMMAR_CACHE_SIZE = int(os.getenv("DATE_GRAMMAR_CACHE_SIZE", 4096))
+
+# 💬 Estado de conversaciones: tamaño máximo y expiración por inactividad (segundos)
+CONVERSATION_MAX_SIZE = int(os.getenv("CONVERSATION_MAX_SIZE", 10000))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", 6 * 3600))
+
+# 📆 Caché de disponibilidad de Cal.com (ventana en días, refresco en segundos)
+AVAILABILITY_WINDOW_DAYS = int(os.getenv("AVAILABILITY_WINDOW_DAYS", 7))
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", 300))
+
+# 🔁 Motor de reservas: intentos máximos, deadline total y backoff con jitter
+BOOKING_MAX_ATTEMPTS = int(os.getenv("BOOKING_MAX_ATTEMPTS", 4))
+BOOKING_DEADLINE_SECONDS = float(os.getenv("BOOKING_DEADLINE_SECONDS", 20))
+BOOKING_BACKOFF_BASE = float(os.getenv("BOOKING_BACKOFF_BASE", 0.25))
+BOOKING_BACKOFF_MAX = float(os.getenv("BOOKING_BACKOFF_MAX", 2))
+BOOKING_TRACE_HISTORY = int(os.getenv("BOOKING_TRACE_HISTORY", 50))
+
+# 🎤 Notas de voz: tamaño máximo descargado en memoria y tamaño de cada chunk
+VOICE_MAX_BYTES = int(os.getenv("VOICE_MAX_BYTES", 16 * 1024 * 1024))
+VOICE_CHUNK_SIZE = int(os.getenv("VOICE_CHUNK_SIZE", 64 * 1024))
+
+# 📝 Caché de transcripciones por media SID y hash del audio ("memory", "sqlite" u "off")
+TRANSCRIPTION_CACHE_BACKEND = os.getenv("TRANSCRIPTION_CACHE_BACKEND", "memory").strip().lower()
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", 5000))
+TRANSCRIPTION_CACHE_TTL = float(os.getenv("TRANSCRIPTION_CACHE_TTL", 7 * 24 * 3600))
+TRANSCRIPTION_CACHE_PATH = os.getenv("TRANSCRIPTION_CACHE_PATH", "transcription_cache.sqlite3")
+
+# 🔑 Idempotencia por MessageSid ("memory", "sqlite" para varios procesos, u "off")
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").strip().lower()
+IDEMPOTENCY_PATH = os.getenv("IDEMPOTENCY_PATH", "idempotency.sqlite3")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_INFLIGHT_TTL = float(os.getenv("IDEMPOTENCY_INFLIGHT_TTL", 300))
+IDEMPOTENCY_MAX_SIZE = int(os.getenv("IDEMPOTENCY_MAX_SIZE", 100000))
+
+# 🩺 Readiness (/ready): probes de upstreams en segundo plano y umbrales de carga
+READY_PROBE_INTERVAL = float(os.getenv("READY_PROBE_INTERVAL", 30))
+READY_PROBE_TIMEOUT = float(os.getenv("READY_PROBE_TIMEOUT", 3))
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", max(1, JOB_QUEUE_MAXSIZE * 8 // 10)))
+READY_MAX_IN_FLIGHT = int(os.getenv("READY_MAX_IN_FLIGHT", 64))
+# Peticiones en curso por conexión del pool HTTP (>1 = esperando conexión libre)
+READY_MAX_POOL_USAGE = float(os.getenv("READY_MAX_POOL_USAGE", 1.0))
+READY_ERROR_WINDOW = float(os.getenv("READY_ERROR_WINDOW", 60))
+READY_MAX_ERROR_RATE = float(os.getenv("READY_MAX_ERROR_RATE", 0.5))
+READY_MIN_SAMPLES = int(os.getenv("READY_MIN_SAMPLES", 20))
+# Una caída de Cal.com/OpenAI afecta a todas las instancias: por defecto no se
+# saca la instancia del balanceador por ello, solo se informa
+READY_FAIL_ON_UPSTREAM = os.getenv("READY_FAIL_ON_UPSTREAM", "false").strip().lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# 📤 Mensajes salientes: "queue" (hilos de envío en segundo plano) o "sync"
+OUTBOUND_MODE = os.getenv("OUTBOUND_MODE", "queue").strip().lower()
+OUTBOUND_SENDERS = int(os.getenv("OUTBOUND_SENDERS", 2))
+# Twilio limita el throughput por número remitente (WhatsApp: 80 msg/s por defecto)
+OUTBOUND_RATE_PER_SECOND = float(os.getenv("OUTBOUND_RATE_PER_SECOND", 80))
+OUTBOUND_BURST = float(os.getenv("OUTBOUND_BURST", OUTBOUND_RATE_PER_SECOND))
+OUTBOUND_COALESCE = os.getenv("OUTBOUND_COALESCE", "true").strip().lower() in ("1", "true", "yes")
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv("OUTBOUND_MAX_ATTEMPTS", 3))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", 0.5))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", 8))
+OUTBOUND_STATUS_HISTORY = int(os.getenv("OUTBOUND_STATUS_HISTORY", 500))
+OUTBOUND_STATUS_CALLBACK_URL = os.getenv("OUTBOUND_STATUS_CALLBACK_URL", "")
+
+# 💬 Respuesta: "rest" (POST a Messages.json) o "twiml" (en la respuesta del webhook
+# si está lista dentro del presupuesto; si no, se envía por REST)
+REPLY_MODE = os.getenv("REPLY_MODE", "rest").strip().lower()
+TWIML_REPLY_BUDGET_SECONDS = float(os.getenv("TWIML_REPLY_BUDGET_SECONDS", 10))
+
+# 🔥 Calentamiento: "background" crea clientes y conexiones en un hilo al arrancar
+# el servidor (el primer mensaje no paga ese coste); "off" lo deja todo bajo demanda
+WARMUP_MODE = os.getenv("WARMUP_MODE", "background").strip().lower()
+
 DEFAULT_TIMEZONE = "America/New_York"
 logger.info(f"⏰ Zona horaria configurada: {DEFAULT_TIMEZONE}")
 
-GOOGLE_SHEETS_AVAILABLE = False
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    GOOGLE_SHEETS_AVAILABLE = True
-except ImportError:
-    print("⚠️ Google Sheets no disponible. Instala con: pip install gspread google-auth-oauthlib")
-    print("💡 El código funcionará sin Google Sheets")
-
-print("\n🔍 DEBUG - Variables de entorno cargadas:")
-print(f"  TWILIO_ACCOUNT_SID: {'✅' if TWILIO_ACCOUNT_SID else '❌'}")
-print(f"  TWILIO_AUTH_TOKEN: {'✅' if TWILIO_AUTH_TOKEN else '❌'}")
-print(f"  WHATSAPP_PHONE: {'✅' if WHATSAPP_PHONE else '❌'}")
-print(f"  TWILIO_PHONE_NUMBER: {'✅' if TWILIO_PHONE_NUMBER else '❌'}")
-print(f"  CAL_API_KEY: {'✅' if CAL_API_KEY else '❌'}")
-print(f"  OPENAI_API_KEY: {'✅' if OPENAI_API_KEY else '❌'}")
-print(f"  CAL_EVENT_TYPE_ID: ✅ {CAL_EVENT_TYPE_ID}")
-print(f"  GOOGLE_SHEETS: {'✅' if GOOGLE_SHEETS_AVAILABLE else '⚠️  Opcional'}")
+
+def _module_available(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ImportError:
+        return False
+
+
+# 💾 Google Sheets es opcional; sus paquetes se importan al conectar, no al arrancar
+GOOGLE_SHEETS_AVAILABLE = _module_available("gspread") and _module_available(
+    "google.oauth2.service_account"
+)
+
+# 🤖 El SDK de OpenAI tarda ~0.7 s en importarse: cliente creado en el primer uso
+_openai_client = None
+_openai_client_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Cliente OpenAI compartido, creado en la primera llamada de cada proceso"""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+
+                _openai_client = OpenAI(
+                    api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT, base_url=OPENAI_BASE_URL
+                )
+    return _openai_client
+
+
+def print_startup_diagnostics():
+    """🔍 Resumen de configuración para la consola (solo al ejecutar el script)"""
+    print("=" * 80)
+    if ENV_FILE_KEYS:
+        print(f"✅ Cargadas desde .env: {', '.join(ENV_FILE_KEYS)}")
+    else:
+        print("⚠️ No se encontró archivo .env (o está vacío)")
+    if not GOOGLE_SHEETS_AVAILABLE:
+        print("⚠️ Google Sheets no disponible. Instala con: pip install gspread google-auth-oauthlib")
+        print("💡 El código funcionará sin Google Sheets")
+    print("\n🔍 DEBUG - Variables de entorno cargadas:")
+    print(f"  TWILIO_ACCOUNT_SID: {'✅' if TWILIO_ACCOUNT_SID else '❌'}")
+    print(f"  TWILIO_AUTH_TOKEN: {'✅' if TWILIO_AUTH_TOKEN else '❌'}")
+    print(f"  WHATSAPP_PHONE: {'✅' if WHATSAPP_PHONE else '❌'}")
+    print(f"  TWILIO_PHONE_NUMBER: {'✅' if TWILIO_PHONE_NUMBER else '❌'}")
+    print(f"  CAL_API_KEY: {'✅' if CAL_API_KEY else '❌'}")
+    print(f"  OPENAI_API_KEY: {'✅' if OPENAI_API_KEY else '❌'}")
+    print(f"  CAL_EVENT_TYPE_ID: ✅ {CAL_EVENT_TYPE_ID}")
+    print(f"  GOOGLE_SHEETS: {'✅' if GOOGLE_SHEETS_AVAILABLE else '⚠️  Opcional'}")
+    print(f"  WEBHOOK_MODE: {WEBHOOK_MODE} ({WORKER_POOL_SIZE} workers)")
+    print(f"  OUTBOUND_MODE: {OUTBOUND_MODE} ({OUTBOUND_RATE_PER_SECOND:g} msg/s)")
+    print(f"  REPLY_MODE: {REPLY_MODE}")
+    print(f"  LOG_MODE: {LOG_MODE} ({LOG_FORMAT}, nivel {LOG_LEVEL})")
+    print(f"  WARMUP_MODE: {WARMUP_MODE}")
+
+
+# ========================================
+# 📈 MÉTRICAS EN PROCESO (FORMATO PROMETHEUS)
+# ========================================
+# Buckets de latencia en segundos: de 5 ms (caché) a 30 s (Whisper con audio largo)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricFamily:
+    """Contador o histograma con etiquetas; ``labels()`` devuelve el hijo (cacheado)"""
+
+    def __init__(self, kind, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = _Histogram(self.buckets) if self.kind == "histogram" else _Counter()
+                    self._children[values] = child
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            if self.kind == "counter":
+                lines.append(
+                    f"{self.name}{_format_labels(self.label_names, values)} {child.value:g}"
+                )
+                continue
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.label_names + ("le",), values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, values)
+            lines.append(f"{self.name}_sum{labels} {total:.6f}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Registro de métricas: contadores, histogramas y valores calculados al hacer scrape"""
+
+    def __init__(self):
+        self._families = []
+        self._gauges = []  # (nombre, ayuda, función, tipo)
+
+    def counter(self, name, help_text, label_names=()):
+        family = MetricFamily("counter", name, help_text, label_names)
+        self._families.append(family)
+        return family
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        family = MetricFamily("histogram", name, help_text, label_names, buckets)
+        self._families.append(family)
+        return family
+
+    def gauge(self, name, help_text, func):
+        """Gauge sin coste en el camino caliente: ``func`` se evalúa en cada scrape"""
+        self._gauges.append((name, help_text, func, "gauge"))
+
+    def counter_func(self, name, help_text, func):
+        """Contador mantenido fuera del registro (monótono); se lee en cada scrape"""
+        self._gauges.append((name, help_text, func, "counter"))
+
+    def render(self):
+        lines = []
+        for family in self._families:
+            lines.extend(family.render())
+        for name, help_text, func, kind in self._gauges:
+            try:
+                value = float(func())
+            except Exception as e:
+                logger.warning(f"⚠️ Métrica {name} no disponible: {e}")
+                continue
+            lines.extend(
+                [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value:g}"]
+            )
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """``with stage_timer("twilio_send") as timer:`` mide la etapa y cuenta errores
+
+    Una excepción o ``timer.fail()`` (respuesta HTTP de error) cuentan como error.
+    """
+
+    __slots__ = ("_histogram", "_errors", "_started", "failed")
+
+    def __init__(self, stage):
+        self._histogram = STAGE_LATENCY.labels(stage)
+        self._errors = STAGE_ERRORS.labels(stage)
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.observe(time.perf_counter() - self._started)
+        if exc_type is not None or self.failed:
+            self._errors.inc()
+        return False
+
+
+def timed_stage(stage, failed=None):
+    """Decorador: mide la función como etapa; ``failed(resultado)`` marca errores sin excepción"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with StageTimer(stage) as timer:
+                result = func(*args, **kwargs)
+                if failed is not None and failed(result):
+                    timer.fail()
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def _returned_false(result):
+    return result is False
+
+
+metrics = MetricsRegistry()
+STAGE_LATENCY = metrics.histogram(
+    "agent_stage_duration_seconds", "Latencia por etapa del pipeline", ("stage",)
+)
+STAGE_ERRORS = metrics.counter(
+    "agent_stage_errors_total", "Errores por etapa del pipeline", ("stage",)
+)
+
+
+# ========================================
+# 🌐 TRANSPORTE HTTP COMPARTIDO (KEEP-ALIVE)
+# ========================================
+class HttpTransport:
+    """Una sesión HTTP con pool de conexiones por upstream (twilio, cal, media)"""
+
+    UPSTREAMS = ("twilio", "cal", "media")
+
+    def __init__(
+        self,
+        pool_size=HTTP_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        connect_retries=HTTP_CONNECT_RETRIES,
+        retry_backoff=HTTP_RETRY_BACKOFF,
+    ):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.connect_retries = connect_retries
+        self.retry_backoff = retry_backoff
+        self._sessions = {}
+        self._host_stats = {}
+        self._lock = threading.Lock()
+
+    def _build_session(self, upstream):
+        # Solo se reintentan errores de conexión: la petición nunca llegó al
+        # upstream, así que es seguro incluso para POST (no duplica reservas)
+        retry = Retry(
+            total=self.connect_retries,
+            connect=self.connect_retries,
+            read=0,
+            redirect=0,
+            status=0,
+            other=0,
+            backoff_factor=self.retry_backoff,
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        pool_size = self.upstream_pool_size(upstream)
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def upstream_pool_size(self, upstream):
+        return int(os.getenv(f"HTTP_POOL_SIZE_{upstream.upper()}", self.pool_size))
+
+    def pool_usage(self):
+        """Peticiones en curso frente al tamaño del pool, por upstream"""
+        with self._lock:
+            in_flight = {}
+            for (upstream, _host), stats in self._host_stats.items():
+                in_flight[upstream] = in_flight.get(upstream, 0) + stats["in_flight"]
+        usage = {}
+        for upstream in self.UPSTREAMS:
+            pool_size = self.upstream_pool_size(upstream)
+            busy = in_flight.get(upstream, 0)
+            usage[upstream] = {
+                "in_flight": busy,
+                "pool_size": pool_size,
+                "usage": round(busy / pool_size, 3) if pool_size else 0.0,
+            }
+        return usage
+
+    def reset_after_fork(self):
+        """Sin sesiones heredadas: los sockets del pool no se comparten entre procesos"""
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._host_stats = {}
+
+    def session(self, upstream):
+        """Devuelve (creando si hace falta) la sesión del upstream"""
+        session = self._sessions.get(upstream)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(upstream)
+                if session is None:
+                    session = self._build_session(upstream)
+                    self._sessions[upstream] = session
+        return session
+
+    def request(self, upstream, method, url, **kwargs):
+        """Petición HTTP por la sesión del upstream, siempre con timeout"""
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        key = (upstream, host)
+        with self._lock:
+            stats = self._host_stats.setdefault(
+                key, {"requests": 0, "errors": 0, "in_flight": 0, "total_time": 0.0}
+            )
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+        started = time.monotonic()
+        try:
+            return self.session(upstream).request(method, url, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                stats["in_flight"] -= 1
+                stats["total_time"] += time.monotonic() - started
+
+    def get(self, upstream, url, **kwargs):
+        return self.request(upstream, "GET", url, **kwargs)
+
+    def post(self, upstream, url, **kwargs):
+        return self.request(upstream, "POST", url, **kwargs)
+
+    def stats(self):
+        """📊 Estadísticas por upstream/host: peticiones, errores, latencia y pool"""
+        result = {}
+        with self._lock:
+            host_stats = {k: dict(v) for k, v in self._host_stats.items()}
+            sessions = dict(self._sessions)
+        for (upstream, host), stats in host_stats.items():
+            entry = {
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+                "in_flight": stats["in_flight"],
+                "avg_latency_ms": round(
+                    stats["total_time"] / stats["requests"] * 1000, 2
+                )
+                if stats["requests"]
+                else 0.0,
+            }
+            entry.update(self._pool_stats(sessions.get(upstream), host))
+            result.setdefault(upstream, {})[host] = entry
+        return result
+
+    def _pool_stats(self, session, host):
+        """Estadísticas del pool urllib3 de un host (conexiones abiertas, reutilizadas)"""
+        if session is None:
+            return {}
+        try:
+            pools = session.get_adapter("https://").poolmanager.pools
+            for pool_key in pools.keys():
+                if pool_key.key_host == host.split(":")[0]:
+                    pool = pools[pool_key]
+                    return {
+                        "pool_maxsize": pool.pool.maxsize if pool.pool else 0,
+                        "connections_opened": pool.num_connections,
+                        "requests_sent": pool.num_requests,
+                    }
+        except Exception as e:
+            logger.debug(f"No se pudieron leer estadísticas del pool de {host}: {e}")
+        return {}
+
+
+# ========================================
+# 🗄️ CACHÉS LRU + TTL (MEMORIA O SQLITE)
+# ========================================
+class LRUTTLCache:
+    """Caché en memoria con expulsión LRU y expiración por TTL (thread-safe)"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteCache:
+    """Caché persistente en un fichero SQLite local, misma interfaz que LRUTTLCache"""
+
+    def __init__(self, path, maxsize=10000, ttl=None, table="cache"):
+        self.path = path
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL, last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table}(last_access)"
+        )
+        conn.commit()
+        return conn
+
+    def reopen(self):
+        """Conexión propia tras un fork: SQLite no admite compartirla entre procesos"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self._conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._conn.execute(
+                f"UPDATE {self.table} SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            overflow = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self.table}"
+            ).fetchone()[0] - self.maxsize
+            if overflow > 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN ("
+                    f"SELECT key FROM {self.table} ORDER BY last_access LIMIT ?)",
+                    (overflow,),
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def build_cache(backend, maxsize, ttl=None, path=None, table="cache"):
+    """Crea la caché configurada: "memory", "sqlite" o None si está desactivada"""
+    if backend in ("off", "none", "disabled", ""):
+        return None
+    if backend == "sqlite":
+        try:
+            return SQLiteCache(path, maxsize=maxsize, ttl=ttl, table=table)
+        except Exception as e:
+            logger.error(f"❌ No se pudo abrir la caché SQLite {path}: {e}, usando memoria")
+    return LRUTTLCache(maxsize=maxsize, ttl=ttl)
+
+
+class ExtractionCache:
+    """Caché de extracciones OpenAI por (mensaje normalizado, idioma)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def make_key(message, language):
+        normalized = re.sub(r"\s+", " ", message.lower()).strip(" .,;:!?¡¿")
+        return f"{language}|{normalized}"
+
+    def get(self, message, language):
+        value = self.backend.get(self.make_key(message, language))
+        return dict(value) if value is not None else None
+
+    def set(self, message, language, extracted):
+        ttl = self.backend.ttl
+        fecha = str(extracted.get("fecha") or extracted.get("date") or "")
+        if fecha and fecha.lower().strip() not in (
+            "not specified",
+            "no especificado",
+            "unspecified",
+        ):
+            # 📅 Una fecha relativa ("mañana") no puede servirse después de medianoche
+            tz = pytz.timezone(DEFAULT_TIMEZONE)
+            now = datetime.now(tz)
+            midnight = tz.localize(
+                datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+            )
+            until_midnight = max(1.0, (midnight - now).total_seconds())
+            ttl = min(ttl, until_midnight) if ttl else until_midnight
+        self.backend.set(self.make_key(message, language), dict(extracted), ttl=ttl)
+
+    def stats(self):
+        return self.backend.stats()
 
 
 class GoogleSheetsIntegration:
@@ -76,13 +986,64 @@ class GoogleSheetsIntegration:
         self.sheet = None
         self.sheet_id = os.getenv("GOOGLE_SHEETS_ID")
         self.credentials_path = os.getenv("GOOGLE_SHEETS_CREDENTIALS")
+        self.configured = False
+        self._connect_lock = threading.Lock()
+        self._connect_failed_at = None
+
+        # 📦 Buffer de escritura diferida (write-behind)
+        self.batch_size = max(1, SHEETS_BATCH_SIZE)
+        self.flush_interval = SHEETS_FLUSH_INTERVAL
+        self.max_pending = max(self.batch_size, SHEETS_MAX_PENDING)
+        self._pending = []  # [(booking_key, row_data)]
+        self._pending_keys = set()
+        self._written_keys = OrderedDict()
+        self._needs_verification = False
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher = None
+        self._buffer_stats = {
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "duplicates_skipped": 0,
+        }
 
         if not GOOGLE_SHEETS_AVAILABLE:
             logger.warning("⚠️ Google Sheets deshabilitado (faltan paquetes)")
             return
 
         if self.sheet_id and self.credentials_path:
+            # 🔌 Sin red al arrancar: la conexión se abre en el primer flush (o en warm_up)
+            self.configured = True
+            atexit.register(self.flush)
+            logger.info("💾 Google Sheets configurado (conexión diferida)")
+        else:
+            logger.info("💾 Google Sheets: No configurado (opcional)")
+
+    def connect(self):
+        """Autoriza, abre la hoja y crea los headers; solo la primera vez
+
+        Se llama desde el hilo de flush o desde warm_up(), nunca desde el webhook.
+        Tras un fallo no se reintenta hasta pasados SHEETS_CONNECT_RETRY_SECONDS.
+        """
+        if self.sheet is not None:
+            return True
+        if not self.configured:
+            return False
+        with self._connect_lock:
+            if self.sheet is not None:
+                return True
+            if (
+                self._connect_failed_at is not None
+                and time.monotonic() - self._connect_failed_at < SHEETS_CONNECT_RETRY_SECONDS
+            ):
+                return False
             try:
+                import gspread
+                from google.oauth2.service_account import Credentials
+
                 scope = [
                     "https://www.googleapis.com/auth/spreadsheets   ",
                     "https://www.googleapis.com/auth/drive.file   ",
@@ -94,13 +1055,15 @@ class GoogleSheetsIntegration:
                 spreadsheet = self.gc.open_by_key(self.sheet_id)
                 self.sheet = spreadsheet.sheet1
                 self._ensure_headers()
+                self._connect_failed_at = None
                 logger.info("✅ Google Sheets integrado correctamente")
+                return True
             except Exception as e:
                 logger.error(f"❌ Error inicializando Google Sheets: {e}")
+                self._connect_failed_at = time.monotonic()
                 self.gc = None
                 self.sheet = None
-        else:
-            logger.info("💾 Google Sheets: No configurado (opcional)")
+                return False
 
     def _ensure_headers(self):
         """Asegura que la hoja tenga los headers necesarios"""
@@ -133,6 +1096,7 @@ class GoogleSheetsIntegration:
             logger.error(f"❌ Error creando headers: {e}")
             return False
 
+    @timed_stage("save_booking_data", failed=_returned_false)
     def save_booking_data(
         self,
         phone_number,
@@ -142,9 +1106,10 @@ class GoogleSheetsIntegration:
         idioma,
         estado="Completado",
         notas="",
+        booking_id=None,
     ):
-        """Guarda los datos de una cita en Google Sheets"""
-        if not self.sheet:
+        """Encola los datos de una cita; se escriben en lote (append) en Google Sheets"""
+        if not self.configured:
             logger.warning("⚠️ Google Sheets no disponible para guardar datos")
             return False
 
@@ -159,14 +1124,153 @@ class GoogleSheetsIntegration:
                 idioma,
                 notas,
             ]
-            num_rows = len(self.sheet.get_all_values())
-            self.sheet.update(f"A{num_rows + 1}:H{num_rows + 1}", [row_data])
-            logger.info(f"✅ Datos guardados: {nombre} ({phone_number})")
+            # 🔑 Clave de idempotencia: el booking ID (si no hay, cada fila es única)
+            key = str(booking_id) if booking_id else f"local-{uuid.uuid4()}"
+            with self._buffer_lock:
+                if key in self._pending_keys or key in self._written_keys:
+                    self._buffer_stats["duplicates_skipped"] += 1
+                    logger.info(f"♻️ Booking {key} ya registrado, fila duplicada ignorada")
+                    return True
+                if len(self._pending) >= self.max_pending:
+                    self._buffer_stats["rows_dropped"] += 1
+                    dropped = self._buffer_stats["rows_dropped"]
+                    # Un aviso al llenarse y luego uno de cada 100 descartes
+                    if dropped % 100 == 1:
+                        logger.error(
+                            f"❌ Buffer de Sheets lleno ({self.max_pending} filas): "
+                            f"fila de {phone_number} descartada ({dropped} en total)"
+                        )
+                    return False
+                self._pending.append((key, row_data))
+                self._pending_keys.add(key)
+                pending = len(self._pending)
+
+            self._ensure_flusher()
+            if pending >= self.batch_size:
+                self._flush_event.set()
+            logger.info(f"✅ Datos encolados para Sheets: {nombre} ({phone_number})")
             return True
         except Exception as e:
             logger.error(f"❌ Error guardando en Google Sheets: {e}")
             return False
 
+    def reset_after_fork(self):
+        """Buffer vacío, sin hilo ni conexión: las filas heredadas las escribe el padre"""
+        self.gc = None
+        self.sheet = None
+        self._connect_lock = threading.Lock()
+        self._connect_failed_at = None
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._pending = []
+        self._pending_keys = set()
+        self._flusher = None
+
+    def _ensure_flusher(self):
+        """Arranca el hilo que vacía el buffer por tamaño o por tiempo"""
+        if self._flusher is not None:
+            return
+        with self._buffer_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_loop, name="sheets-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            if self._pending:
+                self.flush()
+
+    @staticmethod
+    def _row_fingerprint(row):
+        """(Phone, Email, Booked_date): identifica filas sin booking ID"""
+        row = list(row) + [""] * (5 - len(row))
+        return (str(row[1]), str(row[3]), str(row[4]))
+
+    def _existing_rows(self):
+        """Bookings (columna Notes) y huellas de las filas que ya están en la hoja"""
+        values = self.sheet.get_all_values()
+        notes = "\n".join(row[7] for row in values if len(row) > 7)
+        booking_keys = set(re.findall(r"Booking ID: ([^,\s]+)", notes))
+        return booking_keys, {self._row_fingerprint(row) for row in values}
+
+    def _already_in_sheet(self, key, row, existing):
+        """Las claves local-… no aparecen en la hoja: se comparan por teléfono, email y fecha"""
+        booking_keys, fingerprints = existing
+        if key.startswith("local-"):
+            return self._row_fingerprint(row) in fingerprints
+        return key in booking_keys
+
+    @timed_stage("sheets_flush", failed=_returned_false)
+    def flush(self):
+        """Escribe todas las filas pendientes con una sola llamada append"""
+        if not self.connect():
+            return False
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch = list(self._pending)
+            if not batch:
+                return True
+
+            try:
+                # Si el último flush falló, pudo haberse aplicado igualmente:
+                # comprobamos la hoja antes de reintentar para no duplicar filas
+                if self._needs_verification:
+                    existing = self._existing_rows()
+                    rows = [
+                        row for key, row in batch if not self._already_in_sheet(key, row, existing)
+                    ]
+                    if len(rows) < len(batch):
+                        logger.info(f"♻️ {len(batch) - len(rows)} filas ya estaban en Sheets")
+                else:
+                    rows = [row for _, row in batch]
+
+                if rows:
+                    self.sheet.append_rows(
+                        rows,
+                        value_input_option="RAW",
+                        insert_data_option="INSERT_ROWS",
+                        table_range="A1",
+                    )
+            except Exception as e:
+                self._needs_verification = True
+                with self._buffer_lock:
+                    self._buffer_stats["failed_flushes"] += 1
+                logger.error(f"❌ Error guardando lote en Google Sheets: {e}")
+                return False
+
+            self._needs_verification = False
+            flushed = {key for key, _ in batch}
+            with self._buffer_lock:
+                self._pending = [item for item in self._pending if item[0] not in flushed]
+                self._pending_keys -= flushed
+                for key in flushed:
+                    self._written_keys[key] = True
+                while len(self._written_keys) > SHEETS_IDEMPOTENCY_KEYS:
+                    self._written_keys.popitem(last=False)
+                self._buffer_stats["rows_written"] += len(rows)
+                self._buffer_stats["flushes"] += 1
+            logger.info(f"✅ Lote guardado en Google Sheets: {len(rows)} filas")
+            return True
+
+    def stats(self):
+        """📊 Estado del buffer de escritura"""
+        with self._buffer_lock:
+            return {
+                "enabled": self.configured,
+                "connected": self.sheet is not None,
+                "pending_rows": len(self._pending),
+                "max_pending": self.max_pending,
+                "batch_size": self.batch_size,
+                "flush_interval_s": self.flush_interval,
+                **self._buffer_stats,
+            }
+
 
 # ========================================
 # 💬 RESPUESTAS MULTILINGÜES COMPLETAS
@@ -345,322 +1449,1104 @@ class LanguageResponses:
                 "time_out_of_bounds_error": "⚠️ O horário {requested_time} está fora do período permitido para reservas. Tentando com: {next_available}",
             },
         }
+        # ⚡ Se validan y pre-parsean todas las plantillas una sola vez
+        self._compiled = compile_language_templates(self.language_responses)
+        self._default = self._compiled["en"]
+        self._fallbacks = {}  # (idioma, clave) sin plantilla -> plantilla de respaldo
 
     def get_response(self, key, language="en", **kwargs):
         """Obtiene una respuesta con interpolación de variables - CON MANEJO DE ERRORES"""
+        responses = self._compiled.get(language, self._default)
+        template = responses.get(key)
+        if template is None:
+            template = self._fallback(key, language, responses)
+            if template is None:
+                # Último recurso: mensaje fijo
+                return f"🤔 No entendí. ¿Podrías repetir? (Error: clave {key} no encontrada)"
         try:
-            responses = self.language_responses.get(language, self.language_responses["en"])
-
-            # 🛡️ SI LA CLAVE NO EXISTE, USAR UN FALLBACK SEGURO
-            if key not in responses:
-                logger.warning(
-                    f"⚠️ Clave '{key}' no encontrada en idioma '{language}', usando fallback"
-                )
-                fallback_key = "generic_response"
-                if fallback_key in responses:
-                    template = responses[fallback_key]
-                else:
-                    # Último recurso: mensaje fijo
-                    return f"🤔 No entendí. ¿Podrías repetir? (Error: clave {key} no encontrada)"
-            else:
-                template = responses[key]
-
-            return template.format(**kwargs)
+            return template.render(kwargs)
         except Exception as e:
             logger.error(
                 f"❌ Error obteniendo respuesta para clave '{key}' en idioma '{language}': {e}"
             )
             return "🤔 Lo siento, hubo un error. Por favor, intenta nuevamente."
 
+    def _fallback(self, key, language, responses):
+        """🛡️ Resuelve (y avisa) una sola vez por clave desconocida"""
+        cache_key = (language, key)
+        if cache_key not in self._fallbacks:
+            logger.warning(
+                f"⚠️ Clave '{key}' no encontrada en idioma '{language}', usando fallback"
+            )
+            self._fallbacks[cache_key] = responses.get("generic_response")
+        return self._fallbacks[cache_key]
+
+
+TEMPLATE_FORMATTER = string.Formatter()
+
+
+class CompiledTemplate:
+    """Plantilla pre-parseada con ``string.Formatter``
+
+    Las plantillas sin variables se renderizan una vez y se sirven memoizadas.
+    """
+
+    __slots__ = ("key", "language", "fields", "_chunks", "_static")
+
+    def __init__(self, key, language, template):
+        self.key = key
+        self.language = language
+        self._chunks = []
+        fields = set()
+        for literal, field, spec, conversion in TEMPLATE_FORMATTER.parse(template):
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(
+                        f"Plantilla '{key}' ({language}): campo no soportado '{{{field}}}'"
+                    )
+                if spec and "{" in spec:
+                    raise ValueError(
+                        f"Plantilla '{key}' ({language}): formato anidado no soportado"
+                    )
+                fields.add(field)
+            self._chunks.append((literal, field, spec, conversion))
+        self.fields = frozenset(fields)
+        self._static = template.format() if not fields else None
+
+    def render(self, kwargs):
+        if self._static is not None:
+            return self._static
+        missing = self.fields.difference(kwargs)
+        if missing:
+            raise KeyError(", ".join(sorted(missing)))
+        parts = []
+        for literal, field, spec, conversion in self._chunks:
+            parts.append(literal)
+            if field is not None:
+                value = kwargs[field]
+                if conversion:
+                    value = TEMPLATE_FORMATTER.convert_field(value, conversion)
+                parts.append(format(value, spec))
+        return "".join(parts)
+
+
+def compile_language_templates(language_responses, reference="en"):
+    """Compila todas las plantillas y exige las mismas claves y variables en cada idioma
+
+    Lanza ValueError al arrancar si un idioma no tiene una clave o una
+    plantilla usa variables distintas a las del idioma de referencia.
+    """
+    compiled = {
+        language: {
+            key: CompiledTemplate(key, language, template)
+            for key, template in responses.items()
+        }
+        for language, responses in language_responses.items()
+    }
+    base = compiled[reference]
+    problems = []
+    for language, templates in compiled.items():
+        missing = sorted(set(base) - set(templates))
+        extra = sorted(set(templates) - set(base))
+        if missing:
+            problems.append(f"{language}: faltan claves {missing}")
+        if extra:
+            problems.append(f"{language}: claves de más {extra}")
+        for key in set(base) & set(templates):
+            if templates[key].fields != base[key].fields:
+                problems.append(
+                    f"{language}.{key}: variables {sorted(templates[key].fields)} "
+                    f"!= {sorted(base[key].fields)} ({reference})"
+                )
+    if problems:
+        raise ValueError("Plantillas de idioma inconsistentes:\n  " + "\n  ".join(problems))
+    return compiled
+
 
 # ========================================
-# 🤖 AGENTE WHATSAPP CON VOZ
+# 🌍 DETECCIÓN DE IDIOMA (ÍNDICE PRECOMPILADO)
 # ========================================
-class ConversationState:
-    def __init__(self, phone_number):
-        self.phone_number = phone_number
-        self.state = "initial"
-        self.language = "en"
-        self.data = {"name": None, "email": None, "date": None}
-        self.last_updated = datetime.now()
+# Palabras clave por idioma. El orden de las claves decide los empates.
+LANGUAGE_KEYWORDS = {
+    # Spanish
+    "es": (
+        "hola",
+        "gracias",
+        "por favor",
+        "cómo",
+        "qué",
+        "dónde",
+        "cuándo",
+        "por qué",
+        "amigo",
+        "amiga",
+        "bien",
+        "muy",
+        "hasta",
+        "luego",
+        "ahora",
+        "mi nombre es",
+        "me llamo",
+        "quisiera",
+        "quiero",
+        "cita",
+        "agendar",
+        "reunión",
+        "demo",
+        "consulta",
+        "llamada",
+    ),
+    # 🎯 Inglés (prioridad alta para booking)
+    "en": (
+        "hi",
+        "hello",
+        "hey",
+        "greetings",
+        "my name is",
+        "i am",
+        "i'm",
+        "call me",
+        "i would like",
+        "i'd like",
+        "i want",
+        "appointment",
+        "schedule",
+        "book",
+        "meeting",
+        "demo",
+        "consultation",
+        "call back",
+        "phone",
+        "email",
+        "time",
+        "today",
+        "tomorrow",
+        "monday",
+        "tuesday",
+        "wednesday",
+        "thursday",
+        "friday",
+        "weekend",
+        "morning",
+        "afternoon",
+        "evening",
+        "thanks",
+        "please",
+        "how are you",
+        "how do you do",
+        "good morning",
+        "good afternoon",
+        "good evening",
+        "want",
+        "would",
+        "like",
+        "thank",
+    ),
+    # French
+    "fr": (
+        "bonjour",
+        "merci",
+        "s'il vous plaît",
+        "comment",
+        "quoi",
+        "où",
+        "quand",
+        "pourquoi",
+        "ami",
+        "bien",
+        "très",
+        "à bientôt",
+        "maintenant",
+        "mon nom est",
+        "je suis",
+        "je voudrais",
+        "rendez",
+        "rdv",
+        "consultation",
+        "appel",
+    ),
+    # German
+    "de": (
+        "hallo",
+        "danke",
+        "bitte",
+        "wie",
+        "was",
+        "wo",
+        "wann",
+        "warum",
+        "freund",
+        "gut",
+        "sehr",
+        "bis bald",
+        "jetzt",
+        "mein name ist",
+        "ich bin",
+        "ich möchte",
+        "termin",
+        "buchen",
+        "meeting",
+        "beratung",
+        "anruf",
+    ),
+    # Italian
+    "it": (
+        "ciao",
+        "grazie",
+        "per favore",
+        "come",
+        "cosa",
+        "dove",
+        "quando",
+        "perché",
+        "amico",
+        "bene",
+        "molto",
+        "a presto",
+        "ora",
+        "mi chiamo",
+        "sono",
+        "vorrei",
+        "appuntamento",
+        "prenotare",
+        "incontro",
+        "consulta",
+        "chiamata",
+    ),
+    # Portuguese
+    "pt": (
+        "olá",
+        "obrigado",
+        "por favor",
+        "como",
+        "o que",
+        "onde",
+        "quando",
+        "por que",
+        "amigo",
+        "bem",
+        "muito",
+        "até logo",
+        "agora",
+        "meu nome é",
+        "eu sou",
+        "eu gostaria",
+        "encontro",
+        "agendar",
+        "consulta",
+        "ligação",
+    ),
+}
+
+# 🛡️ Nombres comunes que NO deben afectar la detección
+COMMON_NAMES = frozenset(
+    (
+        "jackson",
+        "james",
+        "john",
+        "mike",
+        "tom",
+        "sam",
+        "paul",
+        "mark",
+        "luke",
+        "pete",
+        "jamillet",
+        "jamilet",
+        "maria",
+        "ana",
+        "anna",
+        "clara",
+        "marta",
+        "martin",
+        "diego",
+        "carlos",
+        "luis",
+        "jose",
+        "francesco",
+        "mario",
+        "antonio",
+        "roberto",
+    )
+)
 
 
-class WhatsAppVoiceAgent:
-    def __init__(self):
-        self.language_responses_obj = LanguageResponses()
-        self.language_responses = self.language_responses_obj.language_responses
-        self.default_timezone = DEFAULT_TIMEZONE
-        self.conversation_states = {}
-        self.sheets_integration = GoogleSheetsIntegration()
-        logger.info("🤖 Agente de voz WhatsApp inicializado")
-        logger.info(f"⏰ Zona horaria configurada: {self.default_timezone}")
+class LanguageDetector:
+    """Detecta el idioma en una sola pasada usando un índice de tokens construido una vez"""
+
+    TOKEN_RE = re.compile(r"[\w']+")
+
+    def __init__(self, keyword_tables=LANGUAGE_KEYWORDS, common_names=COMMON_NAMES):
+        self.languages = tuple(keyword_tables)
+        self.common_names = common_names
+        # token -> ((idioma, palabra), ...) para palabras sueltas
+        self._single = {}
+        # primer token -> ((tokens, idioma, frase), ...) para frases de varias palabras
+        self._phrases = {}
+        for lang, keywords in keyword_tables.items():
+            for keyword in keywords:
+                tokens = tuple(self.tokenize(keyword))
+                if len(tokens) == 1:
+                    self._single.setdefault(tokens[0], []).append((lang, keyword))
+                elif tokens:
+                    self._phrases.setdefault(tokens[0], []).append(
+                        (tokens, lang, keyword)
+                    )
+        self._single = {k: tuple(v) for k, v in self._single.items()}
+        self._phrases = {k: tuple(v) for k, v in self._phrases.items()}
+
+    @classmethod
+    def tokenize(cls, text):
+        return cls.TOKEN_RE.findall(text.lower().replace("’", "'"))
+
+    def scores(self, text):
+        """Cuenta las palabras clave distintas de cada idioma (sin nombres comunes)"""
+        tokens = [t for t in self.tokenize(text) if t not in self.common_names]
+        matched = set()
+        single = self._single
+        phrases = self._phrases
+        for i, token in enumerate(tokens):
+            hits = single.get(token)
+            if hits:
+                matched.update(hits)
+            candidates = phrases.get(token)
+            if candidates:
+                for phrase_tokens, lang, keyword in candidates:
+                    if tuple(tokens[i : i + len(phrase_tokens)]) == phrase_tokens:
+                        matched.add((lang, keyword))
+        counts = dict.fromkeys(self.languages, 0)
+        for lang, _ in matched:
+            counts[lang] += 1
+        return counts
+
+    def detect(self, text):
+        if not text or not isinstance(text, str) or not text.strip():
+            return "en", 0
+
+        # Verificar si el mensaje es solo nombres
+        words = text.lower().split()
+        if len(words) <= 4 and all(word in self.common_names for word in words):
+            logger.info(
+                f"🌍 Detección: Solo nombres detectados, usando inglés por defecto"
+            )
+            return "en", 0
 
-    def get_response(self, key, language="en", **kwargs):
-        return self.language_responses_obj.get_response(key, language, **kwargs)
+        counts = self.scores(text)
 
-    def get_or_create_conversation_state(self, phone_number):
-        if phone_number not in self.conversation_states:
-            self.conversation_states[phone_number] = ConversationState(phone_number)
-        return self.conversation_states[phone_number]
+        # Prioridad: frases en inglés de booking
+        if counts.get("en"):
+            return "en", counts["en"]
 
-    def detect_language(self, text):
-        """🌍 DETECCIÓN DE IDIOMA COMPLETA - 6 IDIOMAS"""
-        try:
-            if not text or not isinstance(text, str) or not text.strip():
-                return "en"
-
-            text_lower = text.lower().strip()
-
-            # 🎯 INDICADORES DE IDIOMA (prioridad alta para booking)
-            high_priority_english = [
-                "hi",
-                "hello",
-                "hey",
-                "greetings",
-                "my name is",
-                "i am",
-                "i'm",
-                "call me",
-                "i would like",
-                "i'd like",
-                "i want",
-                "appointment",
-                "schedule",
-                "book",
-                "meeting",
-                "demo",
-                "consultation",
-                "call back",
-                "phone",
-                "email",
-                "time",
-                "today",
-                "tomorrow",
-                "monday",
-                "tuesday",
-                "wednesday",
-                "thursday",
-                "friday",
-                "weekend",
-                "morning",
-                "afternoon",
-                "evening",
-                "thanks",
-                "please",
-                "how are you",
-                "how do you do",
-                "good morning",
-                "good afternoon",
-                "good evening",
-                "want",
-                "would",
-                "like",
-                "thank",
-            ]
+        best_lang = max(counts, key=counts.get)
+        score = counts[best_lang]
+        if score == 0 or len(text.strip()) < 5:
+            return "en", 0
+        return best_lang, score
 
-            # Spanish
-            spanish_words = [
-                "hola",
-                "gracias",
-                "por favor",
-                "cómo",
-                "qué",
-                "dónde",
-                "cuándo",
-                "por qué",
-                "amigo",
-                "amiga",
-                "bien",
-                "muy",
-                "hasta",
-                "luego",
-                "ahora",
-                "mi nombre es",
-                "me llamo",
-                "quisiera",
-                "quiero",
-                "cita",
-                "agendar",
-                "reunión",
-                "demo",
-                "consulta",
-                "llamada",
-            ]
 
-            # French
-            french_words = [
-                "bonjour",
-                "merci",
-                "s'il vous plaît",
-                "comment",
-                "quoi",
-                "où",
-                "quand",
-                "pourquoi",
-                "ami",
-                "bien",
-                "très",
-                "à bientôt",
-                "maintenant",
-                "mon nom est",
-                "je suis",
-                "je voudrais",
-                "rendez",
-                "rdv",
-                "consultation",
-                "appel",
-            ]
+language_detector = LanguageDetector()
 
-            # German
-            german_words = [
-                "hallo",
-                "danke",
-                "bitte",
-                "wie",
-                "was",
-                "wo",
-                "wann",
-                "warum",
-                "freund",
-                "gut",
-                "sehr",
-                "bis bald",
-                "jetzt",
-                "mein name ist",
-                "ich bin",
-                "ich möchte",
-                "termin",
-                "buchen",
-                "meeting",
-                "beratung",
-                "anruf",
-            ]
 
-            # Italian
-            italian_words = [
-                "ciao",
-                "grazie",
-                "per favore",
-                "come",
-                "cosa",
-                "dove",
-                "quando",
-                "perché",
-                "amico",
-                "bene",
-                "molto",
-                "a presto",
-                "ora",
-                "mi chiamo",
-                "sono",
-                "vorrei",
-                "appuntamento",
-                "prenotare",
-                "incontro",
-                "consulta",
-                "chiamata",
-            ]
+# ========================================
+# 📆 GRAMÁTICA DE FECHAS MULTILINGÜE (ANTES QUE DATEUTIL)
+# ========================================
+RELATIVE_DAY_WORDS = {
+    "day_after": (
+        "day after tomorrow", "pasado mañana", "pasado manana", "après-demain",
+        "après demain", "apres-demain", "übermorgen", "uebermorgen", "dopodomani",
+        "depois de amanhã", "depois de amanha",
+    ),
+    "tomorrow": ("tomorrow", "mañana", "demain", "morgen", "domani", "amanhã", "amanha"),
+    "today": ("today", "hoy", "aujourd'hui", "heute", "oggi", "hoje"),
+}
+RELATIVE_DAY_OFFSETS = {"today": 0, "tomorrow": 1, "day_after": 2}
+
+WEEKDAY_WORDS = (
+    ("monday", "lunes", "lundi", "montag", "lunedì", "lunedi", "segunda-feira",
+     "segunda feira"),
+    ("tuesday", "martes", "mardi", "dienstag", "martedì", "martedi", "terça-feira",
+     "terca-feira", "terça feira", "terca feira"),
+    ("wednesday", "miércoles", "miercoles", "mercredi", "mittwoch", "mercoledì",
+     "mercoledi", "quarta-feira", "quarta feira"),
+    ("thursday", "jueves", "jeudi", "donnerstag", "giovedì", "giovedi", "quinta-feira",
+     "quinta feira"),
+    ("friday", "viernes", "vendredi", "freitag", "venerdì", "venerdi", "sexta-feira",
+     "sexta feira"),
+    ("saturday", "sábado", "sabado", "samedi", "samstag", "sonnabend", "sabato"),
+    ("sunday", "domingo", "dimanche", "sonntag", "domenica"),
+)
+# Sin "-feira" también son ordinales ("segunda vez", "quinta opção"): solo cuentan
+# como día de la semana tras "na"/"no"/"próxima"/"esta" (PT_WEEKDAY_RE)
+PT_SHORT_WEEKDAYS = {"segunda": 0, "terça": 1, "terca": 1, "quarta": 2, "quinta": 3, "sexta": 4}
+
+MONTH_WORDS = (
+    ("january", "jan", "enero", "janvier", "januar", "gennaio", "janeiro"),
+    ("february", "feb", "febrero", "février", "fevrier", "februar", "febbraio", "fevereiro"),
+    ("march", "mar", "marzo", "mars", "märz", "maerz", "março", "marco"),
+    ("april", "apr", "abril", "avril", "aprile"),
+    ("may", "mayo", "mai", "maggio", "maio"),
+    ("june", "jun", "junio", "juin", "juni", "giugno", "junho"),
+    ("july", "jul", "julio", "juillet", "juli", "luglio", "julho"),
+    ("august", "aug", "agosto", "août", "aout"),
+    ("september", "sept", "sep", "septiembre", "setiembre", "septembre", "settembre",
+     "setembro"),
+    ("october", "oct", "octubre", "octobre", "oktober", "ottobre", "outubro"),
+    ("november", "nov", "noviembre", "novembre", "novembro"),
+    ("december", "dec", "diciembre", "décembre", "decembre", "dezember", "dicembre",
+     "dezembro"),
+)
 
-            # Portuguese
-            portuguese_words = [
-                "olá",
-                "obrigado",
-                "por favor",
-                "como",
-                "o que",
-                "onde",
-                "quando",
-                "por que",
-                "amigo",
-                "bem",
-                "muito",
-                "até logo",
-                "agora",
-                "meu nome é",
-                "eu sou",
-                "eu gostaria",
-                "encontro",
-                "agendar",
-                "consulta",
-                "ligação",
-            ]
+NEXT_WEEK_PHRASES = (
+    "next week", "la próxima semana", "la proxima semana", "próxima semana",
+    "proxima semana", "la semana que viene", "semana que viene", "la semaine prochaine",
+    "semaine prochaine", "nächste woche", "nächsten woche", "naechste woche",
+    "la prossima settimana", "prossima settimana", "la settimana prossima",
+    "settimana prossima", "semana que vem",
+)
 
-            # 🛡️ Nombres comunes que NO deben afectar la detección
-            common_names = [
-                "jackson",
-                "james",
-                "john",
-                "mike",
-                "tom",
-                "sam",
-                "paul",
-                "mark",
-                "luke",
-                "pete",
-                "jamillet",
-                "jamilet",
-                "maria",
-                "ana",
-                "anna",
-                "clara",
-                "marta",
-                "martin",
-                "diego",
-                "carlos",
-                "luis",
-                "jose",
-                "francesco",
-                "mario",
-                "antonio",
-                "roberto",
-            ]
+# Franja del día: fija AM/PM cuando la hora viene sin marcador ("a las 5 de la tarde")
+DAY_PART_WORDS = {
+    "am": (
+        "in the morning", "this morning", "morning", "de la mañana", "por la mañana",
+        "du matin", "le matin", "morgens", "vormittags", "am morgen", "di mattina",
+        "la mattina", "da manhã", "de manhã", "pela manhã",
+    ),
+    "pm": (
+        "in the afternoon", "this afternoon", "afternoon", "in the evening", "evening",
+        "tonight", "de la tarde", "por la tarde", "de la noche", "por la noche",
+        "de l'après-midi", "l'après-midi", "après-midi", "du soir", "ce soir",
+        "nachmittags", "am nachmittag", "abends", "am abend", "del pomeriggio",
+        "di pomeriggio", "pomeriggio", "di sera", "la sera", "stasera", "da tarde",
+        "à tarde", "de tarde", "da noite", "à noite", "de noite",
+    ),
+    "noon": (
+        "noon", "midday", "mediodía", "mediodia", "midi", "mittags", "mittag",
+        "mezzogiorno", "meio-dia", "meio dia",
+    ),
+}
+
+
+def _alternation(words):
+    """Alternativa regex con las frases más largas primero"""
+    return "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True))
+
+
+WEEKDAY_INDEX = {word: day for day, words in enumerate(WEEKDAY_WORDS) for word in words}
+_WEEKDAYS = _alternation(WEEKDAY_INDEX)
+WEEKDAY_INDEX.update(PT_SHORT_WEEKDAYS)
+MONTH_INDEX = {word: month for month, words in enumerate(MONTH_WORDS, 1) for word in words}
+RELATIVE_DAY_INDEX = {
+    word: kind for kind, words in RELATIVE_DAY_WORDS.items() for word in words
+}
+DAY_PART_INDEX = {word: part for part, words in DAY_PART_WORDS.items() for word in words}
+
+_MONTHS = _alternation(MONTH_INDEX)
+_ARTICLE = r"(?:(?:the|on|el|le|il|am|o|a|na|no|dia|den)\s+)?"
+_ORDINAL = r"(?:st|nd|rd|th|er|e|º|°|ª|\.)?"
+
+ISO_DATE_RE = re.compile(
+    r"(?<!\d)(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})(?!\d)"
+    r"(?:[t ](?P<hour>\d{1,2}):(?P<minute>\d{2})(?::\d{2}(?:\.\d+)?)?"
+    r"(?P<offset>z|[+-]\d{2}:?\d{2})?)?"
+)
+DAY_MONTH_RE = re.compile(
+    rf"(?<!\w){_ARTICLE}(?P<day>\d{{1,2}}){_ORDINAL}\s*(?:de\s+|of\s+)?"
+    rf"(?P<month>{_MONTHS})(?!\w)\.?(?:,?\s*(?:de\s+)?(?P<year>\d{{4}})(?!\d))?"
+)
+MONTH_DAY_RE = re.compile(
+    rf"(?<!\w){_ARTICLE}(?P<month>{_MONTHS})\.?\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?"
+    rf"(?!\d|\s*(?:[ap]\.?m(?!\w)|:\d|h(?!\w)|uhr))(?:,?\s*(?P<year>\d{{4}})(?!\d))?"
+)
+NEXT_WEEK_RE = re.compile(rf"(?<!\w)(?:{_alternation(NEXT_WEEK_PHRASES)})(?!\w)")
+WEEKDAY_RE = re.compile(
+    r"(?<!\w)(?:(?:next|this|coming|el próximo|el proximo|la próxima|la proxima|"
+    r"próximo|proximo|próxima|proxima|este|esta|nächsten|nächster|naechsten|diesen|"
+    r"questo|prossimo|the|on|el|le|il|am|o|a|na|no)\s+)?"
+    rf"(?P<weekday>{_WEEKDAYS})(?!\w)"
+    r"(?:\s+(?:prochain|prochaine|prossimo|que viene|que vem))?"
+)
+PT_WEEKDAY_RE = re.compile(
+    r"(?<!\w)(?:na|no|nesta|neste|esta|este|próxima|proxima)\s+(?:próxima\s+|proxima\s+)?"
+    rf"(?P<weekday>{_alternation(PT_SHORT_WEEKDAYS)})(?!\w)(?:\s+que vem)?"
+)
+# "mañana"/"Morgen" tras un artículo es "la mañana"/"am Morgen", no el día siguiente
+RELATIVE_DAY_RE = re.compile(
+    r"(?<!\w)(?<!\bla )(?<!\besta )(?<!\bam )(?<!\bguten )"
+    rf"(?P<relative>{_alternation(RELATIVE_DAY_INDEX)})(?!\w)"
+)
+# Hora: "3pm", "3:30 p.m.", "15:00", "15h30", "15 Uhr", "a las 3", "alle 15", "às 14h"
+TIME_RE = re.compile(
+    r"(?<![\w:.,/-])(?:(?P<prefix>at|a las|a la|à|alle|alle ore|le ore|ore|um|às|as)\s+)?"
+    r"(?P<hour>\d{1,2})(?:(?::|h|\.)(?P<minute>[0-5]\d))?(?![\d:])\s*"
+    r"(?:(?P<ampm>[ap])\.?\s?m(?!\w)\.?|(?P<marker>h|uhr|hrs?|horas?|heures?|ore)(?!\w))?"
+)
+DAY_PART_RE = re.compile(rf"(?<!\w)(?P<part>{_alternation(DAY_PART_INDEX)})(?!\w)")
+
+
+class DateMatch(
+    namedtuple("DateMatch", "date hour minute kind spans utc_offset", defaults=(None,))
+):
+    """Fecha/hora resuelta por la gramática (``date`` u ``hour`` pueden ser None)
+
+    ``kind``: today, tomorrow, day_after, weekday, next_week, calendar o iso.
+    ``utc_offset``: minutos respecto a UTC si el ISO traía ``Z``/``±hh:mm``;
+    None = hora local de DEFAULT_TIMEZONE.
+    """
+
+    __slots__ = ()
+
+    def as_text(self):
+        """Texto que entienden normalize_date_to_iso y el estado de la conversación"""
+        if self.date is None:
+            return None
+        clock = f"{self.hour:02d}:{self.minute:02d}" if self.hour is not None else None
+        if self.kind in ("today", "tomorrow"):
+            return f"{self.kind} at {clock}" if clock else self.kind
+        day = self.date.isoformat()
+        if self.utc_offset is not None and clock:
+            # El offset se conserva: es un instante concreto, no una hora local
+            if self.utc_offset == 0:
+                return f"{day}T{clock}:00Z"
+            sign = "+" if self.utc_offset > 0 else "-"
+            hours, minutes = divmod(abs(self.utc_offset), 60)
+            return f"{day}T{clock}:00{sign}{hours:02d}:{minutes:02d}"
+        return f"{day} {clock}" if clock else day
+
+
+def _mask(text, spans):
+    """Tapa con espacios lo ya reconocido (para no leer el día 25 como una hora)"""
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = " " * (end - start)
+    return "".join(chars)
+
+
+def _calendar_date(match, reference_date):
+    day, month = int(match.group("day")), match.group("month")
+    month = MONTH_INDEX[month] if not month.isdigit() else int(month)
+    year = match.group("year")
+    try:
+        if year:
+            return datetime(int(year), month, day).date()
+        candidate = datetime(reference_date.year, month, day).date()
+        if candidate < reference_date:
+            candidate = datetime(reference_date.year + 1, month, day).date()
+        return candidate
+    except ValueError:
+        return None
 
-            # Verificar si el mensaje es solo nombres
-            words = text_lower.split()
-            if len(words) <= 4 and all(word in common_names for word in words):
-                logger.info(
-                    f"🌍 Detección: Solo nombres detectados, usando inglés por defecto"
+
+def _utc_offset_minutes(offset):
+    """"z" -> 0, "+02:00"/"-0530" -> minutos; None si no hay offset"""
+    if not offset:
+        return None
+    if offset == "z":
+        return 0
+    digits = offset[1:].replace(":", "")
+    minutes = int(digits[:2]) * 60 + int(digits[2:])
+    return -minutes if offset[0] == "-" else minutes
+
+
+def _match_day(text, reference_date):
+    """Parte de fecha: (date, kind, spans, (hora, minuto, offset)) por prioridad"""
+    match = ISO_DATE_RE.search(text)
+    if match:
+        date = _calendar_date(match, reference_date)
+        if date is not None:
+            clock = None
+            if match.group("hour") is not None:
+                clock = (
+                    int(match.group("hour")),
+                    int(match.group("minute")),
+                    _utc_offset_minutes(match.group("offset")),
                 )
-                return "en"
-
-            # Prioridad: frases en inglés de booking
-            for phrase in high_priority_english:
-                if phrase in text_lower:
-                    return "en"
-
-            # Contar palabras por idioma (excluyendo nombres)
-            filtered_words = [word for word in words if word not in common_names]
-            filtered_text = " ".join(filtered_words)
-
-            counts = {
-                "es": sum(1 for word in spanish_words if word in filtered_text),
-                "en": sum(1 for word in high_priority_english if word in filtered_text),
-                "fr": sum(1 for word in french_words if word in filtered_text),
-                "de": sum(1 for word in german_words if word in filtered_text),
-                "it": sum(1 for word in italian_words if word in filtered_text),
-                "pt": sum(1 for word in portuguese_words if word in filtered_text),
+            return date, "iso", [match.span()], clock
+
+    for regex in (DAY_MONTH_RE, MONTH_DAY_RE):
+        match = regex.search(text)
+        if match:
+            date = _calendar_date(match, reference_date)
+            if date is not None:
+                return date, "calendar", [match.span()], None
+
+    next_week = NEXT_WEEK_RE.search(text)
+    weekday = WEEKDAY_RE.search(text) or PT_WEEKDAY_RE.search(text)
+    if next_week:
+        monday = reference_date + timedelta(days=7 - reference_date.weekday())
+        spans = [next_week.span()]
+        offset = 0
+        if weekday:
+            offset = WEEKDAY_INDEX[weekday.group("weekday")]
+            spans.append(weekday.span())
+        return monday + timedelta(days=offset), "next_week", spans, None
+    if weekday:
+        # Siempre la próxima ocurrencia: "lunes" dicho un lunes es el de la semana que viene
+        days_ahead = (WEEKDAY_INDEX[weekday.group("weekday")] - reference_date.weekday()) % 7
+        date = reference_date + timedelta(days=days_ahead or 7)
+        return date, "weekday", [weekday.span()], None
+
+    match = RELATIVE_DAY_RE.search(text)
+    if match:
+        kind = RELATIVE_DAY_INDEX[match.group("relative")]
+        date = reference_date + timedelta(days=RELATIVE_DAY_OFFSETS[kind])
+        return date, kind, [match.span()], None
+    return None, None, [], None
+
+
+def _match_time(text):
+    """Parte de hora: (hour, minute, spans) o (None, 0, [])"""
+    part_match = DAY_PART_RE.search(text)
+    part = DAY_PART_INDEX[part_match.group("part")] if part_match else None
+    part_spans = [part_match.span()] if part_match else []
+
+    for match in TIME_RE.finditer(text):
+        hour = int(match.group("hour"))
+        minute = int(match.group("minute") or 0)
+        ampm = match.group("ampm")
+        explicit = ampm or match.group("marker") or match.group("minute") is not None
+        if not (explicit or match.group("prefix")) or hour > 23:
+            continue
+        if ampm or part in ("am", "pm"):
+            if hour > 12:
+                pass  # "15h de la tarde": ya es 24h
+            elif (ampm or part[0]) == "p" and hour != 12:
+                hour += 12
+            elif (ampm or part[0]) == "a" and hour == 12:
+                hour = 0
+        elif (
+            1 <= hour <= 7
+            and not match.group("hour").startswith("0")
+            and match.group("marker") not in ("h", "uhr")
+        ):
+            # "a las 3" en una agenda de oficina son las 15:00
+            hour += 12
+        return hour, minute, [match.span()] + part_spans
+
+    if part == "noon":
+        return 12, 0, part_spans
+    return None, 0, []
+
+
+@lru_cache(maxsize=DATE_GRAMMAR_CACHE_SIZE)
+def _resolve_date_cached(text, reference_date):
+    date, kind, spans, clock = _match_day(text, reference_date)
+    utc_offset = None
+    if clock is not None:
+        hour, minute, utc_offset = clock
+    else:
+        hour, minute, time_spans = _match_time(_mask(text, spans))
+        spans = spans + time_spans
+    if date is None and hour is None:
+        return None
+    return DateMatch(date, hour, minute, kind, tuple(sorted(spans)), utc_offset)
+
+
+def resolve_date_text(text, reference_date=None):
+    """📆 Resuelve fechas/horas en es/en/fr/de/it/pt sin dateutil
+
+    Devuelve un DateMatch (memoizado por texto y día de referencia) o None si
+    el texto no contiene nada reconocible.
+    """
+    if not text or not isinstance(text, str):
+        return None
+    if reference_date is None:
+        reference_date = datetime.now(pytz.timezone(DEFAULT_TIMEZONE)).date()
+    return _resolve_date_cached(text.lower(), reference_date)
+
+
+# ========================================
+# 🪜 EXTRACCIÓN POR NIVELES (REGEX ANTES QUE LLM)
+# ========================================
+NOT_SPECIFIED = "Not specified"
+
+EMAIL_RE = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
+
+NAME_PREFIX_RE = re.compile(
+    r"^(?:my name is|my name's|i am|i'm|call me|it's|this is|"
+    r"me llamo|mi nombre es|soy|"
+    r"je m'appelle|je suis|mon nom est|"
+    r"ich heiße|ich bin|mein name ist|"
+    r"mi chiamo|il mio nome è|sono|"
+    r"meu nome é|me chamo|eu sou)\s+",
+    re.IGNORECASE,
+)
+
+NAME_WORD_RE = re.compile(r"^[^\W\d_][^\W\d_'\-]*(?:['\-][^\W\d_]+)*$")
+
+# Palabras de relleno que no aportan datos ("my email is ...", "thanks", "ok")
+FILLER_WORDS = frozenset(
+    (
+        "my", "email", "e-mail", "mail", "is", "it's", "and", "at", "the", "on",
+        "thanks", "thank", "you", "ok", "okay", "yes", "sure", "please", "here",
+        "mi", "correo", "es", "y", "el", "la", "las", "a", "gracias", "sí", "si", "vale",
+        "mon", "adresse", "est", "et", "merci", "oui", "d'accord", "à",
+        "meine", "ist", "und", "danke", "ja", "um", "uhr",
+        "il", "mio", "è", "grazie", "alle", "ore",
+        "meu", "é", "e", "obrigado", "obrigada", "sim", "às", "as",
+    )
+)
+
+# Respuestas y negaciones habituales: nunca son un nombre ("No", "Cancel", "Más tarde")
+REPLY_STOP_WORDS = frozenset(
+    (
+        # en
+        "no", "not", "nope", "cancel", "stop", "now", "why", "what", "who", "how",
+        "when", "where", "help", "maybe", "later", "perfect", "great", "good", "fine",
+        "hmm", "hm", "hi", "hello", "hey", "bye", "sorry", "wait", "nothing", "never",
+        # es
+        "cancelar", "cancela", "para", "basta", "ahora", "después", "despues", "luego",
+        "porque", "porqué", "por", "qué", "que", "ayuda", "quizás", "quizas", "tal",
+        "vez", "perfecto", "hola", "adiós", "adios", "bien", "nada", "nunca", "espera",
+        "cómo", "como", "cuándo", "cuando", "tarde",
+        # fr
+        "non", "annuler", "arrête", "arrêter", "pourquoi", "aide", "peut-être", "plus",
+        "tard", "parfait", "bonjour", "salut", "rien", "jamais", "attends", "quoi",
+        "comment", "maintenant",
+        # de
+        "nein", "nicht", "abbrechen", "stopp", "halt", "warum", "hilfe", "vielleicht",
+        "später", "perfekt", "hallo", "nichts", "nie", "warte", "was", "wie", "jetzt",
+        # it
+        "annulla", "ferma", "perché", "aiuto", "forse", "dopo", "perfetto", "ciao",
+        "niente", "mai", "aspetta", "cosa", "come", "adesso",
+        # pt
+        "não", "nao", "parar", "pare", "porquê", "ajuda", "talvez", "depois",
+        "perfeito", "olá", "ola", "oi", "agora",
+    )
+)
+
+KEYWORD_TOKENS = frozenset(
+    token
+    for keywords in LANGUAGE_KEYWORDS.values()
+    for keyword in keywords
+    for token in LanguageDetector.tokenize(keyword)
+)
+
+
+class TieredExtractor:
+    """Extractores deterministas primero; el LLM solo si falta algo o hay dudas"""
+
+    TIERS = ("email", "datetime", "name", "llm")
+
+    def __init__(self, llm_extract):
+        self.llm_extract = llm_extract
+        self._lock = threading.Lock()
+        self._stats = {
+            tier: {"calls": 0, "hits": 0, "total_time": 0.0} for tier in self.TIERS
+        }
+        self.messages = 0
+        self.resolved_without_llm = 0
+
+    def _record(self, tier, started, hit):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[tier]
+            stats["calls"] += 1
+            stats["total_time"] += elapsed
+            if hit:
+                stats["hits"] += 1
+
+    # ----- Niveles deterministas -----
+    def extract_email(self, text):
+        match = EMAIL_RE.search(text)
+        return (match.group(0), [match.span()]) if match else (None, [])
+
+    def extract_datetime(self, text):
+        """Devuelve la fecha de la gramática si el mensaje trae un día concluyente"""
+        match = resolve_date_text(text)
+        if match is None or match.date is None:
+            return None, []
+        return match.as_text(), list(match.spans)
+
+    def extract_name(self, text, state):
+        """Solo cuando la conversación espera el nombre y hay señales de que lo es
+
+        Se acepta con prefijo explícito ("me llamo ..."), dos o más palabras en
+        mayúscula o un nombre conocido; cualquier otra respuesta va al LLM.
+        """
+        if state is None or state.state not in ("waiting_name", "booking_started"):
+            return None, []
+        candidate = text.strip()
+        offset = 0
+        prefix = NAME_PREFIX_RE.match(candidate)
+        if prefix:
+            offset = prefix.end()
+        words = candidate[offset:].strip(" .,!¡?¿").split()
+        if not 1 <= len(words) <= 4:
+            return None, []
+        for word in words:
+            lower = word.lower()
+            if not NAME_WORD_RE.match(word):
+                return None, []
+            if lower in FILLER_WORDS or lower in REPLY_STOP_WORDS or (
+                lower in KEYWORD_TOKENS and lower not in COMMON_NAMES
+            ):
+                return None, []
+        # 🎯 Puerta de confianza: sin ninguna señal, mejor preguntar al LLM
+        capitalised = sum(1 for word in words if word[:1].isupper())
+        if not (
+            prefix
+            or capitalised >= 2
+            or any(word.lower() in COMMON_NAMES for word in words)
+        ):
+            return None, []
+        name = " ".join(w if not w.islower() else w[:1].upper() + w[1:] for w in words)
+        return name, [(0, len(text))]
+
+    @staticmethod
+    def _residual(text, spans):
+        """Texto que ningún extractor determinista ha explicado"""
+        chars = list(text)
+        for start, end in spans:
+            for i in range(start, end):
+                chars[i] = " "
+        words = re.findall(r"[\w'@.\-]+", "".join(chars).lower())
+        return [w for w in words if w.strip(".-") and w not in FILLER_WORDS]
+
+    # ----- Orquestación -----
+    def extract(self, message, language="en", state=None):
+        with self._lock:
+            self.messages += 1
+        result = {"nombre": NOT_SPECIFIED, "email": NOT_SPECIFIED, "fecha": NOT_SPECIFIED}
+        spans = []
+
+        started = time.perf_counter()
+        email, found = self.extract_email(message)
+        self._record("email", started, bool(email))
+        if email:
+            result["email"] = email
+            spans.extend(found)
+
+        started = time.perf_counter()
+        fecha, found = self.extract_datetime(message)
+        self._record("datetime", started, bool(fecha))
+        if fecha:
+            result["fecha"] = fecha
+            spans.extend(found)
+
+        if not email and not fecha:
+            started = time.perf_counter()
+            name, found = self.extract_name(message, state)
+            self._record("name", started, bool(name))
+            if name:
+                result["nombre"] = name
+                spans.extend(found)
+
+        if spans and not self._residual(message, spans):
+            with self._lock:
+                self.resolved_without_llm += 1
+            logger.info(f"🪜 Extracción determinista (sin LLM): {result}")
+            return result
+
+        # 🤖 Escalar al LLM; lo determinista gana en email, el LLM completa el resto
+        started = time.perf_counter()
+        llm_result = self.llm_extract(message, language) or {}
+        self._record("llm", started, True)
+        merged = dict(result)
+        for field in ("nombre", "fecha"):
+            value = llm_result.get(field) or llm_result.get(
+                {"nombre": "name", "fecha": "date"}[field]
+            )
+            if value and str(value).strip().lower() not in (
+                "not specified",
+                "no especificado",
+                "unspecified",
+            ):
+                merged[field] = value
+        if merged["email"] == NOT_SPECIFIED and llm_result.get("email"):
+            merged["email"] = llm_result["email"]
+        return merged
+
+    def stats(self):
+        """📊 Tasa de acierto y latencia por nivel, llamadas LLM ahorradas"""
+        with self._lock:
+            tiers = {
+                tier: {
+                    "calls": stats["calls"],
+                    "hits": stats["hits"],
+                    "hit_rate": round(stats["hits"] / stats["calls"], 3)
+                    if stats["calls"]
+                    else 0.0,
+                    "avg_latency_ms": round(
+                        stats["total_time"] / stats["calls"] * 1000, 3
+                    )
+                    if stats["calls"]
+                    else 0.0,
+                }
+                for tier, stats in self._stats.items()
             }
+            return {
+                "messages": self.messages,
+                "llm_calls": self._stats["llm"]["calls"],
+                "llm_calls_saved": self.resolved_without_llm,
+                "tiers": tiers,
+            }
+
+
+# ========================================
+# 🤖 AGENTE WHATSAPP CON VOZ
+# ========================================
+class ConversationState:
+    def __init__(self, phone_number):
+        self.phone_number = phone_number
+        self.state = "initial"
+        self.language = "en"
+        self.data = {"name": None, "email": None, "date": None}
+        self.last_updated = datetime.now()
+
+
+class ConversationStore:
+    """Estados de conversación acotados: expiran por inactividad (last_updated) y LRU"""
+
+    def __init__(self, max_size=CONVERSATION_MAX_SIZE, idle_ttl=CONVERSATION_IDLE_TTL):
+        self.max_size = max(1, int(max_size))
+        self.idle_ttl = timedelta(seconds=idle_ttl)
+        # Ordenado por última actividad: el primero es siempre el más inactivo
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.removed = 0
+
+    def _is_expired(self, state, now):
+        return now - state.last_updated > self.idle_ttl
+
+    def _sweep(self, now):
+        """Expira desde el frente; se detiene en el primer estado activo (sin recorrer todo)"""
+        while self._states:
+            phone_number, state = next(iter(self._states.items()))
+            if not self._is_expired(state, now):
+                break
+            del self._states[phone_number]
+            self.expired += 1
+
+    def get_or_create(self, phone_number):
+        now = datetime.now()
+        with self._lock:
+            self._sweep(now)
+            state = self._states.get(phone_number)
+            if state is None:
+                state = ConversationState(phone_number)
+                self._states[phone_number] = state
+                self.created += 1
+                while len(self._states) > self.max_size:
+                    self._states.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._states.move_to_end(phone_number)
+            state.last_updated = now
+            return state
+
+    def get(self, phone_number, default=None):
+        with self._lock:
+            state = self._states.get(phone_number)
+            if state is None or self._is_expired(state, datetime.now()):
+                return default
+            return state
+
+    def pop(self, phone_number, default=None):
+        with self._lock:
+            state = self._states.pop(phone_number, None)
+            if state is None:
+                return default
+            self.removed += 1
+            return state
+
+    def sweep(self):
+        with self._lock:
+            self._sweep(datetime.now())
+
+    def __contains__(self, phone_number):
+        return self.get(phone_number) is not None
+
+    def __delitem__(self, phone_number):
+        if self.pop(phone_number) is None:
+            raise KeyError(phone_number)
+
+    def __len__(self):
+        """Conversaciones vivas: las inactivas se expiran antes de contar"""
+        with self._lock:
+            self._sweep(datetime.now())
+            return len(self._states)
+
+    def stats(self):
+        """📊 Conversaciones vivas, expiradas, expulsadas y completadas"""
+        with self._lock:
+            self._sweep(datetime.now())
+            return {
+                "live": len(self._states),
+                "max_size": self.max_size,
+                "idle_ttl_s": self.idle_ttl.total_seconds(),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "removed": self.removed,
+            }
+
+
+class WhatsAppVoiceAgent:
+    def __init__(self, messenger, openai_client=None, sheets_integration=None):
+        self.language_responses_obj = LanguageResponses()
+        self.language_responses = self.language_responses_obj.language_responses
+        self.default_timezone = DEFAULT_TIMEZONE
+        self.conversation_states = ConversationStore()
+        self.messenger = messenger
+        # Sin cliente propio se usa el compartido del proceso (get_openai_client)
+        self.openai_client = openai_client
+        self.sheets_integration = (
+            sheets_integration if sheets_integration is not None else GoogleSheetsIntegration()
+        )
+        cache_backend = build_cache(
+            EXTRACTION_CACHE_BACKEND,
+            maxsize=EXTRACTION_CACHE_SIZE,
+            ttl=EXTRACTION_CACHE_TTL,
+            path=EXTRACTION_CACHE_PATH,
+            table="extraction_cache",
+        )
+        self.extraction_cache = (
+            ExtractionCache(cache_backend) if cache_backend is not None else None
+        )
+        self.tiered_extractor = TieredExtractor(self._extract_with_llm)
+        logger.info("🤖 Agente de voz WhatsApp inicializado")
+        logger.info(f"⏰ Zona horaria configurada: {self.default_timezone}")
 
-            best_lang = max(counts, key=counts.get)
-            score = counts[best_lang]
+    def get_response(self, key, language="en", **kwargs):
+        return self.language_responses_obj.get_response(key, language, **kwargs)
 
-            if score == 0 or len(text.strip()) < 5:
-                return "en"
+    def get_or_create_conversation_state(self, phone_number):
+        return self.conversation_states.get_or_create(phone_number)
 
-            logger.info(f"🌍 Idioma detectado: {best_lang} (score: {score})")
+    def detect_language(self, text):
+        """🌍 DETECCIÓN DE IDIOMA COMPLETA - 6 IDIOMAS"""
+        try:
+            best_lang, score = language_detector.detect(text)
+            if score:
+                logger.info(f"🌍 Idioma detectado: {best_lang} (score: {score})")
             return best_lang
 
         except Exception as e:
             logger.error(f"❌ Error detectando idioma: {e}")
             return "en"
 
-    def extract_booking_data(self, message, language="en"):
+    @timed_stage("extract_booking_data")
+    def extract_booking_data(self, message, language="en", state=None):
+        """🪜 EXTRACCIÓN POR NIVELES: regex/gramática primero, GPT-4O-MINI si hace falta"""
+        return self.tiered_extractor.extract(message, language, state)
+
+    def _extract_with_llm(self, message, language="en"):
         """🎙️ EXTRACCIÓN DE DATOS CON GPT-4O-MINI - MULTILINGÜE"""
         try:
             if not OPENAI_API_KEY:
                 logger.warning("⚠️ OpenAI API key no disponible, usando extracción básica")
                 return self.basic_data_extraction(message, language)
 
+            # 🗄️ Mensajes repetidos ("yes", "tomorrow at 3pm") no pagan otra llamada
+            if self.extraction_cache:
+                cached = self.extraction_cache.get(message, language)
+                if cached is not None:
+                    logger.info(f"🗄️ Extracción desde caché: {cached}")
+                    return cached
+
             # Prompts específicos por idioma
             language_names = {
                 "es": "español",
@@ -693,19 +2579,23 @@ Responda ÚNICAMENTE con un JSON válido sin texto adicional:
     "fecha": "valor_extraído_o_No_especificado"
 }}"""
 
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Mensaje del usuario: {message}"},
-                ],
-                max_tokens=200,
-                temperature=0.3,
-            )
+            with StageTimer("llm_extraction"):
+                response = (self.openai_client or get_openai_client()).chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"Mensaje del usuario: {message}"},
+                    ],
+                    max_tokens=200,
+                    temperature=0.3,
+                )
 
             response_text = response.choices[0].message.content.strip()
             logger.info(f"🔍 Extracción OpenAI: {response_text}")
-            return json.loads(response_text)
+            extracted = json.loads(response_text)
+            if self.extraction_cache and isinstance(extracted, dict):
+                self.extraction_cache.set(message, language, extracted)
+            return extracted
 
         except json.JSONDecodeError:
             logger.warning(f"⚠️ No se pudo parsear JSON, usando extracción básica")
@@ -717,13 +2607,10 @@ Responda ÚNICAMENTE con un JSON válido sin texto adicional:
     def basic_data_extraction(self, message, language="en"):
         """🔍 EXTRACCIÓN BÁSICA SIN OPENAI - MULTILINGÜE"""
         try:
-            import re
-
             message_lower = message.lower()
 
             # Email (universal)
-            email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-            email_match = re.search(email_pattern, message)
+            email_match = EMAIL_RE.search(message)
             email = email_match.group(0) if email_match else "Not specified"
 
             # Nombre (palabras con mayúscula inicial)
@@ -743,80 +2630,41 @@ Responda ÚNICAMENTE con un JSON válido sin texto adicional:
                 " ".join(potential_names[:3]) if potential_names else "Not specified"
             )
 
-            # FECHA COMPLETA CON HORA - si el usuario la especifica
+            # FECHA COMPLETA CON HORA - gramática precompilada, dateutil como último recurso
             date_text = message_lower
+            now = datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
+            match = resolve_date_text(message, now.date())
 
-            # 🎯 Buscar patrones de hora: "12 PM", "3:30 PM", "14:00", "9am"
-            time_pattern = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
-            time_match = re.search(time_pattern, date_text, re.IGNORECASE)
-
-            # Hora por defecto (10 AM)
-            hour = 10
-            minute = 0
-
-            if time_match:
-                hour = int(time_match.group(1))
-                minute = int(time_match.group(2)) if time_match.group(2) else 0
-                ampm = time_match.group(3)
-
-                if ampm:
-                    ampm = ampm.lower().replace(".", "")
-                    if ampm == "pm" and hour != 12:
-                        hour += 12
-                    elif ampm == "am" and hour == 12:
-                        hour = 0
-
-            # Intentar parsear fecha específica
-            try:
-                dt = parser.parse(date_text, fuzzy=True)
-                if dt.tzinfo is None:
-                    dt = pytz.timezone(DEFAULT_TIMEZONE).localize(dt)
-                else:
-                    dt = dt.astimezone(pytz.timezone(DEFAULT_TIMEZONE))
+            if match and match.date is not None:
+                full_date = match.as_text()
+            else:
+                # Hora por defecto (10 AM) o la que haya reconocido la gramática
+                hour, minute = 10, 0
+                if match:
+                    hour, minute = match.hour, match.minute
+                try:
+                    dt = parser.parse(date_text, fuzzy=True)
+                    if dt.tzinfo is None:
+                        dt = pytz.timezone(DEFAULT_TIMEZONE).localize(dt)
+                    else:
+                        dt = dt.astimezone(pytz.timezone(DEFAULT_TIMEZONE))
 
-                # Si no se especificó hora, usar la hora extraída o por defecto
-                if dt.hour == 0 and dt.minute == 0:
-                    dt = dt.replace(hour=hour, minute=minute)
+                    # Si no se especificó hora, usar la hora extraída o por defecto
+                    if dt.hour == 0 and dt.minute == 0:
+                        dt = dt.replace(hour=hour, minute=minute)
 
-                # Si la fecha es hoy y la hora ya pasó, mover a mañana
-                now = datetime.now(pytz.timezone(DEFAULT_TIMEZONE))
-                if dt.date() == now.date() and dt <= now:
-                    dt = dt + timedelta(days=1)
+                    # Si la fecha es hoy y la hora ya pasó, mover a mañana
+                    if dt.date() == now.date() and dt <= now:
+                        dt = dt + timedelta(days=1)
 
-                date_str = dt.strftime("%Y-%m-%d %H:%M")
-            except:
-                # Si no se puede parsear fecha específica, usar "tomorrow" con la hora extraída
-                if any(
-                    word in date_text
-                    for word in [
-                        "tomorrow",
-                        "mañana",
-                        "demain",
-                        "morgen",
-                        "domani",
-                        "amanhã",
-                    ]
-                ):
-                    base_date = "tomorrow"
-                elif any(
-                    word in date_text
-                    for word in ["today", "hoy", "aujourd'hui", "heute", "oggi", "hoje"]
-                ):
-                    base_date = "today"
-                else:
+                    full_date = dt.strftime("%Y-%m-%d %H:%M")
+                except:
                     return {
                         "nombre": name,
                         "email": email,
                         "fecha": "Not specified",
                     }
 
-                # Si encuentra hora específica, agregarla a la fecha base
-                if time_match:
-                    time_str = f"{hour:02d}:{minute:02d}"
-                    full_date = f"{base_date} at {time_str}"
-                else:
-                    full_date = base_date
-
             logger.info(
                 f"🔍 Extracción básica: nombre='{name}', email='{email}', fecha='{full_date}'"
             )
@@ -971,7 +2819,7 @@ Responda ÚNICAMENTE con un JSON válido sin texto adicional:
                 }
 
             # Extraer datos
-            extracted = self.extract_booking_data(message, language)
+            extracted = self.extract_booking_data(message, language, state)
             logger.info(f"🔍 Datos extraídos: {extracted}")
 
             def clean(v):
@@ -1090,195 +2938,1252 @@ Responda ÚNICAMENTE con un JSON válido sin texto adicional:
             }
 
     def send_whatsapp_message(self, to_number, message):
-        """Envía mensaje por WhatsApp"""
-        try:
-            url = f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
-            data = {
-                "From": f"whatsapp:{TWILIO_PHONE_NUMBER}",
-                "To": f"whatsapp:{to_number}",
-                "Body": message,
-            }
-            response = requests.post(
-                url, data=data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-            )
-
-            if response.status_code == 201:
-                logger.info(f"✅ Mensaje enviado a {to_number}")
-                return True
-            else:
-                error_text = response.text
-                if "unverified number" in error_text.lower():
-                    logger.error(f"❌ MODO TRIAL: Número no verificado {to_number}")
-                    self.send_whatsapp_message(
-                        to_number, self.get_response("trial_mode_warning", "en")
-                    )
-                else:
-                    logger.error(
-                        f"❌ Error enviando mensaje: {response.status_code} - {error_text}"
-                    )
-                return False
-        except Exception as e:
-            logger.error(f"❌ Error enviando mensaje WhatsApp: {e}")
-            return False
+        """Envía mensaje por WhatsApp (a través de la cola de salida)"""
+        return self.messenger.send(to_number, message)
 
 
 # ========================================
-# 🚀 FLASK APPLICATION
-# ========================================
-app = Flask(__name__)
-agent = WhatsAppVoiceAgent()
-
-# ========================================
-# ⭐ CORRECCIÓN CRÍTICA: FUNCION NORMALIZAR FECHAS CON HORA
+# 🧵 COLA DE TRABAJOS CON POOL DE WORKERS
 # ========================================
-def normalize_date_to_iso(date_text, timezone="America/New_York"):
-    """🛠️ Convierte texto natural en fecha ISO EXACTA para Cal.com
+class JobQueue:
+    """Procesa los mensajes del webhook en workers de segundo plano
 
-    IMPORTANTE: Cal.com REQUIERE formato exacto YYYY-MM-DDTHH:MM:SSZ (en UTC)
+    Los trabajos con ``key`` (el número del remitente) van a un buzón por clave:
+    solo un worker a la vez drena cada buzón, en orden de llegada, mientras que
+    remitentes distintos se procesan en paralelo.
     """
-    try:
-        if not date_text or not isinstance(date_text, str):
-            logger.error("❌ Fecha inválida o vacía")
-            return None
-
-        date_text = date_text.strip()
-        tz = pytz.timezone(timezone)
-        now = datetime.now(tz)
-
-        # 🎯 EXTRAER HORA ESPECÍFICA si el usuario la menciona
-        time_pattern = r"(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)?"
-        time_match = re.search(time_pattern, date_text, re.IGNORECASE)
-
-        # Hora por defecto (10 AM)
-        hour = 10
-        minute = 0
-
-        if time_match:
-            hour = int(time_match.group(1))
-            minute = int(time_match.group(2)) if time_match.group(2) else 0
-            ampm = time_match.group(3).lower() if time_match.group(3) else None
 
-            # Convertir de 12h a 24h
-            if ampm:
-                if ampm.startswith("p") and hour != 12:
-                    hour += 12
-                elif ampm.startswith("a") and hour == 12:
-                    hour = 0
-
-        # 1️⃣ Parsear fecha natural
-        date_lower = date_text.lower()
-        if any(
-            word in date_lower
-            for word in [
-                "tomorrow",
-                "mañana",
-                "demain",
-                "morgen",
-                "domani",
-                "amanhã",
-            ]
-        ):
-            # Mañana = día siguiente a medianoche
-            dt = now + timedelta(days=1)
-            dt = dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        elif any(
-            word in date_lower
-            for word in ["today", "hoy", "aujourd'hui", "heute", "oggi", "hoje"]
-        ):
-            # Hoy = hoy a la hora especificada, pero si ya pasó, usar mañana
-            dt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if dt <= now:
-                dt = dt + timedelta(days=1)
-        else:
+    def __init__(self, num_workers=WORKER_POOL_SIZE, maxsize=JOB_QUEUE_MAXSIZE):
+        self.num_workers = max(1, int(num_workers))
+        self.maxsize = maxsize
+        self._queue = queue.Queue()
+        self._mailboxes = {}  # key -> deque de trabajos pendientes de ese remitente
+        self._lock = threading.Lock()
+        self._workers = []
+        self._busy = 0
+        self._queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._total_wait = 0.0
+
+    def start(self):
+        """Arranca los workers (solo la primera vez)"""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                worker.start()
+                self._workers.append(worker)
+        logger.info(f"🧵 Pool de workers iniciado ({self.num_workers} workers)")
+
+    def reset_after_fork(self):
+        """Tras un fork los workers no existen: se vuelven a arrancar en el primer submit"""
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._mailboxes = {}
+        self._workers = []
+        self._busy = 0
+        self._queued = 0
+
+    def submit(self, func, *args, key=None, **kwargs):
+        """Encola un trabajo. Devuelve False si la cola está llena"""
+        self.start()
+        job = (func, args, kwargs, time.monotonic())
+        with self._lock:
+            if self.maxsize and self._queued >= self.maxsize:
+                self.rejected += 1
+                logger.warning(
+                    f"⚠️ Cola de trabajos llena ({self.maxsize}), trabajo rechazado"
+                )
+                return False
+            if key is None:
+                self._queue.put(("job", job))
+            elif key in self._mailboxes:
+                # Ya hay un worker (o un turno en cola) para este remitente
+                self._mailboxes[key].append(job)
+            else:
+                self._mailboxes[key] = deque([job])
+                self._queue.put(("mailbox", key))
+            self._queued += 1
+            self.submitted += 1
+        return True
+
+    def _worker_loop(self):
+        while True:
+            kind, payload = self._queue.get()
             try:
-                # Intentar parsear fecha específica
-                dt = parser.parse(date_text, fuzzy=True)
-                if dt.tzinfo is None:
-                    dt = tz.localize(dt)
+                if kind == "mailbox":
+                    self._drain_mailbox(payload)
                 else:
-                    dt = dt.astimezone(tz)
+                    self._run(payload)
+            finally:
+                self._queue.task_done()
+
+    def _drain_mailbox(self, key):
+        while True:
+            with self._lock:
+                mailbox = self._mailboxes.get(key)
+                if not mailbox:
+                    self._mailboxes.pop(key, None)
+                    return
+                job = mailbox.popleft()
+            self._run(job)
+
+    def _run(self, job):
+        func, args, kwargs, enqueued_at = job
+        with self._lock:
+            self._queued -= 1
+            self._busy += 1
+            self._total_wait += time.monotonic() - enqueued_at
+        ok = False
+        try:
+            func(*args, **kwargs)
+            ok = True
+        except Exception as e:
+            logger.error(f"❌ Error en worker procesando trabajo: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._busy -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
 
-                # Si no se especificó hora, usar la hora extraída o por defecto
-                if dt.hour == 0 and dt.minute == 0:
-                    dt = dt.replace(hour=hour, minute=minute)
+    def stats(self):
+        """📊 Profundidad de cola y utilización de workers"""
+        with self._lock:
+            started = self.completed + self.failed + self._busy
+            return {
+                "mode": WEBHOOK_MODE,
+                "workers": self.num_workers,
+                "busy_workers": self._busy,
+                "utilization": round(self._busy / self.num_workers, 3),
+                "queue_depth": self._queued,
+                "queue_maxsize": self.maxsize,
+                "active_senders": len(self._mailboxes),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self._total_wait / started * 1000, 2)
+                if started
+                else 0.0,
+            }
 
-                # Si la fecha es hoy y la hora ya pasó, mover a mañana
-                if dt.date() == now.date() and dt <= now:
-                    dt = dt + timedelta(days=1)
-            except:
-                logger.error(f"❌ No se pudo parsear la fecha: {date_text}")
-                return None
 
-        # 2️⃣ Asegurar que la fecha sea FUTURA
-        if dt <= now:
-            logger.warning(f"⚠️ Fecha {dt} es pasada, moviendo a mañana")
-            dt = now + timedelta(days=1)
-            dt = dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
+class SenderSerializer:
+    """Turnos FIFO por remitente para el modo sync: un mensaje a la vez por número"""
 
-        # 3️⃣ Convertir a UTC
-        dt_utc = dt.astimezone(pytz.utc)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}  # key -> deque de threading.Event, el primero tiene el turno
+
+    def turn(self, key):
+        """Reserva el turno en orden de llegada; usar con ``with``"""
+        event = threading.Event()
+        with self._lock:
+            waiters = self._waiters.setdefault(key, deque())
+            waiters.append(event)
+            if len(waiters) == 1:
+                event.set()
+        return _SenderTurn(self, key, event)
+
+    def _release(self, key, event):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                return
+            if waiters[0] is event:
+                waiters.popleft()
+                if waiters:
+                    waiters[0].set()
+            else:
+                waiters.remove(event)
+            if not waiters:
+                del self._waiters[key]
 
-        # 4️⃣ Formato EXACTO que Cal.com requiere: YYYY-MM-DDTHH:MM:SSZ
-        iso_date = dt_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
+    def stats(self):
+        with self._lock:
+            return {
+                "active_senders": len(self._waiters),
+                "waiting_messages": sum(len(w) - 1 for w in self._waiters.values()),
+            }
 
-        logger.info(f"📅 Fecha convertida: '{date_text}' → {iso_date}")
-        return iso_date
 
-    except Exception as e:
-        logger.error(f"❌ Error normalizando fecha '{date_text}': {e}")
-        return None
+class _SenderTurn:
+    def __init__(self, serializer, key, event):
+        self._serializer = serializer
+        self._key = key
+        self._event = event
+
+    def __enter__(self):
+        self._event.wait()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._serializer._release(self._key, self._event)
+        return False
 
 
 # ========================================
-# 🎵 MANEJO DE MENSAJES DE VOZ
+# 📤 MENSAJES SALIENTES (cola por destinatario + rate limit de Twilio)
 # ========================================
-def handle_voice_message(audio_url, from_number, language="en"):
-    """Maneja mensajes de voz"""
-    try:
-        logger.info("🎤 Procesando mensaje de voz...")
-        response = requests.get(
-            audio_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        )
+class TokenBucket:
+    """Rate limit tipo token bucket: ``rate`` envíos por segundo con ráfagas de ``capacity``"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = max(0.001, float(rate))
+        self.capacity = max(1.0, float(capacity or rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                self.throttled_seconds += wait
+            time.sleep(wait)
 
-        if response.status_code != 200:
-            logger.error(f"❌ Error descargando audio: {response.status_code}")
-            return agent.get_response("generic_response", language)
 
-        audio_data = response.content
-        temp_filename = None
+class OutboundMessenger:
+    """Envía los mensajes de WhatsApp fuera del hilo de la petición
 
-        try:
-            with tempfile.NamedTemporaryFile(suffix=".ogg", delete=False) as temp_file:
-                temp_file.write(audio_data)
-                temp_filename = temp_file.name
-
-            # Transcribir con OpenAI Whisper
-            with open(temp_filename, "rb") as audio_file:
-                transcription_result = client.audio.transcriptions.create(
-                    model="whisper-1", file=audio_file
+    Cada destinatario tiene su propia cola: un solo hilo a la vez la drena, así
+    que los mensajes llegan en orden. Los mensajes generados dentro de un
+    ``cycle(to_number)`` se unen en un único envío al cerrar el ciclo.
+    """
+
+    def __init__(
+        self,
+        transport,
+        mode=OUTBOUND_MODE,
+        num_senders=OUTBOUND_SENDERS,
+        rate=OUTBOUND_RATE_PER_SECOND,
+        burst=OUTBOUND_BURST,
+        coalesce=OUTBOUND_COALESCE,
+        max_attempts=OUTBOUND_MAX_ATTEMPTS,
+        history=OUTBOUND_STATUS_HISTORY,
+    ):
+        self.transport = transport
+        self.mode = mode
+        self.num_senders = max(1, int(num_senders))
+        self.coalesce = coalesce
+        self.max_attempts = max(1, int(max_attempts))
+        self.history = max(1, int(history))
+        self.bucket = TokenBucket(rate, burst)
+        self._queue = queue.Queue()
+        self._mailboxes = {}  # to_number -> deque de mensajes pendientes
+        self._records = OrderedDict()  # id interno -> registro de entrega
+        self._by_twilio_sid = {}
+        self._cycles = threading.local()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._senders = []
+        self._pending = 0
+        self.coalesced = 0
+        self.counts = {
+            "queued": 0,
+            "sent": 0,
+            "inline": 0,
+            "failed": 0,
+            "undeliverable": 0,
+            "retried": 0,
+        }
+
+    def start(self):
+        """Arranca los hilos de envío (solo la primera vez)"""
+        with self._lock:
+            if self._senders:
+                return
+            for i in range(self.num_senders):
+                sender = threading.Thread(
+                    target=self._sender_loop, name=f"outbound-sender-{i}", daemon=True
                 )
+                sender.start()
+                self._senders.append(sender)
+        atexit.register(self.flush)
+        logger.info(f"📤 Envío de mensajes en segundo plano ({self.num_senders} hilos)")
+
+    def reset_after_fork(self):
+        """Tras un fork los hilos de envío no existen: colas vacías y arranque perezoso"""
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._queue = queue.Queue()
+        self._mailboxes = {}
+        self._cycles = threading.local()
+        self._senders = []
+        self._pending = 0
+
+    # ---- ciclos de procesamiento ----
+    def cycle(self, to_number, reply_slot=None):
+        """Agrupa los mensajes a ``to_number`` hasta cerrar el ciclo; usar con ``with``
+
+        Con ``reply_slot`` (modo TwiML) la respuesta se entrega al webhook que
+        espera; si ya no espera, sale por REST como siempre.
+        """
+        return _OutboundCycle(self, to_number, reply_slot)
+
+    def _open_cycle(self, to_number, reply_slot=None):
+        cycles = self._cycles.__dict__.setdefault("open", {})
+        depth, parts, slot = cycles.get(to_number, (0, [], None))
+        cycles[to_number] = (depth + 1, parts, slot or reply_slot)
+
+    def _close_cycle(self, to_number):
+        cycles = self._cycles.__dict__.get("open", {})
+        depth, parts, slot = cycles.pop(to_number, (1, [], None))
+        if depth > 1:
+            cycles[to_number] = (depth - 1, parts, slot)
+            return
+        bodies = self._merge(parts)
+        if slot is not None and slot.offer(bodies):
+            self._record_inline(to_number, bodies)
+            return
+        for body in bodies:
+            self._submit(to_number, body)
+
+    def _merge(self, parts):
+        """Une los textos del ciclo respetando el límite de 1600 caracteres de WhatsApp"""
+        if not self.coalesce or len(parts) < 2:
+            return parts
+        merged = []
+        for part in parts:
+            if merged and len(merged[-1]) + len(part) + 2 <= 1600:
+                merged[-1] = f"{merged[-1]}\n\n{part}"
+            else:
+                merged.append(part)
+        with self._lock:
+            self.coalesced += len(parts) - len(merged)
+        return merged
+
+    # ---- envío ----
+    def send(self, to_number, body):
+        """Encola (o agrupa en el ciclo abierto) un mensaje. Devuelve False si no se acepta"""
+        cycles = self._cycles.__dict__.get("open", {})
+        if to_number in cycles:
+            cycles[to_number][1].append(body)
+            return True
+        return self._submit(to_number, body)
+
+    def _new_record(self, to_number, status):
+        record = {
+            "id": uuid.uuid4().hex,
+            "to": to_number,
+            "status": status,
+            "attempts": 0,
+            "twilio_sid": None,
+            "error": None,
+            "queued_at": time.time(),
+        }
+        with self._lock:
+            self._records[record["id"]] = record
+            while len(self._records) > self.history:
+                _, old = self._records.popitem(last=False)
+                self._by_twilio_sid.pop(old.get("twilio_sid"), None)
+            self.counts[status] += 1
+        return record
+
+    def _record_inline(self, to_number, bodies):
+        """Registra las respuestas que viajan en el TwiML del webhook"""
+        for _ in bodies:
+            self._new_record(to_number, "inline")
+
+    def _submit(self, to_number, body):
+        record = self._new_record(to_number, "queued")
+        if self.mode != "queue":
+            return self._deliver(record, body)
+
+        self.start()
+        with self._lock:
+            self._pending += 1
+            if to_number in self._mailboxes:
+                self._mailboxes[to_number].append((record, body))
+            else:
+                self._mailboxes[to_number] = deque([(record, body)])
+                self._queue.put(to_number)
+        return True
 
-            transcribed_text = (transcription_result.text or "").strip()
-            logger.info(f"📝 Texto extraído: {transcribed_text}")
+    def _sender_loop(self):
+        while True:
+            to_number = self._queue.get()
+            try:
+                while True:
+                    with self._lock:
+                        mailbox = self._mailboxes.get(to_number)
+                        if not mailbox:
+                            self._mailboxes.pop(to_number, None)
+                            break
+                        record, body = mailbox.popleft()
+                    try:
+                        self._deliver(record, body)
+                    finally:
+                        with self._lock:
+                            self._pending -= 1
+                            self._idle.notify_all()
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, record, body):
+        """POST a Twilio con reintentos ante 429/5xx. Devuelve True si se aceptó"""
+        url = f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json"
+        data = {
+            "From": f"whatsapp:{TWILIO_PHONE_NUMBER}",
+            "To": f"whatsapp:{record['to']}",
+            "Body": body,
+        }
+        if OUTBOUND_STATUS_CALLBACK_URL:
+            data["StatusCallback"] = OUTBOUND_STATUS_CALLBACK_URL
+
+        while True:
+            self.bucket.acquire()
+            record["attempts"] += 1
+            record["status"] = "sending"
+            retryable = False
+            try:
+                with StageTimer("send_whatsapp_message") as send_timer:
+                    response = self.transport.post(
+                        "twilio", url, data=data, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+                    )
+                    if response.status_code != 201:
+                        send_timer.fail()
+                if response.status_code == 201:
+                    try:
+                        twilio_sid = response.json().get("sid")
+                    except ValueError:
+                        twilio_sid = None
+                    self._finish(record, "sent", twilio_sid=twilio_sid)
+                    logger.info(f"✅ Mensaje enviado a {record['to']}")
+                    return True
+                error_text = response.text
+                if "unverified number" in error_text.lower():
+                    # En modo trial no se puede escribir a ese número: avisarle tampoco llegaría
+                    logger.error(f"❌ MODO TRIAL: Número no verificado {record['to']}")
+                    self._finish(record, "undeliverable", error="unverified number")
+                    return False
+                retryable = response.status_code == 429 or response.status_code >= 500
+                error = f"{response.status_code} - {error_text}"
+            except requests.exceptions.RequestException as e:
+                retryable = True
+                error = str(e)
+            except Exception as e:
+                error = str(e)
 
-            # Detectar idioma y procesar
-            detected_language = agent.detect_language(transcribed_text)
-            response_data = agent.get_contextual_response(
-                transcribed_text, from_number, detected_language
-            )
+            if not retryable or record["attempts"] >= self.max_attempts:
+                logger.error(f"❌ Error enviando mensaje: {error}")
+                self._finish(record, "failed", error=error)
+                return False
+            with self._lock:
+                self.counts["retried"] += 1
+            delay = min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * 2 ** (record["attempts"] - 1))
+            logger.warning(f"⚠️ Reintentando envío a {record['to']} en {delay:.1f}s: {error}")
+            time.sleep(delay)
+
+    def _finish(self, record, status, twilio_sid=None, error=None):
+        with self._lock:
+            record["status"] = status
+            record["error"] = error
+            record["finished_at"] = time.time()
+            if twilio_sid:
+                record["twilio_sid"] = twilio_sid
+                self._by_twilio_sid[twilio_sid] = record
+            self.counts[status] += 1
+
+    # ---- estado de entrega ----
+    def update_delivery(self, twilio_sid, status, error_code=None):
+        """Aplica un StatusCallback de Twilio (sent, delivered, read, failed...)"""
+        with self._lock:
+            record = self._by_twilio_sid.get(twilio_sid)
+            if not record:
+                return False
+            record["delivery_status"] = status
+            if error_code:
+                record["error"] = f"Twilio error {error_code}"
+            return True
 
-            # Enviar respuesta
-            if "message" in response_data:
-                agent.send_whatsapp_message(from_number, response_data["message"])
+    def flush(self, timeout=10):
+        """Espera a que se vacíen las colas (al apagar el proceso)"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"⚠️ {self._pending} mensajes salientes sin enviar")
+                    return False
+                self._idle.wait(remaining)
+        return True
 
-            return transcribed_text
-        finally:
-            if temp_filename and os.path.exists(temp_filename):
-                try:
-                    os.unlink(temp_filename)
-                    logger.info(f"🗑️ Archivo temporal limpiado")
-                except:
-                    pass
+    def recent(self, limit=50):
+        with self._lock:
+            return [dict(r) for r in list(self._records.values())[-limit:]]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "senders": self.num_senders,
+                "pending": self._pending,
+                "active_recipients": len(self._mailboxes),
+                "coalesce": self.coalesce,
+                "coalesced": self.coalesced,
+                "rate_per_second": self.bucket.rate,
+                "throttled_seconds": round(self.bucket.throttled_seconds, 3),
+                **self.counts,
+            }
+
+
+class _OutboundCycle:
+    def __init__(self, messenger, to_number, reply_slot=None):
+        self._messenger = messenger
+        self._to_number = to_number
+        self._reply_slot = reply_slot
+
+    def __enter__(self):
+        self._messenger._open_cycle(self._to_number, self._reply_slot)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._messenger._close_cycle(self._to_number)
+        return False
+
+
+class ReplySlot:
+    """Entrega la respuesta de un ciclo al webhook que espera (modo TwiML)
+
+    El primero en llegar gana: si el ciclo termina antes del presupuesto, el
+    webhook devuelve la respuesta como TwiML; si el webhook se rinde antes,
+    ``offer`` devuelve False y el ciclo envía por REST.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._state = "waiting"
+        self._bodies = None
+
+    def offer(self, bodies):
+        with self._lock:
+            if self._state != "waiting":
+                return False
+            self._state = "claimed"
+            self._bodies = bodies
+        self._ready.set()
+        return True
+
+    def wait(self, timeout):
+        """Devuelve los mensajes de respuesta, o None si no llegaron a tiempo"""
+        self._ready.wait(timeout)
+        with self._lock:
+            if self._state == "claimed":
+                return self._bodies
+            self._state = "abandoned"
+            return None
+
+
+def twiml_response(bodies=()):
+    """Respuesta TwiML con un <Message> por texto (vacía = no responder)"""
+    messages = "".join(f"<Message>{xml_escape(body)}</Message>" for body in bodies)
+    return Response(
+        f'<?xml version="1.0" encoding="UTF-8"?><Response>{messages}</Response>',
+        mimetype="text/xml",
+    )
+
+
+# ========================================
+# 🔑 IDEMPOTENCIA DEL WEBHOOK (MessageSid)
+# ========================================
+class IdempotencyStore:
+    """Registra MessageSids en curso y procesados para ignorar reintentos de Twilio
+
+    claim() devuelve "new" (procesar), "in_flight" o "done" (duplicado). Una
+    reserva "in_flight" caduca a los ``inflight_ttl`` segundos por si el worker
+    murió; una "done" a los ``ttl`` segundos.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, inflight_ttl=IDEMPOTENCY_INFLIGHT_TTL):
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self._counter_lock = threading.Lock()
+        self.claims = 0
+        self.duplicates_suppressed = 0
+        self.completed = 0
+        self.released = 0
+
+    def claim(self, message_sid):
+        status = self._claim(message_sid, time.time())
+        with self._counter_lock:
+            self.claims += 1
+            if status != "new":
+                self.duplicates_suppressed += 1
+        return status
+
+    def complete(self, message_sid):
+        self._set_done(message_sid, time.time())
+        with self._counter_lock:
+            self.completed += 1
+
+    def release(self, message_sid):
+        """Libera una reserva fallida para que un reintento pueda procesarla"""
+        self._delete(message_sid)
+        with self._counter_lock:
+            self.released += 1
+
+    def stats(self):
+        with self._counter_lock:
+            return {
+                "backend": self.backend_name,
+                "tracked": len(self),
+                "claims": self.claims,
+                "duplicates_suppressed": self.duplicates_suppressed,
+                "completed": self.completed,
+                "released": self.released,
+            }
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """Idempotencia en memoria (un solo proceso), acotada y con expiración"""
+
+    backend_name = "memory"
+
+    def __init__(self, max_size=IDEMPOTENCY_MAX_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.max_size = max(1, int(max_size))
+        self._entries = OrderedDict()  # sid -> (status, expires_at), orden de inserción
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        # Las entradas "done" comparten TTL: las más antiguas están al frente
+        while self._entries:
+            sid, (status, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_size:
+                break
+            del self._entries[sid]
+
+    def _claim(self, message_sid, now):
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(message_sid)
+            if entry and entry[1] > now:
+                return entry[0]
+            self._entries[message_sid] = ("in_flight", now + self.inflight_ttl)
+            self._entries.move_to_end(message_sid)
+            return "new"
+
+    def _set_done(self, message_sid, now):
+        with self._lock:
+            self._entries[message_sid] = ("done", now + self.ttl)
+            self._entries.move_to_end(message_sid)
+
+    def _delete(self, message_sid):
+        with self._lock:
+            self._entries.pop(message_sid, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """Idempotencia en SQLite: varios procesos workers comparten el mismo fichero"""
+
+    backend_name = "sqlite"
+
+    def __init__(self, path, max_size=IDEMPOTENCY_MAX_SIZE, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = self._connect()
+
+    def _connect(self):
+        # isolation_level=None: transacciones explícitas con BEGIN IMMEDIATE
+        conn = sqlite3.connect(
+            self.path, check_same_thread=False, timeout=10, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_messages ("
+            "sid TEXT PRIMARY KEY, status TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS processed_messages_expires "
+            "ON processed_messages(expires_at)"
+        )
+        return conn
+
+    def reopen(self):
+        """Conexión propia tras un fork: SQLite no admite compartirla entre procesos"""
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _claim(self, message_sid, now):
+        with self._lock:
+            # BEGIN IMMEDIATE toma el lock de escritura: el check-and-set es atómico
+            # también entre procesos
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT status, expires_at FROM processed_messages WHERE sid = ?",
+                    (message_sid,),
+                ).fetchone()
+                if row and row[1] > now:
+                    status = row[0]
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO processed_messages "
+                        "(sid, status, expires_at, created_at) VALUES (?, 'in_flight', ?, ?)",
+                        (message_sid, now + self.inflight_ttl, now),
+                    )
+                    status = "new"
+                    self._writes += 1
+                    if self._writes % 100 == 0:
+                        self._prune(now)
+                self._conn.execute("COMMIT")
+                return status
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _prune(self, now):
+        self._conn.execute("DELETE FROM processed_messages WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM processed_messages WHERE sid IN ("
+            "SELECT sid FROM processed_messages ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,),
+        )
+
+    def _set_done(self, message_sid, now):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE processed_messages SET status = 'done', expires_at = ? WHERE sid = ?",
+                (now + self.ttl, message_sid),
+            )
+
+    def _delete(self, message_sid):
+        with self._lock:
+            self._conn.execute("DELETE FROM processed_messages WHERE sid = ?", (message_sid,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_messages").fetchone()[0]
+
+
+def build_idempotency_store(backend=IDEMPOTENCY_BACKEND, path=IDEMPOTENCY_PATH):
+    """Crea el store configurado: "memory", "sqlite" o None si está desactivado"""
+    if backend in ("off", "none", "disabled", ""):
+        return None
+    if backend == "sqlite":
+        try:
+            return SQLiteIdempotencyStore(path)
+        except Exception as e:
+            logger.error(f"❌ No se pudo abrir {path} para idempotencia: {e}, usando memoria")
+    return InMemoryIdempotencyStore()
+
+
+# ========================================
+# 🩺 READINESS (PROBES EN SEGUNDO PLANO)
+# ========================================
+class ReadinessMonitor:
+    """Decide si la instancia debe recibir tráfico; /ready solo lee su estado
+
+    Un hilo propio sondea Cal.com, OpenAI y Twilio cada READY_PROBE_INTERVAL
+    segundos y guarda el último resultado. La carga local (mensajes en curso,
+    cola, pools HTTP y tasa de errores reciente) se calcula con contadores en
+    memoria, así que responder a /ready nunca hace red.
+    """
+
+    def __init__(
+        self, job_queue, transport, interval=READY_PROBE_INTERVAL, timeout=READY_PROBE_TIMEOUT
+    ):
+        self.job_queue = job_queue
+        self.transport = transport
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._probes = {}  # nombre -> último resultado
+        self._outcomes = deque()  # (instante, ok) de los mensajes procesados
+        self._in_flight = 0
+        self._thread = None
+
+    def start(self):
+        """Arranca el hilo de probes (solo la primera vez en cada proceso)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._probe_loop, name="ready-prober", daemon=True
+            )
+            self._thread.start()
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self._outcomes = deque()
+        self._in_flight = 0
+        self._thread = None
+
+    # ---- carga local ----
+    def begin(self):
+        with self._lock:
+            self._in_flight += 1
+
+    def end(self, ok):
+        with self._lock:
+            self._in_flight -= 1
+        self.record(ok)
+
+    def record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append((now, bool(ok)))
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > READY_ERROR_WINDOW:
+            self._outcomes.popleft()
+
+    # ---- probes ----
+    def _probe_targets(self):
+        """(nombre, URL, kwargs) de los upstreams con credenciales configuradas"""
+        targets = []
+        if CAL_API_KEY:
+            targets.append(
+                (
+                    "cal",
+                    f"{CAL_API_BASE}/v2/me",
+                    {"headers": {"Authorization": f"Bearer {CAL_API_KEY}"}},
+                )
+            )
+        if OPENAI_API_KEY:
+            openai_base = (OPENAI_BASE_URL or "https://api.openai.com/v1").rstrip("/")
+            targets.append(
+                (
+                    "openai",
+                    f"{openai_base}/models",
+                    {"headers": {"Authorization": f"Bearer {OPENAI_API_KEY}"}},
+                )
+            )
+        if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+            targets.append(
+                (
+                    "twilio",
+                    f"{TWILIO_API_BASE}/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}.json",
+                    {"auth": (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)},
+                )
+            )
+        return targets
+
+    def _probe(self, name, url, kwargs):
+        started = time.monotonic()
+        result = {"ok": False, "status": None, "error": None}
+        try:
+            # Upstream propio: las probes no ocupan conexiones del tráfico real
+            response = self.transport.get("probe", url, timeout=self.timeout, **kwargs)
+            result["status"] = response.status_code
+            # 4xx distintos de 401/403 siguen indicando un upstream vivo y accesible
+            result["ok"] = response.status_code < 500 and response.status_code not in (401, 403)
+        except requests.RequestException as e:
+            result["error"] = type(e).__name__
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["checked_at"] = datetime.now().isoformat(timespec="seconds")
+        if not result["ok"]:
+            logger.warning(f"🩺 Probe {name} fallida: {result['status'] or result['error']}")
+        return result
+
+    def run_probes(self):
+        """Sondea todos los upstreams configurados y guarda los resultados"""
+        for name, url, kwargs in self._probe_targets():
+            result = self._probe(name, url, kwargs)
+            with self._lock:
+                self._probes[name] = result
+
+    def _probe_loop(self):
+        while True:
+            try:
+                self.run_probes()
+            except Exception as e:
+                logger.error(f"❌ Error en las probes de readiness: {e}")
+            time.sleep(self.interval)
+
+    # ---- veredicto ----
+    def snapshot(self):
+        """Estado completo y motivos para dejar de recibir tráfico (lista vacía = listo)"""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            in_flight = self._in_flight
+            samples = len(self._outcomes)
+            errors = sum(1 for _, ok in self._outcomes if not ok)
+            probes = {name: dict(result) for name, result in self._probes.items()}
+        error_rate = errors / samples if samples else 0.0
+        queue_stats = self.job_queue.stats()
+        # Un transporte inyectado puede no exponer sus pools: se informan como desconocidos
+        pool_usage = getattr(self.transport, "pool_usage", None)
+        pools = pool_usage() if pool_usage is not None else None
+
+        reasons = []
+        if queue_stats["queue_depth"] >= READY_MAX_QUEUE_DEPTH:
+            reasons.append(f"queue_depth {queue_stats['queue_depth']} >= {READY_MAX_QUEUE_DEPTH}")
+        if in_flight >= READY_MAX_IN_FLIGHT:
+            reasons.append(f"in_flight {in_flight} >= {READY_MAX_IN_FLIGHT}")
+        for upstream, pool in (pools or {}).items():
+            if pool["usage"] > READY_MAX_POOL_USAGE:
+                reasons.append(f"pool {upstream} usage {pool['usage']} > {READY_MAX_POOL_USAGE}")
+        if samples >= READY_MIN_SAMPLES and error_rate > READY_MAX_ERROR_RATE:
+            reasons.append(f"error_rate {error_rate:.2f} > {READY_MAX_ERROR_RATE}")
+        if READY_FAIL_ON_UPSTREAM:
+            for name, result in probes.items():
+                if not result["ok"]:
+                    reasons.append(f"upstream {name} unavailable")
+
+        return {
+            "ready": not reasons,
+            "reasons": reasons,
+            "in_flight": in_flight,
+            "queue": {
+                "depth": queue_stats["queue_depth"],
+                "busy_workers": queue_stats["busy_workers"],
+                "workers": queue_stats["workers"],
+            },
+            "errors": {
+                "window_s": READY_ERROR_WINDOW,
+                "samples": samples,
+                "errors": errors,
+                "rate": round(error_rate, 3),
+            },
+            "pools": pools,
+            "upstreams": probes,
+        }
+
+
+# ========================================
+# 🚀 FLASK APPLICATION
+# ========================================
+# Las rutas se registran en un blueprint; create_app() monta la aplicación y
+# sus componentes (AgentComponents), que las rutas leen con current_components()
+routes = Blueprint("agent", __name__)
+
+# 📈 Gauges: se leen en cada scrape de /metrics, sin coste por mensaje
+metrics.gauge(
+    "agent_conversations_live",
+    "Conversaciones en memoria",
+    lambda: len(current_components().agent.conversation_states),
+)
+metrics.gauge(
+    "agent_job_queue_depth",
+    "Mensajes entrantes en cola",
+    lambda: current_components().job_queue.stats()["queue_depth"],
+)
+metrics.gauge(
+    "agent_busy_workers",
+    "Workers procesando un mensaje",
+    lambda: current_components().job_queue.stats()["busy_workers"],
+)
+metrics.gauge(
+    "agent_outbound_pending",
+    "Mensajes salientes pendientes de envío",
+    lambda: current_components().outbound_messenger.stats()["pending"],
+)
+metrics.gauge(
+    "agent_log_queue_depth",
+    "Records de log pendientes de escribir",
+    lambda: logging_stats().get("queue_depth", 0),
+)
+metrics.counter_func(
+    "agent_log_records_dropped_total",
+    "Records de log descartados por cola llena",
+    lambda: logging_stats().get("dropped", 0),
+)
+
+# ========================================
+# ⭐ CORRECCIÓN CRÍTICA: FUNCION NORMALIZAR FECHAS CON HORA
+# ========================================
+def normalize_date_to_iso(date_text, timezone="America/New_York"):
+    """🛠️ Convierte texto natural en fecha ISO EXACTA para Cal.com
+
+    IMPORTANTE: Cal.com REQUIERE formato exacto YYYY-MM-DDTHH:MM:SSZ (en UTC)
+    """
+    try:
+        if not date_text or not isinstance(date_text, str):
+            logger.error("❌ Fecha inválida o vacía")
+            return None
+
+        date_text = date_text.strip()
+        tz = pytz.timezone(timezone)
+        now = datetime.now(tz)
+
+        # 🎯 Gramática precompilada: día y hora en los 6 idiomas
+        match = resolve_date_text(date_text, now.date())
+
+        # Hora por defecto (10 AM)
+        hour = 10
+        minute = 0
+        if match and match.hour is not None:
+            hour, minute = match.hour, match.minute
+
+        # 1️⃣ Parsear fecha natural
+        if match and match.date is not None and match.utc_offset is not None:
+            # ISO con Z/±hh:mm: es un instante exacto, se convierte (no se localiza)
+            dt = (
+                datetime.combine(match.date, datetime.min.time())
+                .replace(hour=hour, minute=minute, tzinfo=pytz.FixedOffset(match.utc_offset))
+                .astimezone(tz)
+            )
+        elif match and match.date is not None:
+            dt = tz.localize(
+                datetime.combine(match.date, datetime.min.time()).replace(
+                    hour=hour, minute=minute
+                )
+            )
+            # Hoy = hoy a la hora especificada, pero si ya pasó, usar mañana
+            if match.kind == "today" and dt <= now:
+                dt = dt + timedelta(days=1)
+        elif match:
+            # Solo hora ("a las 3"): hoy a esa hora, o mañana si ya pasó
+            dt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if dt <= now:
+                dt = dt + timedelta(days=1)
+        else:
+            try:
+                # Último recurso: dateutil
+                dt = parser.parse(date_text, fuzzy=True)
+                if dt.tzinfo is None:
+                    dt = tz.localize(dt)
+                else:
+                    dt = dt.astimezone(tz)
+
+                # Si no se especificó hora, usar la hora por defecto
+                if dt.hour == 0 and dt.minute == 0:
+                    dt = dt.replace(hour=hour, minute=minute)
+
+                # Si la fecha es hoy y la hora ya pasó, mover a mañana
+                if dt.date() == now.date() and dt <= now:
+                    dt = dt + timedelta(days=1)
+            except:
+                logger.error(f"❌ No se pudo parsear la fecha: {date_text}")
+                return None
+
+        # 2️⃣ Asegurar que la fecha sea FUTURA
+        if dt <= now:
+            logger.warning(f"⚠️ Fecha {dt} es pasada, moviendo a mañana")
+            dt = now + timedelta(days=1)
+            dt = dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+        # 3️⃣ Convertir a UTC
+        dt_utc = dt.astimezone(pytz.utc)
+
+        # 4️⃣ Formato EXACTO que Cal.com requiere: YYYY-MM-DDTHH:MM:SSZ
+        iso_date = dt_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        logger.info(f"📅 Fecha convertida: '{date_text}' → {iso_date}")
+        return iso_date
+
+    except Exception as e:
+        logger.error(f"❌ Error normalizando fecha '{date_text}': {e}")
+        return None
+
+
+# ========================================
+# 🎵 MANEJO DE MENSAJES DE VOZ
+# ========================================
+AUDIO_EXTENSIONS = {
+    "audio/ogg": "ogg",
+    "application/ogg": "ogg",
+    "audio/opus": "ogg",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/mp4": "m4a",
+    "audio/aac": "m4a",
+    "audio/x-m4a": "m4a",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+    "audio/webm": "webm",
+    "audio/amr": "amr",
+}
+
+
+class TranscriptionCache:
+    """Transcripciones direccionadas por contenido: media SID de Twilio y SHA-256 del audio
+
+    Una reentrega de Twilio (mismo media SID) no descarga ni transcribe; un audio
+    reenviado (SID nuevo, mismo contenido) solo paga la descarga.
+    """
+
+    MEDIA_SID_RE = re.compile(r"/Media/(ME[0-9a-fA-F]{32})")
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self.media_hits = 0
+        self.hash_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def media_key(cls, audio_url, message_sid=None):
+        match = cls.MEDIA_SID_RE.search(audio_url or "")
+        if match:
+            return match.group(1)
+        if message_sid:
+            return f"{message_sid}/0"
+        return audio_url or None
+
+    @staticmethod
+    def content_hash(buffer):
+        return hashlib.sha256(buffer.getbuffer()).hexdigest()
+
+    def get_by_media(self, media_key):
+        if not media_key:
+            return None
+        text = self.backend.get(f"media:{media_key}")
+        if text is not None:
+            with self._lock:
+                self.media_hits += 1
+        return text
+
+    def get_by_hash(self, digest, media_key=None):
+        text = self.backend.get(f"sha256:{digest}")
+        with self._lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hash_hits += 1
+        if text is not None and media_key:
+            self.backend.set(f"media:{media_key}", text)
+        return text
+
+    def set(self, media_key, digest, text):
+        self.backend.set(f"sha256:{digest}", text)
+        if media_key:
+            self.backend.set(f"media:{media_key}", text)
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                "media_hits": self.media_hits,
+                "hash_hits": self.hash_hits,
+                "misses": self.misses,
+            }
+        return {**counters, "backend": self.backend.stats()}
+
+
+def build_transcription_cache():
+    """Caché de transcripciones según TRANSCRIPTION_CACHE_* (None si está desactivada)"""
+    backend = build_cache(
+        TRANSCRIPTION_CACHE_BACKEND,
+        maxsize=TRANSCRIPTION_CACHE_SIZE,
+        ttl=TRANSCRIPTION_CACHE_TTL,
+        path=TRANSCRIPTION_CACHE_PATH,
+        table="transcription_cache",
+    )
+    return TranscriptionCache(backend) if backend is not None else None
+
+
+def transcribe_voice_media(audio_url, message_sid=None):
+    """📝 Devuelve la transcripción usando la caché antes de descargar y de llamar a Whisper"""
+    components = current_components()
+    transcription_cache = components.transcription_cache
+    media_key = TranscriptionCache.media_key(audio_url, message_sid)
+    if transcription_cache:
+        cached = transcription_cache.get_by_media(media_key)
+        if cached is not None:
+            logger.info(f"📝 Transcripción desde caché (media {media_key})")
+            return cached
+
+    with StageTimer("voice_download"):
+        audio_buffer, filename, content_type = download_voice_media(audio_url)
+
+    digest = None
+    if transcription_cache:
+        digest = TranscriptionCache.content_hash(audio_buffer)
+        cached = transcription_cache.get_by_hash(digest, media_key)
+        if cached is not None:
+            logger.info(f"📝 Transcripción desde caché (audio {digest[:12]}…)")
+            return cached
+
+    # Transcribir con OpenAI Whisper directamente desde memoria
+    with StageTimer("voice_transcription"):
+        transcription_result = components.openai().audio.transcriptions.create(
+            model="whisper-1", file=(filename, audio_buffer, content_type)
+        )
+    transcribed_text = (transcription_result.text or "").strip()
+    if transcription_cache:
+        transcription_cache.set(media_key, digest, transcribed_text)
+    return transcribed_text
+
+
+def download_voice_media(audio_url):
+    """⬇️ Descarga el audio en streaming a un buffer en memoria (sin archivo temporal)
+
+    Devuelve (buffer, filename, content_type). Aborta antes de leer el cuerpo si el
+    tipo no es audio o si Content-Length supera VOICE_MAX_BYTES, y durante la
+    descarga si el cuerpo real lo supera.
+    """
+    with current_components().http_transport.get(
+        "media", audio_url, auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN), stream=True
+    ) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Error descargando audio: {response.status_code}")
+
+        content_type = (response.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if not (content_type.startswith("audio/") or content_type == "application/ogg"):
+            raise ValueError(f"Tipo de contenido no soportado: {content_type or 'desconocido'}")
+
+        declared = response.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > VOICE_MAX_BYTES:
+            raise ValueError(f"Audio demasiado grande: {declared} bytes > {VOICE_MAX_BYTES}")
+
+        buffer = BytesIO()
+        size = 0
+        for chunk in response.iter_content(chunk_size=VOICE_CHUNK_SIZE):
+            size += len(chunk)
+            if size > VOICE_MAX_BYTES:
+                raise ValueError(f"Audio demasiado grande: > {VOICE_MAX_BYTES} bytes")
+            buffer.write(chunk)
+
+    buffer.seek(0)
+    filename = f"voice.{AUDIO_EXTENSIONS.get(content_type, 'ogg')}"
+    logger.info(f"⬇️ Audio descargado: {size} bytes ({content_type})")
+    return buffer, filename, content_type
+
+
+def handle_voice_message(audio_url, from_number, language="en", message_sid=None):
+    """Maneja mensajes de voz"""
+    agent = current_components().agent
+    try:
+        logger.info("🎤 Procesando mensaje de voz...")
+        try:
+            transcribed_text = transcribe_voice_media(audio_url, message_sid)
+        except ValueError as e:
+            logger.error(f"❌ {e}")
+            return agent.get_response("generic_response", language)
+
+        logger.info(f"📝 Texto extraído: {transcribed_text}")
+
+        # Detectar idioma y procesar
+        detected_language = agent.detect_language(transcribed_text)
+        response_data = agent.get_contextual_response(
+            transcribed_text, from_number, detected_language
+        )
+
+        # Enviar respuesta
+        if "message" in response_data:
+            agent.send_whatsapp_message(from_number, response_data["message"])
+
+        return transcribed_text
     except Exception as e:
         logger.error(f"❌ Error procesando mensaje de voz: {e}")
         return agent.get_response("generic_response", language)
@@ -1288,16 +4193,79 @@ def handle_voice_message(audio_url, from_number, language="en"):
 # 📅 API DE CAL.COM - VERSIÓN CORREGIDA Y VALIDADA VERSION OPTIMIZADA PARA 
 # ANTICIPAR CITAS CADA 60 MIN  EN CAL.COM 
 # ========================================
-def create_cal_com_booking(
-    name, email, date_preference, phone_number, language="en", retry_count=0
-):
-    """🛠️ Crea cita en Cal.com - VERSIÓN FINAL Y ESTABLE"""
-    
-    MAX_RETRIES = 3
-    
+def _find_booking_id(data):
+    """🔍 Busca el ID de la reserva en todos los lugares posibles de la respuesta"""
+    # Cal.com v2 usa 'uid' en el root
+    booking_id = data.get("uid") or data.get("id")
+
+    # Si no está en root, buscar en data.booking
+    if not booking_id and "data" in data and isinstance(data["data"], dict):
+        booking_id = data["data"].get("uid") or data["data"].get("id")
+
+    # Si aún no lo encontramos, buscar recursivamente
+    if not booking_id:
+        def deep_search(obj, path=""):
+            nonlocal booking_id
+            if isinstance(obj, dict):
+                for k, v in obj.items():
+                    if k in ["uid", "id", "bookingId"] and v and isinstance(v, str):
+                        booking_id = v
+                        logger.info(f"✅ Encontrado booking_id en {path}.{k}: {booking_id}")
+                        return True
+                    if isinstance(v, (dict, list)):
+                        if deep_search(v, f"{path}.{k}" if path else k):
+                            return True
+            elif isinstance(obj, list):
+                for i, item in enumerate(obj):
+                    if deep_search(item, f"{path}[{i}]"):
+                        return True
+            return False
+
+        deep_search(data)
+    return booking_id
+
+
+def _booking_backoff(attempt):
+    """Espera con jitter completo antes del intento ``attempt`` (2, 3, ...)"""
+    ceiling = min(BOOKING_BACKOFF_MAX, BOOKING_BACKOFF_BASE * 2 ** (attempt - 2))
+    return random.uniform(0, ceiling)
+
+
+# Trazas estructuradas de las últimas reservas (intento, slot, código, latencia)
+booking_traces = deque(maxlen=BOOKING_TRACE_HISTORY)
+
+
+def create_cal_com_booking(name, email, date_preference, phone_number, language="en"):
+    """🛠️ Crea cita en Cal.com - motor iterativo con límite de intentos y deadline"""
+
+    MINIMUM_NOTICE_HOURS = 1  # Debe coincidir con tu configuración en Cal.com
+
+    components = current_components()
+    agent = components.agent
+    availability_index = components.availability_index
+    started = time.monotonic()
+    deadline = started + BOOKING_DEADLINE_SECONDS
+    trace = {
+        "phone_number": phone_number,
+        "started_at": datetime.now(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "requested": date_preference,
+        "attempts": [],
+        "outcome": None,
+    }
+
+    def finish(result, outcome):
+        trace["outcome"] = outcome
+        trace["total_ms"] = round((time.monotonic() - started) * 1000, 1)
+        booking_traces.append(trace)
+        result["trace"] = trace
+        logger.info(
+            f"🧾 Reserva {outcome} en {len(trace['attempts'])} intento(s), {trace['total_ms']} ms"
+        )
+        return result
+
     try:
         logger.info("📅 Iniciando creación de cita en Cal.com...")
-        
+
         # ===== 1️⃣ VALIDACIÓN DE DATOS =====
         if not CAL_API_KEY:
             return {"success": False, "error": "Falta CAL_API_KEY"}
@@ -1307,258 +4275,591 @@ def create_cal_com_booking(
             return {"success": False, "error": f"Email inválido: {email}"}
         if not date_preference:
             return {"success": False, "error": "Fecha no especificada"}
-        
-        # ===== 2️⃣ NORMALIZAR FECHA =====
-        iso_date = normalize_date_to_iso(date_preference)
-        if not iso_date:
-            return {"success": False, "error": f"No se pudo parsear: {date_preference}"}
-        
-        # ===== 🔥 VALIDACIÓN CRÍTICA: ANTECEDENCIA MÍNIMA =====
-        now_utc = datetime.now(pytz.utc)
-        booking_dt = datetime.fromisoformat(iso_date.replace("Z", "+00:00"))
-        hours_diff = (booking_dt - now_utc).total_seconds() / 3600
-        
-        MINIMUM_NOTICE_HOURS = 1  # Debe coincidir con tu configuración en Cal.com
-        
-        if hours_diff < MINIMUM_NOTICE_HOURS:
-            logger.warning(f"⚠️ Reserva muy cercana: {hours_diff:.1f}h < {MINIMUM_NOTICE_HOURS}h")
-            
-            valid_dt = now_utc + timedelta(hours=MINIMUM_NOTICE_HOURS)
-            local_tz = pytz.timezone(DEFAULT_TIMEZONE)
-            valid_local = valid_dt.astimezone(local_tz)
-            pretty_time = valid_local.strftime("%I:%M %p")
-            
-            if valid_local.date() == now_utc.astimezone(local_tz).date():
-                suggested_time = f"today at {pretty_time}"
-            else:
-                suggested_time = "tomorrow at 10 AM"
-            
-            return {
-                "success": False,
-                "error": "Antecedencia insuficiente",
-                "message": agent.get_response(
-                    "insufficient_notice_error",
-                    language,
-                    requested_time=date_preference,
-                    minimum_hours=MINIMUM_NOTICE_HOURS,
-                    suggested_time=suggested_time,
-                    pretty_time=pretty_time
-                )
-            }
-        
-        # ===== 3️⃣ OBTENER DURACIÓN DEL EVENTO =====
-        event_duration_minutes = 15  # CAMBIA ESTO según tu evento
-        
-        # ===== 4️⃣ CALCULAR FECHA DE FIN =====
-        start_dt = datetime.fromisoformat(iso_date.replace("Z", "+00:00"))
-        end_dt = start_dt + timedelta(minutes=event_duration_minutes)
-        end_iso = end_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-        
-        # ===== 5️⃣ PAYLOAD =====
-        state = agent.get_or_create_conversation_state(phone_number)
-        booking_language = getattr(state, "language", "en")
-        language_map = {"es": "es", "en": "en", "fr": "fr", "de": "de", "it": "it", "pt": "pt"}
-        
-        payload = {
-            "eventTypeId": CAL_EVENT_TYPE_ID,
-            "start": iso_date,
-            "end": end_iso,
-            "timeZone": DEFAULT_TIMEZONE,
-            "language": language_map.get(booking_language, "en"),
-            "responses": {
-                "name": name.strip(),
-                "email": email.strip(),
-                "notes": f"WhatsApp: {phone_number}",
-            },
-            "location": "Google Meet",
-            "metadata": {
-                "source": "WhatsApp Voice Agent",
-                "phone_number": phone_number,
-                "language": booking_language,
-            },
-            "status": "ACCEPTED",
-        }
-        
+
         headers = {
             "Authorization": f"Bearer {CAL_API_KEY}",
             "Content-Type": "application/json",
             "cal-api-version": "2024-06-14",
         }
-        
-        url = "https://api.cal.com/v2/bookings"
-        
-        logger.info("🌐 Enviando solicitud a Cal.com...")
-        logger.info(f"📨 Payload: {json.dumps(payload, indent=2)}")
-        
-        # ===== 6️⃣ ENVIAR SOLICITUD =====
-        response = requests.post(url, json=payload, headers=headers)
-        
-        # ===== 7️⃣ MANEJO DE RESPUESTA =====
-        logger.info(f"📥 Status Code: {response.status_code}")
-        
-        if response.status_code in [200, 201]:
-            data = response.json()
-            
-            # 🔍 BUSCAR EL ID EN TODOS LOS LUGARES POSIBLES
-            booking_id = None
-            
-            # Cal.com v2 usa 'uid' en el root
-            booking_id = data.get("uid") or data.get("id")
-            
-            # Si no está en root, buscar en data.booking
-            if not booking_id and "data" in data and isinstance(data["data"], dict):
-                booking_id = data["data"].get("uid") or data["data"].get("id")
-            
-            # Si aún no lo encontramos, buscar recursivamente
-            if not booking_id:
-                def deep_search(obj, path=""):
-                    nonlocal booking_id
-                    if isinstance(obj, dict):
-                        for k, v in obj.items():
-                            if k in ["uid", "id", "bookingId"] and v and isinstance(v, str):
-                                booking_id = v
-                                logger.info(f"✅ Encontrado booking_id en {path}.{k}: {booking_id}")
-                                return True
-                            if isinstance(v, (dict, list)):
-                                if deep_search(v, f"{path}.{k}" if path else k):
-                                    return True
-                    elif isinstance(obj, list):
-                        for i, item in enumerate(obj):
-                            if deep_search(item, f"{path}[{i}]"):
-                                return True
-                    return False
-                
-                deep_search(data)
-            
-            # Construir la URL
-            if booking_id:
-                meeting_url = f"https://app.cal.com/booking/{booking_id}"
-                logger.info(f"✅ URL final: {meeting_url}")
+        url = f"{CAL_API_BASE}/v2/bookings"
+        event_duration_minutes = 15  # CAMBIA ESTO según tu evento
+        state = agent.get_or_create_conversation_state(phone_number)
+        booking_language = getattr(state, "language", "en")
+        language_map = {"es": "es", "en": "en", "fr": "fr", "de": "de", "it": "it", "pt": "pt"}
+
+        preference = date_preference
+        notices = []
+        last_error = None
+
+        for attempt in range(1, BOOKING_MAX_ATTEMPTS + 1):
+            if attempt > 1:
+                wait = _booking_backoff(attempt)
+                if time.monotonic() + wait >= deadline:
+                    last_error = "deadline"
+                    break
+                time.sleep(wait)
+
+            # ===== 2️⃣ NORMALIZAR FECHA =====
+            # Los slots de reintento llegan como datetime aware: no se vuelven a parsear
+            if isinstance(preference, datetime):
+                iso_date = _to_cal_iso(preference)
             else:
-                # Fallback a la URL del evento
-                meeting_url = f"https://app.cal.com/{os.getenv('ACCOUNT_USERNAME', '')}/{CAL_EVENT_TYPE_ID}"
-                logger.warning(f"⚠️ No se encontró booking_id, usando URL del evento: {meeting_url}")
-            
-            return {
-                "success": True,
-                "booking_id": booking_id,
-                "booking_url": data.get("uri", ""),
-                "meeting_url": meeting_url,
-                "raw": data,
+                iso_date = normalize_date_to_iso(preference)
+            if not iso_date:
+                return finish(
+                    {"success": False, "error": f"No se pudo parsear: {preference}"},
+                    "unparseable_date",
+                )
+
+            # ===== 🔥 VALIDACIÓN CRÍTICA: ANTECEDENCIA MÍNIMA =====
+            now_utc = datetime.now(pytz.utc)
+            booking_dt = datetime.fromisoformat(iso_date.replace("Z", "+00:00"))
+            hours_diff = (booking_dt - now_utc).total_seconds() / 3600
+
+            if attempt == 1 and hours_diff < MINIMUM_NOTICE_HOURS:
+                logger.warning(f"⚠️ Reserva muy cercana: {hours_diff:.1f}h < {MINIMUM_NOTICE_HOURS}h")
+
+                valid_dt = now_utc + timedelta(hours=MINIMUM_NOTICE_HOURS)
+                local_tz = pytz.timezone(DEFAULT_TIMEZONE)
+                valid_local = valid_dt.astimezone(local_tz)
+                pretty_time = valid_local.strftime("%I:%M %p")
+
+                if valid_local.date() == now_utc.astimezone(local_tz).date():
+                    suggested_time = f"today at {pretty_time}"
+                else:
+                    suggested_time = "tomorrow at 10 AM"
+
+                return finish(
+                    {
+                        "success": False,
+                        "error": "Antecedencia insuficiente",
+                        "message": agent.get_response(
+                            "insufficient_notice_error",
+                            language,
+                            requested_time=date_preference,
+                            minimum_hours=MINIMUM_NOTICE_HOURS,
+                            suggested_time=suggested_time,
+                            pretty_time=pretty_time,
+                        ),
+                    },
+                    "insufficient_notice",
+                )
+
+            # ===== 📆 PRE-FLIGHT: VALIDAR CONTRA LA DISPONIBILIDAD EN CACHÉ =====
+            # Un slot ocupado se ajusta al siguiente libre del mismo día ANTES del POST,
+            # así la mayoría de conflictos no cuestan ni una reserva fallida ni un
+            # reintento. Como el conflicto 400, solo avanza: nunca antes de lo pedido.
+            # Sin caché para ese día no se espera a Cal.com: se carga en segundo plano
+            availability_index.record("preflight_checks")
+            cached_free = availability_index.is_free(booking_dt, blocking=False)
+            if cached_free is None:
+                availability_index.record("preflight_cold")
+            elif cached_free is False:
+                snapped = availability_index.next_free_after(
+                    booking_dt, blocking=False, same_day=True
+                )
+                if snapped:
+                    availability_index.record("conflicts_avoided")
+                    logger.info(f"📆 Slot {iso_date} ocupado según caché, ajustado a {snapped}")
+                    notices.append(
+                        agent.get_response(
+                            "slot_conflict_retry", language, original_time=iso_date, new_time=snapped
+                        )
+                    )
+                    iso_date = snapped
+
+            # ===== 3️⃣ CALCULAR FECHA DE FIN =====
+            start_dt = datetime.fromisoformat(iso_date.replace("Z", "+00:00"))
+            end_dt = start_dt + timedelta(minutes=event_duration_minutes)
+            end_iso = end_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+            # ===== 4️⃣ PAYLOAD =====
+            payload = {
+                "eventTypeId": CAL_EVENT_TYPE_ID,
+                "start": iso_date,
+                "end": end_iso,
+                "timeZone": DEFAULT_TIMEZONE,
+                "language": language_map.get(booking_language, "en"),
+                "responses": {
+                    "name": name.strip(),
+                    "email": email.strip(),
+                    "notes": f"WhatsApp: {phone_number}",
+                },
+                "location": "Google Meet",
+                "metadata": {
+                    "source": "WhatsApp Voice Agent",
+                    "phone_number": phone_number,
+                    "language": booking_language,
+                },
+                "status": "ACCEPTED",
             }
-            
-        elif response.status_code == 400:
+
+            logger.info(f"🌐 Enviando solicitud a Cal.com (intento {attempt})...")
+            # 📨 El payload completo solo se serializa si DEBUG está activo
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"📨 Payload: {json.dumps(payload, ensure_ascii=False)}")
+
+            # ===== 5️⃣ ENVIAR SOLICITUD (nunca más allá del deadline) =====
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                last_error = "deadline"
+                break
+            record = {"attempt": attempt, "requested_slot": iso_date}
+            trace["attempts"].append(record)
+            attempt_started = time.monotonic()
+            try:
+                with StageTimer("cal_booking_attempt") as attempt_timer:
+                    response = components.http_transport.post(
+                        "cal",
+                        url,
+                        json=payload,
+                        headers=headers,
+                        timeout=(HTTP_CONNECT_TIMEOUT, max(0.1, min(HTTP_READ_TIMEOUT, remaining))),
+                    )
+                    if response.status_code not in (200, 201):
+                        attempt_timer.fail()
+            except requests.RequestException as e:
+                record["latency_ms"] = round((time.monotonic() - attempt_started) * 1000, 1)
+                record["status"] = None
+                record["error_code"] = type(e).__name__
+                last_error = record["error_code"]
+                logger.warning(f"⚠️ Error de red con Cal.com (intento {attempt}): {e}")
+                continue
+            record["latency_ms"] = round((time.monotonic() - attempt_started) * 1000, 1)
+            record["status"] = response.status_code
+
+            # ===== 6️⃣ MANEJO DE RESPUESTA =====
+            logger.info(f"📥 Status Code: {response.status_code}")
+
+            if response.status_code in [200, 201]:
+                data = response.json()
+                booking_id = _find_booking_id(data)
+                record["error_code"] = None
+
+                # 📆 El slot ya no está libre: se quita del índice sin volver a consultar
+                availability_index.invalidate_slot(start_dt)
+
+                # Construir la URL
+                if booking_id:
+                    meeting_url = f"https://app.cal.com/booking/{booking_id}"
+                    logger.info(f"✅ URL final: {meeting_url}")
+                else:
+                    # Fallback a la URL del evento
+                    meeting_url = f"https://app.cal.com/{os.getenv('ACCOUNT_USERNAME', '')}/{CAL_EVENT_TYPE_ID}"
+                    logger.warning(f"⚠️ No se encontró booking_id, usando URL del evento: {meeting_url}")
+
+                return finish(
+                    {
+                        "success": True,
+                        "booking_id": booking_id,
+                        "booking_url": data.get("uri", ""),
+                        "meeting_url": meeting_url,
+                        "notice": "\n".join(notices) or None,
+                        "raw": data,
+                    },
+                    "booked",
+                )
+
             error_text = response.text
             logger.error(f"❌ Error Cal.com → Status: {response.status_code}")
-            
-            if "no_available_users_found" in error_text:
+
+            if response.status_code == 400 and "no_available_users_found" in error_text:
+                record["error_code"] = "no_available_users_found"
+                last_error = record["error_code"]
                 logger.warning(f"⚠️ Slot ocupado: {iso_date}, buscando siguiente...")
-                if retry_count >= MAX_RETRIES:
-                    return {
-                        "success": False,
-                        "error": "Máximos reintentos",
-                        "message": agent.get_response("all_slots_full", language)
-                    }
-                
-                next_slot = get_next_available_slot(iso_date)
-                if not next_slot:
-                    return {
-                        "success": False,
-                        "error": "No hay slots",
-                        "message": agent.get_response("availability_error", language)
-                    }
-                
-                agent.send_whatsapp_message(
-                    phone_number,
-                    agent.get_response("slot_conflict_retry", language, original_time=iso_date, new_time=next_slot)
+                availability_index.record("conflicts_hit")
+                availability_index.invalidate_slot(start_dt)
+
+                # 🔍 La búsqueda del siguiente slot también respeta el deadline
+                if time.monotonic() >= deadline:
+                    last_error = "deadline"
+                    break
+                lookup_started = time.monotonic()
+                next_slot = get_next_available_slot(iso_date, deadline=deadline)
+                record["next_slot_lookup_ms"] = round(
+                    (time.monotonic() - lookup_started) * 1000, 1
                 )
-                
-                return create_cal_com_booking(
-                    name=name, email=email, date_preference=next_slot,
-                    phone_number=phone_number, language=language, retry_count=retry_count + 1
+                if not next_slot:
+                    if time.monotonic() >= deadline:
+                        last_error = "deadline"
+                        break
+                    return finish(
+                        {
+                            "success": False,
+                            "error": "No hay slots",
+                            "message": agent.get_response("availability_error", language),
+                        },
+                        "no_slots",
+                    )
+                notices.append(
+                    agent.get_response(
+                        "slot_conflict_retry", language, original_time=iso_date, new_time=next_slot
+                    )
                 )
-                
-            elif "booking_time_out_of_bounds" in error_text:
+                preference = _parse_slot_datetime(next_slot)
+
+            elif response.status_code == 400 and "booking_time_out_of_bounds" in error_text:
+                record["error_code"] = "booking_time_out_of_bounds"
+                last_error = record["error_code"]
                 logger.error(f"❌ Fuera de límites: {iso_date}")
-                
-                try:
-                    new_preference = f"tomorrow at {date_preference.split(' at ')[1]}" if " at " in date_preference else "tomorrow at 10 AM"
-                    agent.send_whatsapp_message(
-                        phone_number,
-                        agent.get_response("time_out_of_bounds_error", language, requested_time=date_preference, next_available=new_preference)
-                    )
-                    
-                    return create_cal_com_booking(
-                        name=name, email=email, date_preference=new_preference,
-                        phone_number=phone_number, language=language, retry_count=retry_count
+                new_preference = (
+                    f"tomorrow at {preference.split(' at ')[1]}"
+                    if isinstance(preference, str) and " at " in preference
+                    else "tomorrow at 10 AM"
+                )
+                notices.append(
+                    agent.get_response(
+                        "time_out_of_bounds_error",
+                        language,
+                        requested_time=preference if isinstance(preference, str) else iso_date,
+                        next_available=new_preference,
                     )
-                except:
-                    return {
-                        "success": False,
-                        "error": "Time out of bounds",
-                        "message": agent.get_response("time_out_of_bounds_error", language)
-                    }
-            
+                )
+                preference = new_preference
+
+            elif response.status_code == 429 or response.status_code >= 500:
+                # Transitorio: mismo slot, con backoff
+                record["error_code"] = f"http_{response.status_code}"
+                last_error = record["error_code"]
+
             else:
-                return {
-                    "success": False,
-                    "error": f"Cal.com API Error ({response.status_code})",
-                    "message": error_text
-                }
-            
+                record["error_code"] = f"http_{response.status_code}"
+                return finish(
+                    {
+                        "success": False,
+                        "error": f"Cal.com API Error ({response.status_code})",
+                        "message": error_text,
+                    },
+                    "rejected",
+                )
+
+        # ===== 7️⃣ SIN ÉXITO: INTENTOS O TIEMPO AGOTADOS =====
+        outcome = "deadline_exceeded" if last_error == "deadline" else "max_attempts"
+        logger.error(f"❌ Reserva sin éxito ({outcome}), último error: {last_error}")
+        return finish(
+            {
+                "success": False,
+                "error": "Máximos reintentos" if outcome == "max_attempts" else "Tiempo agotado",
+                "message": agent.get_response("all_slots_full", language),
+            },
+            outcome,
+        )
+
     except Exception as e:
         logger.error(f"❌ Excepción: {e}")
-        return {"success": False, "error": f"Exception: {str(e)}"}
+        return finish({"success": False, "error": f"Exception: {str(e)}"}, "exception")
+
+
 # ====================================================
-#  CONSULTA API PARA PROXIMA CITA DISPONIBLE
-#  SI EL SLOT SOLICITADO ESTA OCUPADO
+#  📆 ÍNDICE DE DISPONIBILIDAD (CACHÉ DE SLOTS)
 # ====================================================
-def get_next_available_slot(current_iso_date, timezone="America/New_York"):
-    """🔍 Consulta la API de Cal.com para encontrar el siguiente slot libre"""
-    try:
-        # Convertir ISO a datetime
-        current_dt = datetime.fromisoformat(current_iso_date.replace("Z", "+00:00"))
+def _parse_slot_datetime(value):
+    """Convierte un slot de Cal.com (str o dict con time/start) a datetime UTC"""
+    if isinstance(value, dict):
+        value = value.get("time") or value.get("start")
+    if not value or not isinstance(value, str):
+        return None
+    dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = pytz.timezone(DEFAULT_TIMEZONE).localize(dt)
+    return dt.astimezone(pytz.utc)
+
 
-        # Buscar slots para los próximos 7 días
-        start_date = (current_dt + timedelta(minutes=15)).strftime(
-            "%Y-%m-%d"
-        )  # 15 min después
-        end_date = (current_dt + timedelta(days=7)).strftime("%Y-%m-%d")
+def _to_cal_iso(dt):
+    return dt.astimezone(pytz.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
-        availability_url = f"https://api.cal.com/v1/availability "
 
+class AvailabilityIndex:
+    """Slots libres por tipo de evento en una lista ordenada (búsqueda con bisect)
+
+    Se consulta Cal.com una vez por ventana de días (anclada en hoy) y toda
+    consulta de un día dentro de la ventana sale de memoria; pasado el TTL se
+    sigue sirviendo la copia y se refresca en segundo plano.
+    """
+
+    def __init__(
+        self,
+        transport,
+        window_days=AVAILABILITY_WINDOW_DAYS,
+        ttl=AVAILABILITY_TTL,
+        timezone=DEFAULT_TIMEZONE,
+    ):
+        self.transport = transport
+        self.window_days = window_days
+        self.ttl = ttl
+        self.timezone = timezone
+        self._entries = {}  # event_type_id -> dict(epochs, start, end, fetched_at)
+        self._loading = set()  # (event_type_id, start) con carga en segundo plano
+        self._lock = threading.Lock()
+        self._stats = {
+            "fetches": 0,
+            "fetch_errors": 0,
+            "cache_hits": 0,
+            "background_refreshes": 0,
+            "invalidations": 0,
+            "preflight_checks": 0,
+            "preflight_cold": 0,
+            "conflicts_avoided": 0,
+            "conflicts_hit": 0,
+        }
+
+    def _fetch(self, event_type_id, start_date, end_date, deadline=None):
+        """GET /v1/availability para un rango de días; devuelve epochs ordenados
+
+        Con ``deadline`` (time.monotonic()) el timeout se recorta al tiempo que
+        queda y, si ya no queda, no se consulta.
+        """
+        request_kwargs = {}
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning("⏱️ Sin tiempo para consultar disponibilidad, se omite")
+                return None
+            request_kwargs["timeout"] = (
+                max(0.1, min(HTTP_CONNECT_TIMEOUT, remaining)),
+                max(0.1, min(HTTP_READ_TIMEOUT, remaining)),
+            )
+        availability_url = f"{CAL_API_BASE}/v1/availability"
         params = {
             "apiKey": CAL_API_KEY,
-            "eventTypeId": CAL_EVENT_TYPE_ID,
-            "startDate": start_date,
-            "endDate": end_date,
-            "timeZone": timezone,
+            "eventTypeId": event_type_id,
+            "startDate": start_date.strftime("%Y-%m-%d"),
+            "endDate": end_date.strftime("%Y-%m-%d"),
+            "timeZone": self.timezone,
         }
+        logger.info(f"🔍 Consultando disponibilidad: {start_date} → {end_date}")
+        with self._lock:
+            self._stats["fetches"] += 1
+        with StageTimer("cal_availability_fetch") as fetch_timer:
+            response = self.transport.get(
+                "cal", availability_url, params=params, **request_kwargs
+            )
+            if response.status_code != 200:
+                fetch_timer.fail()
+        if response.status_code != 200:
+            with self._lock:
+                self._stats["fetch_errors"] += 1
+            logger.error(f"❌ Error consultando disponibilidad: {response.status_code}")
+            return None
 
-        logger.info(f"🔍 Consultando disponibilidad: {availability_url}")
-        logger.info(f"📊 Parámetros: {json.dumps(params, indent=2)}")
-
-        response = requests.get(availability_url, params=params)
+        slots = response.json().get("slots", [])
+        raw_slots = []
+        if isinstance(slots, dict):
+            # Formato {"2025-01-01": [{"time": ...}, ...]}
+            for day_slots in slots.values():
+                raw_slots.extend(day_slots or [])
+        else:
+            # Formato [{"available": true, "slots": [...]}, ...]
+            for day_slots in slots:
+                if isinstance(day_slots, dict) and day_slots.get("available", False):
+                    raw_slots.extend(day_slots.get("slots", []) or [])
+                elif not isinstance(day_slots, dict):
+                    raw_slots.append(day_slots)
+
+        epochs = set()
+        for raw in raw_slots:
+            try:
+                dt = _parse_slot_datetime(raw)
+            except ValueError:
+                dt = None
+            if dt:
+                epochs.add(dt.timestamp())
+        return sorted(epochs)
+
+    def _load(self, event_type_id, start_date, deadline=None):
+        end_date = start_date + timedelta(days=self.window_days)
+        epochs = self._fetch(event_type_id, start_date, end_date, deadline)
+        if epochs is None:
+            return None
+        entry = {
+            "epochs": epochs,
+            "start": start_date,
+            "end": end_date,
+            "fetched_at": time.monotonic(),
+            "refreshing": False,
+        }
+        with self._lock:
+            self._entries[event_type_id] = entry
+        return entry
+
+    def _refresh_in_background(self, event_type_id, entry):
+        with self._lock:
+            if entry.get("refreshing"):
+                return
+            entry["refreshing"] = True
+            self._stats["background_refreshes"] += 1
+
+        # La ventana avanza con el calendario: nunca se recargan días ya pasados
+        today = datetime.now(pytz.timezone(self.timezone)).date()
+        start = max(entry["start"], today)
+
+        def refresh():
+            try:
+                if self._load(event_type_id, start) is None:
+                    entry["refreshing"] = False
+            except Exception as e:
+                entry["refreshing"] = False
+                logger.error(f"❌ Error refrescando disponibilidad: {e}")
+
+        threading.Thread(target=refresh, name="availability-refresh", daemon=True).start()
+
+    @staticmethod
+    def _covers(entry, local_date):
+        return entry is not None and entry["start"] <= local_date <= entry["end"]
+
+    def _window_start(self, local_date):
+        """Ventana anclada en hoy; una fecha más lejana abre su propia ventana"""
+        today = datetime.now(pytz.timezone(self.timezone)).date()
+        if today <= local_date <= today + timedelta(days=self.window_days):
+            return today
+        return local_date
+
+    def _load_in_background(self, event_type_id, start):
+        key = (event_type_id, start)
+        with self._lock:
+            if key in self._loading:
+                return
+            self._loading.add(key)
+
+        def load():
+            try:
+                self._load(event_type_id, start)
+            except Exception as e:
+                logger.error(f"❌ Error cargando disponibilidad: {e}")
+            finally:
+                with self._lock:
+                    self._loading.discard(key)
+
+        threading.Thread(target=load, name="availability-load", daemon=True).start()
+
+    def _entry_for(self, event_type_id, dt, blocking=True, deadline=None):
+        """Devuelve la entrada cuya ventana contiene el día de dt, cargándola si hace falta
+
+        Con ``blocking=False`` nunca hace red: si no hay entrada que cubra el día
+        la carga en segundo plano y devuelve None.
+        """
+        local_date = dt.astimezone(pytz.timezone(self.timezone)).date()
+        with self._lock:
+            entry = self._entries.get(event_type_id)
+        if not self._covers(entry, local_date):
+            start = self._window_start(local_date)
+            if not blocking:
+                self._load_in_background(event_type_id, start)
+                return None
+            return self._load(event_type_id, start, deadline)
+        with self._lock:
+            self._stats["cache_hits"] += 1
+        if time.monotonic() - entry["fetched_at"] > self.ttl:
+            self._refresh_in_background(event_type_id, entry)
+        return entry
+
+    def next_free_after(
+        self, dt, event_type_id=CAL_EVENT_TYPE_ID, blocking=True, same_day=False, deadline=None
+    ):
+        """Primer slot libre estrictamente posterior a dt (ISO Cal.com) o None
+
+        Con ``same_day=True`` solo vale un slot del mismo día local que dt; con
+        ``blocking=False`` solo se consulta la caché (ver _entry_for). Las
+        consultas a Cal.com no pasan de ``deadline`` (time.monotonic()).
+        """
+        entry = self._entry_for(event_type_id, dt, blocking, deadline)
+        if entry is None:
+            return None
+        local_tz = pytz.timezone(self.timezone)
+        with self._lock:
+            epochs = entry["epochs"]
+            index = bisect.bisect_right(epochs, dt.timestamp())
+            if index < len(epochs):
+                slot = datetime.fromtimestamp(epochs[index], pytz.utc)
+                if same_day and slot.astimezone(local_tz).date() != dt.astimezone(local_tz).date():
+                    return None
+                return _to_cal_iso(slot)
+            end = entry["end"]
+        if same_day or not blocking:
+            return None
+        # Nada libre hasta el final de la ventana: se consulta la siguiente
+        following = self._fetch(
+            event_type_id,
+            end + timedelta(days=1),
+            end + timedelta(days=self.window_days),
+            deadline,
+        )
+        if not following:
+            return None
+        return _to_cal_iso(datetime.fromtimestamp(following[0], pytz.utc))
 
-        if response.status_code != 200:
-            logger.error(
-                f"❌ Error consultando disponibilidad: {response.status_code}"
-            )
+    def is_free(self, dt, event_type_id=CAL_EVENT_TYPE_ID, blocking=True):
+        """True/False según la caché, None si no hay datos de disponibilidad"""
+        entry = self._entry_for(event_type_id, dt, blocking)
+        if entry is None:
             return None
+        with self._lock:
+            epochs = entry["epochs"]
+            index = bisect.bisect_left(epochs, dt.timestamp())
+            return index < len(epochs) and epochs[index] == dt.timestamp()
+
+    def record(self, counter):
+        """Incrementa un contador (preflight_checks, preflight_cold, conflicts_avoided, ...)"""
+        with self._lock:
+            self._stats[counter] += 1
+
+    def invalidate_slot(self, dt, event_type_id=CAL_EVENT_TYPE_ID):
+        """Quita un slot recién reservado por nosotros (sin volver a consultar)"""
+        with self._lock:
+            entry = self._entries.get(event_type_id)
+            if entry is None:
+                return False
+            epochs = entry["epochs"]
+            index = bisect.bisect_left(epochs, dt.timestamp())
+            if index < len(epochs) and epochs[index] == dt.timestamp():
+                del epochs[index]
+                self._stats["invalidations"] += 1
+                return True
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "event_types": {
+                    str(event_type_id): {
+                        "slots": len(entry["epochs"]),
+                        "start": entry["start"].isoformat(),
+                        "end": entry["end"].isoformat(),
+                        "age_s": round(time.monotonic() - entry["fetched_at"], 1),
+                    }
+                    for event_type_id, entry in self._entries.items()
+                },
+                "ttl_s": self.ttl,
+                **self._stats,
+            }
 
-        data = response.json()
-        slots = data.get("slots", [])
 
-        # Buscar el primer slot disponible
-        for day_slots in slots:
-            if day_slots.get("available", False):
-                # Devolver el primer slot del día
-                first_slot = day_slots.get("slots", [])[0]
-                if first_slot:
-                    logger.info(f"✅ Próximo slot disponible: {first_slot}")
-                    return first_slot
 
-        logger.warning("⚠️ No se encontraron slots disponibles en los próximos 7 días")
+# ====================================================
+#  CONSULTA API PARA PROXIMA CITA DISPONIBLE
+#  SI EL SLOT SOLICITADO ESTA OCUPADO
+# ====================================================
+@timed_stage("get_next_available_slot")
+def get_next_available_slot(current_iso_date, timezone="America/New_York", deadline=None):
+    """🔍 Siguiente slot libre según el índice de disponibilidad de Cal.com
+
+    ``deadline`` (time.monotonic()) limita las consultas a Cal.com que haga falta.
+    """
+    try:
+        # Convertir ISO a datetime
+        current_dt = datetime.fromisoformat(current_iso_date.replace("Z", "+00:00"))
+
+        # Buscar a partir de 15 min después del slot ocupado
+        next_slot = current_components().availability_index.next_free_after(
+            current_dt + timedelta(minutes=15) - timedelta(seconds=1), deadline=deadline
+        )
+        if next_slot:
+            logger.info(f"✅ Próximo slot disponible: {next_slot}")
+            return next_slot
+
+        logger.warning(
+            f"⚠️ No se encontraron slots disponibles en los próximos {AVAILABILITY_WINDOW_DAYS} días"
+        )
         return None
 
     except Exception as e:
@@ -1569,11 +4870,10 @@ def get_next_available_slot(current_iso_date, timezone="America/New_York"):
 # ==========================================
 #    MANEJO DE MENSAJES DE WHATSAPP
 # ============================================
-@app.route("/webhook/whatsapp", methods=["POST"])
-def whatsapp_webhook():
-    """Webhook de WhatsApp"""
+def process_whatsapp_message(form_data):
+    """Procesa un mensaje de WhatsApp completo (voz o texto) - pipeline del agente"""
+    agent = current_components().agent
     try:
-        form_data = request.form.to_dict()
         from_number = form_data.get("From", "").replace("whatsapp:", "")
         message_body = form_data.get("Body", "").strip()
         media_url = form_data.get("MediaUrl0", "")
@@ -1584,8 +4884,10 @@ def whatsapp_webhook():
         # 🎤 MENSAJE DE AUDIO
         if media_url:
             logger.info(f"🎵 Audio: {media_url}")
-            result = handle_voice_message(media_url, from_number)
-            return jsonify({"status": "success", "message": "Voice message processed"})
+            result = handle_voice_message(
+                media_url, from_number, message_sid=form_data.get("MessageSid")
+            )
+            return {"status": "success", "message": "Voice message processed"}
 
         # ✉️ MENSAJE DE TEXTO
         if message_body:
@@ -1609,9 +4911,7 @@ def whatsapp_webhook():
                 ):
                     error_msg = "❌ Faltan datos requeridos. Necesito nombre, email y fecha."
                     agent.send_whatsapp_message(from_number, error_msg)
-                    return jsonify(
-                        {"status": "error", "message": "Missing required fields"}
-                    )
+                    return {"status": "error", "message": "Missing required fields"}
 
                 booking_result = create_cal_com_booking(
                     name=state.data.get("name"),
@@ -1627,6 +4927,8 @@ def whatsapp_webhook():
                         detected_language,
                         meeting_url=meeting_url,
                     )
+                    if booking_result.get("notice"):
+                        success_message = f"{booking_result['notice']}\n\n{success_message}"
                     agent.send_whatsapp_message(from_number, success_message)
 
                     # Guardar en Google Sheets (opcional)
@@ -1637,11 +4939,11 @@ def whatsapp_webhook():
                         fecha_cita=state.data.get("date", ""),
                         idioma=detected_language,
                         notas=f"Booking ID: {booking_result.get('booking_id')}, Meeting URL: {meeting_url}",
+                        booking_id=booking_result.get("booking_id"),
                     )
 
                     # Limpiar estado
-                    if from_number in agent.conversation_states:
-                        del agent.conversation_states[from_number]
+                    agent.conversation_states.pop(from_number)
                 else:
                     # Mostrar error detallado
                     error_msg = f"❌ {booking_result.get('message', 'Error desconocido')}"
@@ -1660,7 +4962,106 @@ def whatsapp_webhook():
                 if "message" in response_data:
                     agent.send_whatsapp_message(from_number, response_data["message"])
 
-            return jsonify({"status": "success", "message": "Text message processed"})
+            return {"status": "success", "message": "Text message processed"}
+
+        return {"status": "ignored", "message": "Empty message"}
+
+    except Exception as e:
+        logger.error(f"❌ Error general en webhook: {e}", exc_info=True)
+        return {"status": "error", "message": "Internal error", "error": str(e)}
+
+
+def process_claimed_message(form_data, reply_slot=None):
+    """Procesa un mensaje ya reservado y marca su MessageSid como hecho o liberado"""
+    components = current_components()
+    idempotency_store = components.idempotency_store
+    message_sid = form_data.get("MessageSid")
+    from_number = form_data.get("From", "").replace("whatsapp:", "")
+    result = {"status": "error", "message": "Internal error"}
+    components.readiness.begin()
+    try:
+        # 📤 Todo lo que se responda en este ciclo sale como un único mensaje
+        # 📜 y todos los logs del ciclo llevan conversación y MessageSid
+        with LogContext(from_number, message_sid), components.outbound_messenger.cycle(
+            from_number, reply_slot
+        ):
+            result = process_whatsapp_message(form_data)
+        return result
+    finally:
+        components.readiness.end(result.get("status") != "error")
+        if message_sid and idempotency_store is not None:
+            if result.get("status") == "error":
+                idempotency_store.release(message_sid)
+            else:
+                idempotency_store.complete(message_sid)
+
+
+@routes.route("/webhook/whatsapp", methods=["POST"])
+def whatsapp_webhook():
+    """Webhook de WhatsApp - valida, encola y responde al instante (modo queue)"""
+    components = current_components()
+    idempotency_store = components.idempotency_store
+    try:
+        form_data = request.form.to_dict()
+        from_number = form_data.get("From", "").replace("whatsapp:", "").strip()
+        if not from_number:
+            logger.warning("⚠️ Webhook sin remitente (From), ignorado")
+            return jsonify({"status": "error", "message": "Missing From"}), 400
+        if not form_data.get("Body", "").strip() and not form_data.get("MediaUrl0"):
+            return jsonify({"status": "ignored", "message": "Empty message"})
+
+        # 🔑 Reintentos de Twilio (mismo MessageSid): no se vuelve a procesar nada
+        message_sid = form_data.get("MessageSid")
+        if message_sid and idempotency_store is not None:
+            claim = idempotency_store.claim(message_sid)
+            if claim != "new":
+                logger.info(f"♻️ MessageSid {message_sid} duplicado ({claim}), ignorado")
+                if REPLY_MODE == "twiml":
+                    # Twilio espera TwiML: un <Response/> vacío no envía nada
+                    return twiml_response(())
+                return jsonify({"status": "duplicate", "message": f"Already {claim}"})
+
+        # Hasta que process_claimed_message (que libera o completa por su cuenta)
+        # recibe el mensaje, cualquier fallo libera el MessageSid: si no, el
+        # reintento de Twilio se tomaría por duplicado y el mensaje se perdería
+        handed_off = False
+        try:
+            # 💬 Modo TwiML: la respuesta viaja en este mismo HTTP si está a tiempo
+            reply_slot = ReplySlot() if REPLY_MODE == "twiml" else None
+
+            # 🔒 Un mensaje a la vez por remitente, en orden de llegada
+            if WEBHOOK_MODE != "queue":
+                with components.sender_serializer.turn(from_number):
+                    handed_off = True
+                    result = process_claimed_message(form_data, reply_slot)
+                if reply_slot is not None:
+                    return twiml_response(reply_slot.wait(0) or ())
+                return jsonify(result)
+
+            # Los workers de la cola no tienen contexto de Flask: se les pasa la app
+            handed_off = components.job_queue.submit(
+                run_in_app_context,
+                current_app._get_current_object(),
+                process_claimed_message,
+                form_data,
+                reply_slot,
+                key=from_number,
+            )
+            if not handed_off:
+                if message_sid and idempotency_store is not None:
+                    idempotency_store.release(message_sid)
+                components.readiness.record(False)
+                return jsonify({"status": "busy", "message": "Job queue full"}), 503
+
+            if reply_slot is not None:
+                # Si no llega a tiempo, el worker la enviará por REST al terminar
+                return twiml_response(reply_slot.wait(TWIML_REPLY_BUDGET_SECONDS) or ())
+
+            return jsonify({"status": "queued", "message": "Message accepted"})
+        except Exception:
+            if not handed_off and message_sid and idempotency_store is not None:
+                idempotency_store.release(message_sid)
+            raise
 
     except Exception as e:
         logger.error(f"❌ Error general en webhook: {e}", exc_info=True)
@@ -1669,7 +5070,18 @@ def whatsapp_webhook():
         )
 
 
-@app.route("/health", methods=["GET"])
+@routes.route("/webhook/whatsapp/status", methods=["POST"])
+def whatsapp_status_callback():
+    """StatusCallback de Twilio: estado de entrega de los mensajes salientes"""
+    current_components().outbound_messenger.update_delivery(
+        request.form.get("MessageSid", ""),
+        request.form.get("MessageStatus", ""),
+        request.form.get("ErrorCode"),
+    )
+    return "", 204
+
+
+@routes.route("/health", methods=["GET"])
 def health_check():
     """Health check endpoint"""
     return jsonify(
@@ -1689,6 +5101,7 @@ def health_check():
                 "Trial mode support",
                 "Smart time extraction",
                 "Past date validation",
+                "Background job queue",
             ],
             "credentials": {
                 "Twilio": bool(TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN),
@@ -1700,7 +5113,242 @@ def health_check():
     )
 
 
+@routes.route("/ready", methods=["GET"])
+def readiness_check():
+    """🩺 Readiness para el balanceador: 503 si la instancia debe dejar de recibir tráfico"""
+    # Primera llamada: arranca las probes; esta respuesta no espera a ninguna
+    readiness = current_components().readiness
+    readiness.start()
+    snapshot = readiness.snapshot()
+    return jsonify(snapshot), 200 if snapshot["ready"] else 503
+
+
+@routes.route("/stats/bookings", methods=["GET"])
+def booking_stats():
+    """🧾 Trazas de los últimos intentos de reserva en Cal.com"""
+    return jsonify({"traces": list(booking_traces)})
+
+
+@routes.route("/stats/outbound", methods=["GET"])
+def outbound_stats():
+    """📤 Estado de entrega de los últimos mensajes salientes"""
+    return jsonify({"messages": current_components().outbound_messenger.recent()})
+
+
+@routes.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """📈 Métricas en formato de texto de Prometheus"""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@routes.route("/stats", methods=["GET"])
+def stats():
+    """📊 Estadísticas internas (cola de trabajos, workers, pools HTTP, Sheets)"""
+    components = current_components()
+    agent = components.agent
+    idempotency_store = components.idempotency_store
+    transcription_cache = components.transcription_cache
+    return jsonify(
+        {
+            "queue": components.job_queue.stats(),
+            "senders": components.sender_serializer.stats(),
+            "idempotency": idempotency_store.stats() if idempotency_store is not None else None,
+            "outbound": components.outbound_messenger.stats(),
+            "logging": logging_stats(),
+            "http": components.http_transport.stats(),
+            "sheets": agent.sheets_integration.stats(),
+            "conversations": agent.conversation_states.stats(),
+            "availability": components.availability_index.stats(),
+            "transcription_cache": transcription_cache.stats()
+            if transcription_cache
+            else None,
+            "extraction": agent.tiered_extractor.stats(),
+            "extraction_cache": agent.extraction_cache.stats()
+            if agent.extraction_cache
+            else None,
+        }
+    )
+
+
+# ========================================
+# 🍴 SERVIDOR PRE-FORK (GUNICORN)
+# ========================================
+def reinit_after_fork():
+    """Hijo recién creado por fork: hilos, locks y conexiones propios
+
+    Las tablas de solo lectura (plantillas, índice de idiomas, gramática de
+    fechas) se heredan tal cual. Los hilos no sobreviven al fork y los sockets
+    o conexiones SQLite no pueden compartirse, así que se recrean aquí.
+    """
+    global _openai_client
+    if async_logging is not None:
+        async_logging.reset_after_fork()
+    _openai_client = None
+    for components in list(_live_components):
+        components.reset_after_fork()
+    logger.info(f"🍴 Proceso hijo {os.getpid()} reinicializado tras fork")
+
+
+# Cubre gunicorn --preload y cualquier otro servidor que haga fork tras importar
+os.register_at_fork(after_in_child=reinit_after_fork)
+
+
+# ========================================
+# 🔥 CALENTAMIENTO EN SEGUNDO PLANO
+# ========================================
+def warm_up():
+    """Crea por adelantado lo que el primer mensaje crearía bajo demanda"""
+    started = time.monotonic()
+    components = current_components()
+    try:
+        if OPENAI_API_KEY:
+            components.openai()
+        for upstream in HttpTransport.UPSTREAMS:
+            components.http_transport.session(upstream)
+        components.agent.sheets_integration.connect()
+        components.readiness.start()
+    except Exception as e:
+        logger.warning(f"⚠️ Calentamiento incompleto: {e}")
+        return False
+    logger.info(f"🔥 Calentamiento completado en {time.monotonic() - started:.2f}s")
+    return True
+
+
+_warmup_pid = None
+
+
+def start_background_warmup():
+    """Lanza warm_up() en un hilo, una vez por proceso, si WARMUP_MODE=background"""
+    global _warmup_pid
+    if WARMUP_MODE != "background" or _warmup_pid == os.getpid():
+        return False
+    _warmup_pid = os.getpid()
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    return True
+
+
+# ========================================
+# 🏭 FÁBRICA DE LA APLICACIÓN
+# ========================================
+EXTENSION_NAME = "whatsapp_agent"
+
+# Componentes vivos del proceso: reinit_after_fork() los recorre en cada hijo
+_live_components = weakref.WeakSet()
+
+
+class AgentComponents:
+    """🧩 Componentes con estado de una aplicación (clientes, colas, cachés, agente)
+
+    create_app() construye uno por aplicación y lo guarda en ``app.extensions``.
+    Cualquiera se sustituye por nombre (``http_transport=FakeTransport()``, ...);
+    los demás se construyen a partir de la configuración del entorno.
+    """
+
+    NAMES = (
+        "http_transport",
+        "openai_client",
+        "sheets_integration",
+        "outbound_messenger",
+        "agent",
+        "job_queue",
+        "sender_serializer",
+        "idempotency_store",
+        "availability_index",
+        "transcription_cache",
+        "readiness",
+    )
+
+    def __init__(self, **overrides):
+        unknown = sorted(set(overrides) - set(self.NAMES))
+        if unknown:
+            raise TypeError(f"Componentes desconocidos: {', '.join(unknown)}")
+
+        def build(name, factory):
+            return overrides[name] if name in overrides else factory()
+
+        self.http_transport = build("http_transport", HttpTransport)
+        # None: cliente de OpenAI compartido del proceso, creado en el primer uso
+        self.openai_client = overrides.get("openai_client")
+        self.outbound_messenger = build(
+            "outbound_messenger", lambda: OutboundMessenger(self.http_transport)
+        )
+        self.agent = build(
+            "agent",
+            lambda: WhatsAppVoiceAgent(
+                self.outbound_messenger,
+                openai_client=self.openai_client,
+                sheets_integration=overrides.get("sheets_integration"),
+            ),
+        )
+        self.job_queue = build("job_queue", JobQueue)
+        self.sender_serializer = build("sender_serializer", SenderSerializer)
+        self.idempotency_store = build("idempotency_store", build_idempotency_store)
+        self.availability_index = build(
+            "availability_index", lambda: AvailabilityIndex(self.http_transport)
+        )
+        self.transcription_cache = build("transcription_cache", build_transcription_cache)
+        self.readiness = build(
+            "readiness", lambda: ReadinessMonitor(self.job_queue, self.http_transport)
+        )
+        _live_components.add(self)
+
+    def openai(self):
+        """Cliente de OpenAI de esta aplicación (el compartido si no se inyectó uno)"""
+        return self.openai_client if self.openai_client is not None else get_openai_client()
+
+    def reset_after_fork(self):
+        """Hilos, pools y conexiones SQLite propios del proceso hijo"""
+        extraction_cache = self.agent.extraction_cache
+        for component in (
+            self.http_transport,
+            self.job_queue,
+            self.outbound_messenger,
+            self.readiness,
+            self.agent.sheets_integration,
+        ):
+            if hasattr(component, "reset_after_fork"):
+                component.reset_after_fork()
+        for store in (
+            self.idempotency_store,
+            self.transcription_cache.backend if self.transcription_cache else None,
+            extraction_cache.backend if extraction_cache else None,
+        ):
+            if hasattr(store, "reopen"):
+                store.reopen()
+
+
+def current_components():
+    """Componentes de la aplicación activa; fuera de contexto, los de ``app``"""
+    if has_app_context():
+        return current_app.extensions[EXTENSION_NAME]
+    return app.extensions[EXTENSION_NAME]
+
+
+def run_in_app_context(flask_app, func, *args):
+    """Ejecuta ``func`` dentro del contexto de ``flask_app`` (hilos de la cola)"""
+    with flask_app.app_context():
+        return func(*args)
+
+
+def create_app(config=None, **components):
+    """Crea una aplicación Flask con las rutas del agente y sus propios componentes
+
+    ``config`` ajusta la configuración de Flask (``{"TESTING": True}``, ...) y
+    ``components`` sustituye componentes por nombre (ver AgentComponents.NAMES),
+    p. ej. ``create_app(http_transport=fake, openai_client=fake_openai)``.
+    """
+    flask_app = Flask(__name__)
+    flask_app.config.update(config or {})
+    flask_app.extensions[EXTENSION_NAME] = AgentComponents(**components)
+    flask_app.register_blueprint(routes)
+    return flask_app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
+    print_startup_diagnostics()
     print("\n" + "=" * 70)
     print("🤖 WHATSAPP VOICE AGENT - MULTILINGÜE INICIANDO")
     print("=" * 70)
@@ -1712,10 +5360,16 @@ if __name__ == "__main__":
     )
     print(f"🌐 Idiomas soportados: Español, English, Français, Deutsch, Italiano, Português")
     print("=" * 70)
-    print("🚀 Servidor corriendo en http://0.0.0.0:5000   ")
-    print("📡 Webhook: http://localhost:5000/webhook/whatsapp")
-    print("🌐 Health: http://localhost:5000/health")
+    port = int(os.getenv("PORT", 5000))
+    print(f"🚀 Servidor de desarrollo en http://0.0.0.0:{port}")
+    print("🏭 Producción: gunicorn -c gunicorn.conf.py")
+    print(f"📡 Webhook: http://localhost:{port}/webhook/whatsapp")
+    print(f"🌐 Health: http://localhost:{port}/health")
+    print(f"🩺 Ready: http://localhost:{port}/ready")
+    print(f"📊 Stats: http://localhost:{port}/stats")
     print("=" * 70 + "\n")
 
-    app.run(host="0.0.0.0", port=5000, debug=False)
+    # 🔥 El hilo de calentamiento no retrasa el arranque del servidor
+    start_background_warmup()
+    app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
  
\ No newline at end of file
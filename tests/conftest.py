@@ -0,0 +1,21 @@
+"""Fixtures compartidas: el agente se carga con el mismo cargador que los benchmarks"""
+
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_ROOT, "benchmarks")
+
+# _common (cargador de import.py) y _fakes viven junto a los benchmarks
+if BENCH_DIR not in sys.path:
+    sys.path.insert(0, BENCH_DIR)
+
+from _common import load_agent_module  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def agent_module():
+    """Módulo del agente sin red ni ficheros: log a /dev/null y sin calentamiento"""
+    return load_agent_module(LOG_FILE=os.devnull, WARMUP_MODE="off")
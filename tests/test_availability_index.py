@@ -0,0 +1,77 @@
+"""Índice de disponibilidad: ajuste hacia delante y consultas limitadas por el deadline"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from _fakes import FakeTransport
+
+TIMEZONE = "America/New_York"
+
+
+@pytest.fixture
+def index(agent_module):
+    return agent_module.AvailabilityIndex(FakeTransport(timezone=TIMEZONE), timezone=TIMEZONE)
+
+
+def local_slot(days_ahead, hour):
+    tz = pytz.timezone(TIMEZONE)
+    day = datetime.now(tz).date() + timedelta(days=days_ahead)
+    return tz.localize(datetime(day.year, day.month, day.day, hour)).astimezone(pytz.utc)
+
+
+def as_local_hour(iso_slot):
+    slot = datetime.fromisoformat(iso_slot.replace("Z", "+00:00"))
+    return slot.astimezone(pytz.timezone(TIMEZONE)).hour
+
+
+def test_busy_slot_moves_forward_on_the_same_day(index):
+    busy = local_slot(2, 10)
+    assert index.is_free(busy) is True
+    index.invalidate_slot(busy)
+    assert index.is_free(busy) is False
+    snapped = index.next_free_after(busy, blocking=False, same_day=True)
+    assert as_local_hour(snapped) == 11
+
+
+def test_last_slot_of_the_day_is_never_moved_earlier_or_to_the_next_day(index):
+    busy = local_slot(2, 17)
+    assert index.is_free(busy) is True
+    index.invalidate_slot(busy)
+    assert index.next_free_after(busy, blocking=False, same_day=True) is None
+    # Sin límite de día, el siguiente libre es a las 9:00 del día siguiente
+    assert as_local_hour(index.next_free_after(busy)) == 9
+
+
+def test_cold_index_never_blocks(index):
+    assert index.next_free_after(local_slot(2, 10), blocking=False, same_day=True) is None
+    deadline = time.monotonic() + 5
+    while index.stats()["fetches"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.stats()["fetches"] == 1
+
+
+class RecordingTransport(FakeTransport):
+    def __init__(self):
+        super().__init__(timezone=TIMEZONE)
+        self.timeouts = []
+
+    def get(self, upstream, url, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        return super().get(upstream, url, **kwargs)
+
+
+def test_lookup_timeout_is_capped_by_the_deadline(agent_module):
+    transport = RecordingTransport()
+    index = agent_module.AvailabilityIndex(transport, timezone=TIMEZONE)
+    assert index.next_free_after(local_slot(2, 10), deadline=time.monotonic() + 0.5)
+    connect_timeout, read_timeout = transport.timeouts[0]
+    assert connect_timeout <= 0.5 and read_timeout <= 0.5
+
+
+def test_no_lookup_once_the_deadline_has_passed(agent_module):
+    transport = RecordingTransport()
+    index = agent_module.AvailabilityIndex(transport, timezone=TIMEZONE)
+    assert index.next_free_after(local_slot(2, 10), deadline=time.monotonic() - 1) is None
+    assert transport.timeouts == []
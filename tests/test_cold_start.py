@@ -0,0 +1,25 @@
+"""Arranque en frío en un intérprete nuevo: sin red ni SDK de OpenAI al importar
+
+El presupuesto de tiempo se mide en benchmarks/bench_cold_start.py; aquí solo se
+comprueba lo que no depende de la máquina.
+"""
+
+import pytest
+from bench_cold_start import run_round
+
+
+@pytest.fixture(scope="module")
+def cold_start():
+    return run_round()[0]
+
+
+def test_import_opens_no_sockets(cold_start):
+    assert cold_start["connections"] == []
+
+
+def test_openai_sdk_not_imported_at_startup(cold_start):
+    assert cold_start["openai_imported"] is False
+
+
+def test_first_health_check_succeeds(cold_start):
+    assert cold_start["health_status"] == 200
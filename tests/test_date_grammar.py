@@ -0,0 +1,17 @@
+"""Gramática de fechas: el corpus de benchmarks/bench_date_grammar.py como tests"""
+
+import pytest
+from bench_date_grammar import CORPUS, NORMALIZE_CASES, REFERENCE
+
+
+@pytest.mark.parametrize("text, expected", CORPUS, ids=[text for text, _ in CORPUS])
+def test_resolve_date_text(agent_module, text, expected):
+    match = agent_module.resolve_date_text(text, REFERENCE)
+    assert (match.as_text() if match else None) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected", NORMALIZE_CASES, ids=[text for text, _ in NORMALIZE_CASES]
+)
+def test_normalize_zoned_iso(agent_module, text, expected):
+    assert agent_module.normalize_date_to_iso(text) == expected
@@ -0,0 +1,104 @@
+"""Plantillas de respuesta: paridad entre idiomas, render y respaldo de claves"""
+
+import string
+
+import pytest
+
+LANGUAGES = ("es", "en", "fr", "de", "it", "pt")
+
+SAMPLE_VALUES = {
+    "name": "Ana Ruiz",
+    "email": "ana@example.com",
+    "date": "2030-05-14T15:00:00",
+    "meeting_url": "https://cal.example.com/meet/abc",
+    "original_time": "15:00",
+    "new_time": "15:30",
+    "minimum_hours": 1,
+    "requested_time": "2030-05-14 15:00",
+    "suggested_time": "2030-05-14 16:00",
+    "pretty_time": "4:00 PM",
+    "next_available": "2030-05-14 16:15",
+    "user_name": "Ana Ruiz",
+    "user_email": "ana@example.com",
+    "user_date": "mañana a las 3pm",
+    "remaining_fields": "email",
+}
+
+
+def template_fields(template):
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+
+@pytest.fixture(scope="module")
+def responses(agent_module):
+    return agent_module.LanguageResponses()
+
+
+def test_all_languages_present(responses):
+    assert set(responses.language_responses) == set(LANGUAGES)
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_same_keys_as_english(responses, language):
+    assert set(responses.language_responses[language]) == set(
+        responses.language_responses["en"]
+    )
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_same_placeholders_as_english(responses, language):
+    english = responses.language_responses["en"]
+    for key, template in responses.language_responses[language].items():
+        assert template_fields(template) == template_fields(english[key]), key
+
+
+def test_sample_values_cover_every_placeholder(responses):
+    fields = set()
+    for templates in responses.language_responses.values():
+        for template in templates.values():
+            fields |= template_fields(template)
+    assert fields <= set(SAMPLE_VALUES)
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_render_matches_str_format(responses, language):
+    for key, template in responses.language_responses[language].items():
+        assert responses.get_response(key, language, **SAMPLE_VALUES) == template.format(
+            **SAMPLE_VALUES
+        ), key
+
+
+def test_static_template_ignores_extra_kwargs(responses):
+    assert responses.get_response("greeting", "fr", name="Ana") == (
+        responses.language_responses["fr"]["greeting"]
+    )
+
+
+@pytest.mark.parametrize("language", LANGUAGES)
+def test_unknown_key_falls_back_to_generic_response(responses, language):
+    assert responses.get_response("no_such_key", language) == (
+        responses.language_responses[language]["generic_response"]
+    )
+
+
+def test_unknown_language_uses_english(responses):
+    assert responses.get_response("greeting", "xx") == (
+        responses.language_responses["en"]["greeting"]
+    )
+
+
+def test_missing_placeholder_returns_error_message(responses):
+    message = responses.get_response("ask_for_email", "es")
+    assert "{name}" not in message
+    assert message != responses.language_responses["es"]["ask_for_email"]
+
+
+def test_inconsistent_templates_rejected_at_compile_time(agent_module):
+    with pytest.raises(ValueError, match="faltan claves"):
+        agent_module.compile_language_templates(
+            {"en": {"greeting": "Hi", "bye": "Bye"}, "es": {"greeting": "Hola"}}
+        )
+    with pytest.raises(ValueError, match="variables"):
+        agent_module.compile_language_templates(
+            {"en": {"ask": "Hi {name}"}, "es": {"ask": "Hola {nombre}"}}
+        )
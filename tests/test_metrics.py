@@ -0,0 +1,7 @@
+"""/metrics: tipos de Prometheus de los valores calculados al hacer scrape"""
+
+
+def test_dropped_log_records_exported_as_counter(agent_module):
+    text = agent_module.app.test_client().get("/metrics").get_data(as_text=True)
+    assert "# TYPE agent_log_records_dropped_total counter" in text
+    assert "# TYPE agent_log_queue_depth gauge" in text
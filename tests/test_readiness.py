@@ -0,0 +1,35 @@
+"""/ready a través de create_app con componentes falsos (sin red)"""
+
+import pytest
+from _fakes import make_fakes
+
+
+@pytest.fixture
+def app(agent_module):
+    fakes = make_fakes(agent_module.DEFAULT_TIMEZONE)
+    return agent_module.create_app({"TESTING": True}, **fakes.components)
+
+
+def test_ready_with_injected_transport(app):
+    response = app.test_client().get("/ready")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["ready"] is True
+    # FakeTransport no expone sus pools: se informan como desconocidos
+    assert body["pools"] is None
+
+
+def test_probes_go_through_the_injected_transport(app, agent_module):
+    readiness = app.extensions[agent_module.EXTENSION_NAME].readiness
+    readiness.run_probes()
+    assert readiness.snapshot()["upstreams"]
+    assert all(result["ok"] for result in readiness.snapshot()["upstreams"].values())
+
+
+def test_not_ready_when_recent_messages_fail(app, agent_module):
+    readiness = app.extensions[agent_module.EXTENSION_NAME].readiness
+    for _ in range(agent_module.READY_MIN_SAMPLES):
+        readiness.record(False)
+    response = app.test_client().get("/ready")
+    assert response.status_code == 503
+    assert any(reason.startswith("error_rate") for reason in response.get_json()["reasons"])
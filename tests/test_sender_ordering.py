@@ -0,0 +1,36 @@
+"""Orden por remitente en modo queue (JobQueue) y sync (SenderSerializer)
+
+Versión reducida de benchmarks/stress_sender_ordering.py: varios hilos golpean
+el mismo número mientras otros remitentes envían en paralelo.
+"""
+
+import pytest
+from stress_sender_ordering import HOT_NUMBER, run_queue_mode, run_sync_mode
+
+THREADS = 4
+MESSAGES = 10
+
+MODES = {"queue": run_queue_mode, "sync": run_sync_mode}
+
+
+@pytest.fixture(scope="module", params=sorted(MODES))
+def recorder(request, agent_module):
+    return MODES[request.param](agent_module, THREADS, MESSAGES)
+
+
+def test_every_message_is_processed(recorder):
+    assert len(recorder.processed[HOT_NUMBER]) == THREADS * MESSAGES
+    assert sum(len(order) for order in recorder.processed.values()) == 2 * THREADS * MESSAGES
+
+
+def test_one_message_at_a_time_per_sender(recorder):
+    assert recorder.max_running_per_sender == 1
+
+
+def test_messages_processed_in_arrival_order(recorder):
+    for sender, order in recorder.processed.items():
+        assert order == recorder.arrivals[sender], sender
+
+
+def test_different_senders_run_in_parallel(recorder):
+    assert recorder.max_global_running >= 2
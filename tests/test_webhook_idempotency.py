@@ -0,0 +1,39 @@
+"""Webhook: un fallo antes de procesar el mensaje no deja el MessageSid reservado"""
+
+import pytest
+from _fakes import make_fakes
+
+
+class BrokenSerializer:
+    def turn(self, key):
+        raise RuntimeError("serializer roto")
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def fakes(agent_module):
+    return make_fakes(agent_module.DEFAULT_TIMEZONE)
+
+
+def post_message(client, sid):
+    return client.post(
+        "/webhook/whatsapp",
+        data={"From": "whatsapp:+15550001234", "Body": "Hola", "MessageSid": sid},
+    )
+
+
+def test_claim_released_when_dispatch_fails(agent_module, fakes):
+    app = agent_module.create_app(sender_serializer=BrokenSerializer(), **fakes.components)
+    store = app.extensions[agent_module.EXTENSION_NAME].idempotency_store
+    response = post_message(app.test_client(), "SMbroken")
+    assert response.get_json()["status"] == "error"
+    # El reintento de Twilio vuelve a reclamar el mensaje en lugar de ignorarlo
+    assert store.claim("SMbroken") == "new"
+
+
+def test_duplicate_ignored_after_successful_processing(agent_module, fakes):
+    client = agent_module.create_app(**fakes.components).test_client()
+    assert post_message(client, "SMonce").get_json()["status"] == "success"
+    assert post_message(client, "SMonce").get_json()["status"] == "duplicate"